@@ -0,0 +1,104 @@
+from collections import OrderedDict
+import operator
+import queue
+import threading
+
+
+def execute_in_order(execute_fn, state, inputs):
+    """Run inputs through execute_fn one after another, returning the new
+    state and the outputs"""
+    outputs = []
+    for input_value in inputs:
+        state, output = execute_fn(state, input_value)
+        outputs.append(output)
+    return state, outputs
+
+
+class Applier(object):
+    """Runs a replica's state machine: submit(fn, callback) calls fn after
+    everything submitted before it, and passes the result to callback on the
+    network's thread.  This one calls fn straight away."""
+
+    def __init__(self, node):
+        self.node = node
+
+    def submit(self, fn, callback):
+        callback(fn())
+
+    def execute(self, execute_fn, state, inputs):
+        """Run inputs through execute_fn, returning the new state and the outputs"""
+        return execute_in_order(execute_fn, state, inputs)
+
+    def stop(self):
+        pass
+
+
+class ThreadedApplier(Applier):
+    """Runs the state machine on a worker thread, so that a slow execute_fn
+    doesn't hold up message handling, and with it consensus, on the node.
+    Results come back through network.call_soon, which is thread-safe in
+    both Network and AsyncioNetwork."""
+
+    def __init__(self, node):
+        super(ThreadedApplier, self).__init__(node)
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, callback):
+        self.jobs.put((fn, callback))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            fn, callback = job
+            try:
+                result = fn()
+            except Exception as e:
+                # raise it on the network's thread, as Applier would have,
+                # rather than dying here and leaving later jobs waiting
+                self.node.network.call_soon(self.fail, e)
+            else:
+                self.node.network.call_soon(callback, result)
+
+    def fail(self, exception):
+        raise exception
+
+    def stop(self):
+        self.jobs.put(None)
+
+
+class PartitionedApplier(ThreadedApplier):
+    """A ThreadedApplier for dict states, like run.py's key-value store, that
+    applies each slot's requests for different keys in parallel on executor
+    (a concurrent.futures pool).  key_fn gives the one key of the state each
+    input reads or writes.  Requests for the same key keep their order and
+    different keys commute, so every replica still ends up with the same
+    state and outputs."""
+
+    def __init__(self, node, executor, key_fn=operator.itemgetter(1)):
+        super(PartitionedApplier, self).__init__(node)
+        self.executor = executor
+        self.key_fn = key_fn
+
+    def execute(self, execute_fn, state, inputs):
+        partitions = OrderedDict()  # {key: [index of input]}
+        for i, input_value in enumerate(inputs):
+            partitions.setdefault(self.key_fn(input_value), []).append(i)
+        if len(partitions) < 2:
+            return super(PartitionedApplier, self).execute(execute_fn, state, inputs)
+        futures = [(key, indexes, self.executor.submit(
+                        execute_in_order, execute_fn,
+                        {key: state[key]} if key in state else {},
+                        [inputs[i] for i in indexes]))
+                   for key, indexes in partitions.items()]
+        outputs = [None] * len(inputs)
+        for key, indexes, future in futures:
+            part, part_outputs = future.result()
+            state.pop(key, None)
+            state.update(part)
+            for i, output in zip(indexes, part_outputs):
+                outputs[i] = output
+        return state, outputs
@@ -0,0 +1,117 @@
+import asyncio
+import functools
+import pickle
+import random
+import socket
+import threading
+
+from cluster import Node, Timer, freeze
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, network, node):
+        self.network = network
+        self.node = node
+
+    def datagram_received(self, data, addr):
+        try:
+            sender, message = pickle.loads(data)
+        except Exception:
+            self.node.logger.warning("dropping undecodable datagram from %s", addr)
+            return
+        if self.node.address in self.network.nodes:
+            self.node.receive(sender, message)
+
+
+class AsyncioNetwork(object):
+    """A drop-in replacement for Network that delivers messages over UDP on
+    an asyncio event loop, so nodes can run in separate processes.
+
+    ``addresses`` maps every cluster address to a ``(host, port)`` pair, and
+    ``local`` lists the addresses hosted by this process (default: all of
+    them).  Messages are pickled, so each one must fit in a single datagram."""
+
+    def __init__(self, addresses, local=None):
+        self.addresses = dict(addresses)
+        self.local = list(local or sorted(self.addresses))
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = None
+        self.nodes = {}
+        self.sockets = {}
+        self.transports = []
+        self.rnd = random.Random()
+
+    @property
+    def now(self):
+        return self.loop.time()
+
+    def new_node(self, address=None):
+        address = address or next(a for a in self.local if a not in self.nodes)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(self.addresses[address])
+        sock.setblocking(False)
+        # binding to port 0 picks a free port; publish the real one
+        self.addresses[address] = sock.getsockname()
+        self.sockets[address] = sock
+        node = Node(self, address=address)
+        self.nodes[address] = node
+        self.call_soon(self.listen, node)
+        return node
+
+    def listen(self, node):
+        endpoint = self.loop.create_datagram_endpoint(
+            functools.partial(DatagramProtocol, self, node), sock=self.sockets[node.address])
+        self.loop.create_task(endpoint).add_done_callback(
+            lambda task: self.transports.append(task.result()[0]))
+
+    def call_soon(self, callback, *args):
+        """Run callback on the event loop, safely from any thread; on the
+        loop's own thread, run it straight away"""
+        if threading.get_ident() == self.loop_thread:
+            callback(*args)
+        else:
+            # queued until the loop runs, if it hasn't started yet
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def run(self):
+        self.loop_thread = threading.get_ident()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            for transport in self.transports:
+                transport.close()
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+
+    def stop(self):
+        self.call_soon(self.loop.stop)
+
+    def set_timer(self, address, seconds, callback):
+        timer = Timer(self.now + seconds, address, callback)
+        self.call_soon(self.loop.call_at, timer.expires, self.fire, timer)
+        return timer
+
+    def fire(self, timer):
+        if timer.cancelled:
+            return
+        if not timer.address or timer.address in self.nodes:
+            timer.callback()
+
+    def send(self, sender, destinations, message):
+        sender.logger.debug("sending %s to %s", message, destinations)
+        # freeze and encode once; local delivery shares the frozen copy, as in
+        # Network, and remote recipients unpickle read-only copies of it
+        message = freeze(message)
+        data = pickle.dumps((sender.address, message), pickle.HIGHEST_PROTOCOL)
+        for dest in destinations:
+            if dest == sender.address:
+                self.set_timer(sender.address, 0, functools.partial(
+                    sender.receive, sender.address, message))
+            elif dest in self.addresses:
+                try:
+                    self.sockets[sender.address].sendto(data, self.addresses[dest])
+                except OSError as e:
+                    # a lost datagram is just another dropped message
+                    sender.logger.warning("dropping message to %s: %s", dest, e)
@@ -0,0 +1,95 @@
+from cluster import Bootstrap, Leader, Network, Requester, Seed
+import functools
+import sys
+
+START = 1.0  # when every node starts sending requests, all at once
+INTERVAL = 0.2  # between requests from each node
+KILL = 10.0  # when the leader dies
+END = 20.0
+
+class TimedLeader(Leader):
+    """A Leader that records when it is adopted and preempted"""
+
+    def __init__(self, node, peers, events, **kwargs):
+        super(TimedLeader, self).__init__(node, peers, **kwargs)
+        self.events = events
+
+    def do_Adopted(self, sender, ballot_num, accepted_proposals):
+        super(TimedLeader, self).do_Adopted(sender, ballot_num, accepted_proposals)
+        self.events.append((self.node.network.now, self.node.address, 'adopted'))
+
+    def do_Preempted(self, sender, slots, preempted_by):
+        super(TimedLeader, self).do_Preempted(sender, slots, preempted_by)
+        self.events.append((self.node.network.now, self.node.address, 'preempted'))
+
+def settle(events, start, end):
+    """Return (seconds from start until a leader was adopted that stayed so
+    until end, or None if none did; preemptions in between)"""
+    period = [e for e in events if start <= e[0] < end]
+    preemptions = sum(1 for e in period if e[2] == 'preempted')
+    adoptions = [e for e in period if e[2] == 'adopted']
+    if not adoptions:
+        return None, preemptions
+    adopted_at, leader, _ = adoptions[-1]
+    if any(e[1] == leader and e[2] == 'preempted' and e[0] > adopted_at for e in period):
+        return None, preemptions
+    return adopted_at - start, preemptions
+
+def run(seed, count):
+    network = Network(seed)
+    start = network.now
+    events = []
+    bootstrap_cls = functools.partial(
+        Bootstrap, leader_cls=functools.partial(TimedLeader, events=events))
+    peers = ['N%d' % i for i in range(count)]
+    nodes = [network.new_node(address=p) for p in peers]
+    Seed(nodes[0], initial_state=0, peers=peers, execute_fn=lambda state, n: (state + n, state + n),
+         bootstrap_cls=bootstrap_cls)
+    for node in nodes[1:]:
+        bootstrap_cls(node, execute_fn=lambda state, n: (state + n, state + n), peers=peers).start()
+
+    # every node starts a request every INTERVAL, so every replica
+    # proposes, and scouts for its own leader until it hears of another;
+    # elections only start when there is something to propose
+    def request(node):
+        if node.address in network.nodes:
+            Requester(node, 1, lambda output: None).start()
+            network.set_timer(None, INTERVAL, functools.partial(request, node))
+    for node in nodes:
+        network.set_timer(None, START, functools.partial(request, node))
+
+    # a deposed leader stays active until it next hears from the acceptors,
+    # so kill the one with the highest ballot
+    def kill_leader():
+        leaders = [r for node in nodes for r in node.roles if isinstance(r, Leader) and r.active]
+        if leaders:
+            del network.nodes[max(leaders, key=lambda r: r.ballot_num).node.address]
+    network.set_timer(None, KILL, kill_leader)
+    network.set_timer(None, END, network.stop)
+    network.run()
+    return settle(events, start + START, start + KILL), settle(events, start + KILL, start + END)
+
+def summarize(results):
+    times = sorted(t for t, _ in results if t is not None)
+    unsettled = len(results) - len(times)
+    if not times:
+        return "%8s %8s %8s %9d" % ('-', '-', '-', unsettled)
+    return "%8.3f %8.3f %8.2f %9d" % (times[len(times) // 2], times[-1],
+                                     sum(p for _, p in results) / float(len(results)), unsettled)
+
+def main():
+    """usage: bench_election.py [<runs>] [<nodes>]
+
+    Simulate elections under contention: every node starts sending requests
+    at once, so every node scouts, and later the leader dies.  For each,
+    report the time until a leader was adopted that then stayed adopted,
+    the preemptions on the way, and the runs that never settled."""
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    results = [run(seed, count) for seed in range(runs)]
+    print("%-9s %8s %8s %8s %9s" % ("", "median", "max", "preempt", "unsettled"))
+    print("%-9s %s" % ("startup", summarize([r[0] for r in results])))
+    print("%-9s %s" % ("failover", summarize([r[1] for r in results])))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from cluster import Bootstrap, Network, Requester, Seed
+from links import Bandwidth, HeavyTailed, Topology
+from unittest import mock
+import cluster
+import sys
+
+START = 2.0  # when the requests start, once the cluster is up
+END = 12.0
+PEERS = ['N%d' % i for i in range(5)]
+# two replicas in each of two regions, and a fifth further away
+REGIONS = dict(zip(PEERS, ['us', 'us', 'eu', 'eu', 'ap']))
+ROUTES = {('us', 'eu'): 0.04, ('us', 'ap'): 0.08, ('eu', 'ap'): 0.12}
+BANDWIDTH = 1000000  # bytes per second out of each node
+CONFIGS = [
+    ("unbatched", dict(INVOKE_BATCH_SIZE=1, ACCEPT_BATCH_SIZE=1, THRIFTY=False)),
+    ("batched", dict(THRIFTY=False)),
+    ("unbatched thrifty", dict(INVOKE_BATCH_SIZE=1, ACCEPT_BATCH_SIZE=1, THRIFTY=True)),
+    ("batched thrifty", dict(THRIFTY=True)),
+]
+
+class Metered(Bandwidth):
+    """Bandwidth that counts the bytes each node sends"""
+
+    def __init__(self, link, bandwidth):
+        super(Metered, self).__init__(link, bandwidth)
+        self.bytes_sent = {}
+
+    def transit(self, network, sender, dest, message):
+        delay = super(Metered, self).transit(network, sender, dest, message)
+        # Bandwidth has just sized the message, once for all of a broadcast
+        self.bytes_sent[sender] = self.bytes_sent.get(sender, 0) + self.sized[1]
+        return delay
+
+def run(seed, rate, alpha):
+    """Send rate requests per second, spread over the replicas, and return
+    (the latencies of those answered, bytes sent by the busiest node)"""
+    routes = dict((pair, HeavyTailed(delay, alpha=alpha, drop=0.01))
+                  for pair, delay in ROUTES.items())
+    link = Metered(Topology(REGIONS, routes), BANDWIDTH)
+    network = Network(seed, link=link)
+    nodes = [network.new_node(address=p) for p in PEERS]
+    add = lambda state, n: (state + n, state + n)
+    Seed(nodes[0], initial_state=0, peers=PEERS, execute_fn=add)
+    for node in nodes[1:]:
+        Bootstrap(node, execute_fn=add, peers=PEERS).start()
+
+    latencies = []
+    def request(node):
+        sent = network.now
+        Requester(node, 1, lambda output: latencies.append(network.now - sent)).start()
+    for i in range(int((END - START) * rate)):
+        network.set_timer(None, START + float(i) / rate,
+                          lambda node=nodes[i % len(nodes)]: request(node))
+    network.set_timer(None, END, network.stop)
+    network.run()
+    return sorted(latencies), max(link.bytes_sent.values())
+
+def main():
+    """usage: bench_links.py [<requests per second>] [<alpha>] [<runs>]
+
+    Predict how batching and thrifty quorums perform on a wide-area
+    network: five replicas over three regions, heavy-tailed links (Pareto
+    index alpha) losing 1% of messages, and each node sending at most
+    BANDWIDTH.  For each configuration, report the requests answered and
+    their latency, and the traffic from the busiest node."""
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 200
+    alpha = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    total = int((END - START) * rate) * runs
+    print("%-18s %9s %8s %8s %8s %10s" % ("", "answered", "median", "p99", "max", "MB/node"))
+    for name, config in CONFIGS:
+        with mock.patch.multiple(cluster, **config):
+            results = [run(seed, rate, alpha) for seed in range(runs)]
+        latencies = sorted(l for r in results for l in r[0])
+        print("%-18s %8.1f%% %8.3f %8.3f %8.3f %10.2f" % (
+            name, 100.0 * len(latencies) / total, latencies[len(latencies) // 2],
+            latencies[len(latencies) * 99 // 100], latencies[-1],
+            max(r[1] for r in results) / 1e6))
+
+if __name__ == "__main__":
+    main()
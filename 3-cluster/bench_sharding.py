@@ -0,0 +1,71 @@
+from cluster import Member, Network, Requester
+from links import Bandwidth, Uniform
+from run import key_value_state_machine
+from sharding import Router
+import sys
+
+START = 3.0  # when the requests start, once every group has formed
+END = 13.0
+PEERS = ['N%d' % i for i in range(5)]
+KEYS = ['k%02d' % n for n in range(12)]
+BANDWIDTH = 100000  # bytes per second out of each node, shared by its groups
+WINDOW = 400  # requests outstanding at once, from N0
+GROUPS = [1, 2, 3, 5]
+
+class HostBandwidth(Bandwidth):
+    """Bandwidth shared by all the groups on a node: their addresses,
+    '<node>/<group>', queue behind each other"""
+
+    def transit(self, network, sender, dest, message):
+        return super(HostBandwidth, self).transit(network, sender.split('/')[0],
+                                                  dest.split('/')[0], message)
+
+def unplaced(*args, **kwargs):
+    """A Member without a preferred leader, as Router built them before"""
+    kwargs.pop('leader')
+    return Member(*args, **kwargs)
+
+def run(seed, groups, member_cls=Member):
+    """Keep WINDOW requests outstanding from N0, spread over the keys, and
+    return how many are answered per second between START and END"""
+    network = Network(seed, link=HostBandwidth(Uniform(drop=0.01), BANDWIDTH))
+    split_keys = [KEYS[g * len(KEYS) // groups] for g in range(1, groups)]
+    routers = [Router(key_value_state_machine, network, PEERS, p, split_keys,
+                      seed={} if p == PEERS[0] else None, member_cls=member_cls)
+               for p in PEERS]
+    for router in routers:
+        for member in router.members:
+            member.startup_role.start()
+
+    router = routers[0]
+    answered = []
+    def request(n):
+        input_value = ('set', KEYS[n % len(KEYS)], n)
+        node = router.members[router.group(input_value)].node
+        Requester(node, input_value, lambda output: done(n)).start()
+    def done(n):
+        answered.append(network.now)
+        request(n + WINDOW)
+    for n in range(WINDOW):
+        network.set_timer(None, START, lambda n=n: request(n))
+    network.set_timer(None, END, network.stop)
+    network.run()
+    return len([t for t in answered if t >= START + 1]) / (END - START - 1)
+
+def main():
+    """usage: bench_sharding.py [<runs>]
+
+    Predict how splitting the keys between Paxos groups scales on five
+    nodes that can each send BANDWIDTH, with WINDOW requests outstanding:
+    the requests answered per second for each number of GROUPS, with their
+    preferred leaders spread over the nodes, and with every group led from
+    the node that sends the requests, as happens when none is preferred."""
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print("%-8s %10s %10s" % ("groups", "spread", "unplaced"))
+    for groups in GROUPS:
+        spread = sum(run(seed, groups) for seed in range(runs)) / runs
+        together = sum(run(seed, groups, unplaced) for seed in range(runs)) / runs
+        print("%-8d %10.1f %10.1f" % (groups, spread, together))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+from cluster import Ballot, Proposal
+from wal import WriteAheadLog
+import os
+import sys
+import tempfile
+import time
+
+def bench(path, batch_size, records):
+    """Append records in batches of batch_size, syncing after each batch, and
+    return (records per second, mean seconds from first append to durable)"""
+    wal = WriteAheadLog(path)
+    ballot = Ballot(1, 'N0')
+    latencies = []
+    started = time.time()
+    for first in range(0, records, batch_size):
+        t = time.time()
+        for slot in range(first, first + batch_size):
+            wal.append(('accept', slot, ballot, Proposal('N1', slot, ('set', 'k', slot))))
+        wal.sync()
+        latencies.append(time.time() - t)
+    elapsed = time.time() - started
+    wal.close()
+    os.unlink(path)
+    return records / elapsed, sum(latencies) / len(latencies)
+
+def main():
+    """usage: bench_wal.py [<records>] [<directory>]
+
+    Measure how group-commit batch size trades appends per second against
+    the latency a reply waits for its fsync."""
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    directory = sys.argv[2] if len(sys.argv) > 2 else None
+    print("%6s %12s %14s" % ("batch", "records/s", "latency (ms)"))
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        batch_size = 1
+        while batch_size <= 512:
+            rate, latency = bench(os.path.join(tmp, 'acceptor.wal'), batch_size, records)
+            print("%6d %12.0f %14.3f" % (batch_size, rate, latency * 1000))
+            batch_size *= 2
+
+if __name__ == "__main__":
+    main()
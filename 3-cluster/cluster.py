@@ -1,44 +1,155 @@
-from collections import namedtuple
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import Future
 import copy
 import functools
 import heapq
 import itertools
 import logging
-from queue  import Queue
 import random
 import threading
 
+from applier import Applier
+from roundtrip import RoundTripTime, RoundTripTimes, backoff
+
 # data types
 Proposal = namedtuple('Proposal', ['caller', 'client_id', 'input'])
 Ballot = namedtuple('Ballot', ['n', 'leader'])
+Snapshot = namedtuple('Snapshot', ['slot', 'state', 'sessions'])
+Batch = namedtuple('Batch', ['proposals'])  # several client requests sharing a slot
+Outstanding = namedtuple('Outstanding', ['message', 'callback', 'timer', 'sent_at', 'retransmits'])
+InFlight = namedtuple('InFlight', ['ballot_num', 'proposals', 'acceptors', 'sent_at', 'retransmits',
+                                   'sent_to', 'due'])
 
 # message types
-Accepted = namedtuple('Accepted', ['slot', 'ballot_num'])
-Accept = namedtuple('Accept', ['slot', 'ballot_num', 'proposal'])
+Accepted = namedtuple('Accepted', ['slots', 'ballot_num'])
+Accept = namedtuple('Accept', ['ballot_num', 'proposals'])
 Decision = namedtuple('Decision', ['slot', 'proposal'])
+Relay = namedtuple('Relay', ['decisions', 'relay_to'])  # {slot: proposal}, to apply and pass on
 Invoked = namedtuple('Invoked', ['client_id', 'output'])
 Invoke = namedtuple('Invoke', ['caller', 'client_id', 'input_value'])
+Read = namedtuple('Read', ['caller', 'client_id', 'input_value'])
 Join = namedtuple('Join', [])
-Active = namedtuple('Active', [])
-Prepare = namedtuple('Prepare', ['ballot_num'])
+Active = namedtuple('Active', ['ballot_num', 'lease_start', 'rto'])
+LeaseGranted = namedtuple('LeaseGranted', ['ballot_num', 'lease_start'])
+Lease = namedtuple('Lease', ['expires', 'slot'])
+Prepare = namedtuple('Prepare', ['ballot_num', 'slot'])
+PreVote = namedtuple('PreVote', ['ballot_num'])
+PreVoted = namedtuple('PreVoted', ['requested', 'ballot_num', 'granted'])
 Promise = namedtuple('Promise', ['ballot_num', 'accepted_proposals'])
 Propose = namedtuple('Propose', ['slot', 'proposal'])
-Welcome = namedtuple('Welcome', ['state', 'slot', 'decisions'])
-Decided = namedtuple('Decided', ['slot'])
-Preempted = namedtuple('Preempted', ['slot', 'preempted_by'])
+Welcome = namedtuple('Welcome', ['state', 'slot', 'decisions', 'sessions'])
+Decided = namedtuple('Decided', ['slots'])
+Preempted = namedtuple('Preempted', ['slots', 'preempted_by'])
 Adopted = namedtuple('Adopted', ['ballot_num', 'accepted_proposals'])
 Accepting = namedtuple('Accepting', ['leader'])
-
-# constants - these times should really be in terms of average round-trip time
+Executed = namedtuple('Executed', ['slot'])
+Compact = namedtuple('Compact', ['slot'])
+Catchup = namedtuple('Catchup', ['slot', 'count'])
+CaughtUp = namedtuple('CaughtUp', ['decisions'])
+Learn = namedtuple('Learn', ['slot', 'sent_at'])
+Progress = namedtuple('Progress', ['slot', 'sent_at'])
+
+# constants - the retransmit times are only used until there are round-trip
+# times to derive them from (see RoundTripTimes), and LEADER_TIMEOUT is
+# stretched by the leader's retransmit timeout
 JOIN_RETRANSMIT = 0.7
-CATCHUP_INTERVAL = 0.6
+CATCHUP_INTERVAL = 0.6  # how often a replica checks whether it has fallen behind
+CATCHUP_CHUNK = 100  # decided slots asked of a peer in one CATCHUP
+CATCHUP_WINDOW = 4  # CATCHUPs a replica has outstanding at once
 ACCEPT_RETRANSMIT = 1.0
+ACCEPT_BATCH_WINDOW = 0.01  # how long the leader gathers proposals into one ACCEPT
+ACCEPT_BATCH_SIZE = 100
+WAL_SYNC_DELAY = 0.002  # how long an acceptor gathers log appends into one fsync
 PREPARE_RETRANSMIT = 1.0
+PRE_VOTE = True  # scouts check a quorum would promise before raising any acceptor's ballot
 INVOKE_RETRANSMIT = 0.5
+INVOKE_WINDOW = 1000  # requests a Member will have outstanding at once
+INVOKE_BATCH_WINDOW = 0.005  # how long a replica gathers requests into one proposal
+INVOKE_BATCH_SIZE = 50
 LEADER_TIMEOUT = 1.0
+LEASE_DURATION = LEADER_TIMEOUT  # how long a granted lease keeps other leaders out
+THRIFTY = False  # send ACCEPT and PREPARE to the fastest quorum, widening on retransmit
+PHASE1_QUORUM = None  # acceptors a scout needs promises from (None: a majority)
+PHASE2_QUORUM = None  # acceptors that decide a slot by accepting it (None: a majority)
+DECISION_RELAYS = 0  # peers the leader's decisions fan out through (0: sent to every peer)
+SESSION_LIMIT = 10000  # finished client requests remembered for duplicate detection
+SNAPSHOT_INTERVAL = 100  # slots executed between state-machine snapshots
+LEARNER_TIMEOUT = 2.0  # feeds drop learners, and learners feeds, unheard from this long
 NULL_BALLOT = Ballot(-1, -1)  # sorts before all real ballots
 NOOP_PROPOSAL = Proposal(None, None, None)  # no-op to fill otherwise empty slots
 
+def _immutable(self, *args, **kwargs):
+    raise TypeError("%s is read-only" % type(self).__name__)
+
+class FrozenDict(dict):
+    """A dict that refuses to change; see freeze()"""
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+class FrozenList(list):
+    """A list that refuses to change; see freeze()"""
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = clear = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+
+class FrozenSet(set):
+    """A set that refuses to change; see freeze()"""
+
+    __iand__ = __ior__ = __isub__ = __ixor__ = _immutable
+    add = clear = discard = pop = remove = update = _immutable
+    difference_update = intersection_update = symmetric_difference_update = _immutable
+
+    def __reduce__(self):
+        return (FrozenSet, (list(self),))
+
+IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None), frozenset,
+                   FrozenDict, FrozenList, FrozenSet)
+THAWED_TYPES = {FrozenDict: dict, FrozenList: list, FrozenSet: set}
+
+def freeze(value):
+    """Return a read-only copy of a message payload that every recipient can
+    share: dicts, lists and sets become FrozenDicts, FrozenLists and
+    FrozenSets, so accidental mutation by a receiver raises TypeError."""
+    if isinstance(value, IMMUTABLE_TYPES):
+        return value
+    if isinstance(value, tuple):
+        if hasattr(value, '_fields'):  # namedtuple
+            return type(value)._make(freeze(v) for v in value)
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    if isinstance(value, set):
+        return FrozenSet(value)
+    return copy.deepcopy(value)
+
+def unbatch(proposal):
+    """The client requests decided in a slot"""
+    return proposal.proposals if isinstance(proposal, Batch) else (proposal,)
+
+def thaw(value):
+    """Return a private, mutable copy of a frozen payload, for recipients that
+    take ownership of it: each FrozenDict, FrozenList and FrozenSet in it
+    becomes the dict, list or set it was frozen from."""
+    if type(value) in THAWED_TYPES:
+        if isinstance(value, dict):
+            return dict((k, thaw(v)) for k, v in value.items())
+        return THAWED_TYPES[type(value)](thaw(v) for v in value)
+    if isinstance(value, tuple) and not isinstance(value, IMMUTABLE_TYPES):
+        thawed = [thaw(v) for v in value]
+        if all(t is v for t, v in zip(thawed, value)):
+            return value
+        return type(value)._make(thawed) if hasattr(value, '_fields') else tuple(thawed)
+    return value
+
 class Node(object):
     unique_ids = itertools.count()
 
@@ -48,50 +159,78 @@ class Node(object):
         self.logger = SimTimeLogger(logging.getLogger(self.address), {'network': self.network})
         self.logger.info('starting')
         self.roles = []
+        self.rtt = RoundTripTimes()
+        # a request's round trip covers a whole consensus round rather than
+        # an exchange with any one peer, so it is estimated apart
+        self.request_rtt = RoundTripTime()
+        self.client = None  # the Client role, once this node sends requests
+        # {message type name: (bound do_<name> handlers, in registration order)}
+        self.handlers = {}
         self.send = functools.partial(self.network.send, self)
 
     def register(self, roles):
         self.roles.append(roles)
+        for name in handler_names(type(roles)):
+            self.handlers[name] = self.handlers.get(name, ()) + (getattr(roles, 'do_' + name),)
 
     def unregister(self, roles):
         self.roles.remove(roles)
+        for name in handler_names(type(roles)):
+            self.handlers[name] = tuple(fn for fn in self.handlers[name] if fn.__self__ is not roles)
 
     def receive(self, sender, message):
-        handler_name = f'do_{type(message).__name__}' 
-
-        for comp in self.roles[:]:
-            if not hasattr(comp, handler_name):
-                continue
-            comp.logger.debug(f"received {message} from {sender}")
-            fn = getattr(comp, handler_name)
-            fn(sender=sender, **message._asdict())
+        # (un)registering replaces the tuple rather than changing it, so roles
+        # coming and going in a handler don't disturb this loop; handlers take
+        # the message fields positionally, in the order they are declared
+        for fn in self.handlers.get(type(message).__name__, ()):
+            fn.__self__.logger.debug("received %s from %s", message, sender)
+            fn(sender, *message)
+
+@functools.lru_cache(maxsize=None)
+def handler_names(role_cls):
+    """The message type names that role_cls has do_<name> handlers for"""
+    return tuple(name[3:] for name in dir(role_cls) if name.startswith('do_'))
 
 class Timer(object):
+    sequence = itertools.count()
 
-    def __init__(self, expires, address, callback):
+    def __init__(self, expires, address, callback, on_cancel=None):
         self.expires = expires
         self.address = address
         self.callback = callback
         self.cancelled = False
+        # timers expiring together fire in the order they were set
+        self.seq = next(self.sequence)
+        self.on_cancel = on_cancel
 
     #def __cmp__(self, other):
     #    return cmp(self.expires, other.expires)
     def __lt__(self, other):
-        return self.expires < other.expires
+        return (self.expires, self.seq) < (other.expires, other.seq)
 
     def cancel(self):
-        self.cancelled = True
+        if not self.cancelled:
+            self.cancelled = True
+            if self.on_cancel:
+                self.on_cancel()
 
 class Network(object):
     PROP_DELAY = 0.03
     PROP_JITTER = 0.02
     DROP_PROB = 0.05
 
-    def __init__(self, seed):
+    def __init__(self, seed, link=None):
         self.nodes = {}
         self.rnd = random.Random(seed)
+        self.link = link  # models every link (see links.py); by default, the constants above
         self.timers = []
+        self.cancelled_timers = 0  # still in self.timers
         self.now = 1000.0
+        # callbacks from other threads (see call_soon), moved onto the timer
+        # heap by run(), so that only the network's own thread touches it; a
+        # deque's append and popleft are atomic, and checking it is empty,
+        # as run() does before every event, needs no lock
+        self.pending = deque()
 
     def new_node(self, address=None):
         node = Node(self, address=address)
@@ -99,37 +238,71 @@ class Network(object):
         return node
 
     def run(self):
-        while self.timers:
+        while True:
+            self.schedule_pending()
+            if not self.timers:
+                break
             next_timer = self.timers[0]
             if next_timer.expires > self.now:
                 self.now = next_timer.expires
             heapq.heappop(self.timers)
+            next_timer.on_cancel = None  # no longer in the heap
             if next_timer.cancelled:
+                self.cancelled_timers -= 1
                 continue
             if not next_timer.address or next_timer.address in self.nodes:
                 next_timer.callback()
 
     def stop(self):
         self.timers = []
+        self.cancelled_timers = 0
+
+    def call_soon(self, callback, *args):
+        """Run callback on the network's thread, soon; safe from any thread"""
+        self.pending.append(functools.partial(callback, *args))
+
+    def schedule_pending(self):
+        while self.pending:
+            self.set_timer(None, 0, self.pending.popleft())
 
     def set_timer(self, address, seconds, callback):
-        timer = Timer(self.now + seconds, address, callback)
+        timer = Timer(self.now + seconds, address, callback, on_cancel=self.timer_cancelled)
         heapq.heappush(self.timers, timer)
         return timer
 
+    def timer_cancelled(self):
+        # cancelled retransmit timers would otherwise sit in the heap until
+        # they expire; rebuild it without them once they are the majority, so
+        # each cancel costs O(1) amortized and the heap stays proportional to
+        # the live timers
+        self.cancelled_timers += 1
+        if self.cancelled_timers > len(self.timers) / 2:
+            self.timers = [t for t in self.timers if not t.cancelled]
+            heapq.heapify(self.timers)
+            self.cancelled_timers = 0
+
     def send(self, sender, destinations, message):
-        sender.logger.debug(f"sending {message} to {destinations}")
-        # avoid aliasing by making a closure containing distinct deep copy of message for each dest
+        sender.logger.debug("sending %s to %s", message, destinations)
+        # avoid aliasing by freezing one copy of the message, shared by every dest
+        message = freeze(message)
         def sendto(dest, message):
             if dest == sender.address:
                 # reliably deliver local messages with no delay
                 self.set_timer(sender.address, 0, lambda: sender.receive(sender.address, message))
-            elif self.rnd.uniform(0, 1.0) > self.DROP_PROB:
-                delay = self.PROP_DELAY + self.rnd.uniform(-self.PROP_JITTER, self.PROP_JITTER)
-                self.set_timer(dest, delay, functools.partial(self.nodes[dest].receive,
-                                                              sender.address, message))
+            else:
+                delay = self.transit(sender.address, dest, message)
+                if delay is not None:
+                    self.set_timer(dest, delay, functools.partial(self.nodes[dest].receive,
+                                                                  sender.address, message))
         for dest in (d for d in destinations if d in self.nodes):
-            sendto(dest, copy.deepcopy(message))
+            sendto(dest, message)
+
+    def transit(self, sender, dest, message):
+        """Seconds until message from sender reaches dest, or None if it is lost"""
+        if self.link:
+            return self.link.transit(self, sender, dest, message)
+        if self.rnd.uniform(0, 1.0) > self.DROP_PROB:
+            return self.PROP_DELAY + self.rnd.uniform(-self.PROP_JITTER, self.PROP_JITTER)
 
 class SimTimeLogger(logging.LoggerAdapter):
 
@@ -158,57 +331,232 @@ class Role(object):
 
 class Acceptor(Role):
 
-    def __init__(self, node):
+    def __init__(self, node, wal=None):
         super(Acceptor, self).__init__(node)
         self.ballot_num = NULL_BALLOT
         self.accepted_proposals = {}  # {slot: (ballot_num, proposal)}
-
-    def do_Prepare(self, sender, ballot_num):
-        if ballot_num > self.ballot_num:
+        self.lease_holder = None
+        self.lease_expires = 0
+        # with a write-ahead log (see wal.py), replies wait for the fsync that
+        # makes the state they promise durable
+        self.wal = wal
+        self.replies = []
+        self.sync_timer = None
+        if wal:
+            self.replay(wal.replay())
+            # leases aren't logged; after a restart, assume the one we might
+            # have granted is still running
+            self.lease_expires = node.network.now + LEASE_DURATION
+
+    def replay(self, records):
+        for record in records:
+            if record[0] == 'ballot':
+                self.ballot_num = max(self.ballot_num, record[1])
+            elif record[0] == 'accept':
+                self.accepted_proposals[record[1]] = record[2:]
+
+    def log(self, record):
+        if self.wal:
+            self.wal.append(record)
+
+    def reply(self, destinations, message):
+        if not self.wal:
+            self.node.send(destinations, message)
+            return
+        self.replies.append((destinations, message))
+        if not self.sync_timer:
+            self.sync_timer = self.set_timer(WAL_SYNC_DELAY, self.sync)
+
+    def sync(self):
+        """Group commit: one fsync covers every append since the last one"""
+        self.wal.sync()
+        self.sync_timer = None
+        replies, self.replies = self.replies, []
+        for destinations, message in replies:
+            self.node.send(destinations, message)
+
+    def do_Active(self, sender, ballot_num, lease_start, rto):
+        if ballot_num != self.ballot_num:
+            return  # not the leader we last promised
+        # promise no other leader until the lease runs out; the leader counts
+        # its lease from before we received this, so it expires there first
+        self.lease_holder = sender
+        self.lease_expires = self.node.network.now + LEASE_DURATION
+        self.node.send([sender], LeaseGranted(ballot_num=ballot_num, lease_start=lease_start))
+
+    def leased_to_other(self, sender):
+        return self.lease_holder != sender and self.node.network.now < self.lease_expires
+
+    def do_Prepare(self, sender, ballot_num, slot):
+        if ballot_num > self.ballot_num and self.leased_to_other(sender):
+            self.logger.info("refusing PREPARE from %s; lease held by %s", sender, self.lease_holder)
+        elif ballot_num > self.ballot_num:
             self.ballot_num = ballot_num
+            self.log(('ballot', ballot_num))
             # we've heard from a scout, so it might be the next leader
             self.node.send([self.node.address], Accepting(leader=sender))
 
-        self.node.send([sender], Promise(ballot_num=self.ballot_num, accepted_proposals=self.accepted_proposals))
-
-    def do_Accept(self, sender, ballot_num, slot, proposal):
+        # the scout already knows everything decided below slot
+        accepted_proposals = dict((s, v) for s, v in self.accepted_proposals.items() if s >= slot)
+        self.reply([sender], Promise(ballot_num=self.ballot_num, accepted_proposals=accepted_proposals))
+
+    def do_PreVote(self, sender, ballot_num):
+        # would we promise ballot_num?  Promise nothing yet, so that a scout
+        # that can't win doesn't disturb the leader we follow
+        granted = ballot_num >= self.ballot_num and not self.leased_to_other(sender)
+        self.node.send([sender], PreVoted(requested=ballot_num, ballot_num=self.ballot_num,
+                                          granted=granted))
+
+    def do_Compact(self, sender, slot):
+        for s in [s for s in self.accepted_proposals if s < slot]:
+            del self.accepted_proposals[s]
+        if self.wal:
+            # rewrite the log without the forgotten slots
+            self.wal.checkpoint(self.records())
+
+    def records(self):
+        """The log records that restore this acceptor's current state"""
+        return [('ballot', self.ballot_num)] + [
+            ('accept', s, b, p) for s, (b, p) in sorted(self.accepted_proposals.items())]
+
+    def do_Accept(self, sender, ballot_num, proposals):
         if ballot_num >= self.ballot_num:
-            self.ballot_num = ballot_num
+            if ballot_num > self.ballot_num:
+                self.ballot_num = ballot_num
+                self.log(('ballot', ballot_num))
             acc = self.accepted_proposals
-            if slot not in acc or acc[slot][0] < ballot_num:
-                acc[slot] = (ballot_num, proposal)
+            for slot, proposal in proposals.items():
+                if slot not in acc or acc[slot][0] < ballot_num:
+                    acc[slot] = (ballot_num, proposal)
+                    self.log(('accept', slot, ballot_num, proposal))
 
-        self.node.send([sender], Accepted(
-            slot=slot, ballot_num=self.ballot_num))
+        self.reply([sender], Accepted(
+            slots=tuple(sorted(proposals)), ballot_num=self.ballot_num))
 
 class Replica(Role):
 
-    def __init__(self, node, execute_fn, state, slot, decisions, peers):
+    def __init__(self, node, execute_fn, state, slot, decisions, peers, sessions=None,
+                 applier_cls=Applier, leader=None):
         super(Replica, self).__init__(node)
         self.execute_fn = execute_fn
-        self.state = state
+        self.applier = applier_cls(node)
+        self.state = state  # only touched by the applier once we're running
         self.slot = slot
         self.decisions = decisions
         self.peers = peers
-        self.proposals = {}
-        # next slot num for a proposal (may lead slot)
-        self.next_slot = slot
-        self.latest_leader = None
+        self.proposals = {}  # {slot: Proposal or Batch}
+        self.proposed = {}  # {(caller, client_id): slot} for requests in self.proposals
+        self.proposed_at = {}  # {slot: when we last sent its proposal}
+        self.batch = OrderedDict()  # {(caller, client_id): Proposal} not yet proposed
+        self.batch_timer = None
+        self.latest_leader = leader  # the cluster's preferred leader, if it has one
+        self.latest_leader_ballot = NULL_BALLOT  # highest ballot an ACTIVE leader has shown us
         self.latest_leader_timeout = None
+        self.latest_leader_rto = None  # as the leader last told us in ACTIVE
+        # {(caller, client_id): output} for committed requests, oldest first
+        self.sessions = OrderedDict(sessions or {})
+        self.applying = set()  # (caller, client_id) of committed requests not yet applied
+        self.snapshot = Snapshot(slot, freeze(state), freeze(self.sessions))
+        self.snapshot_slot = slot  # of the latest snapshot asked of the applier
+        self.peer_slots = {}  # {peer: slot it has executed up to}
+        self.compacted_slot = 0
+        self.last_decided = max(decisions or [slot - 1])
+        # next slot num for a proposal (may lead slot)
+        self.next_slot = self.last_decided + 1
+        self.lease_expires = 0
+        self.lease_slot = 0
+        self.catchup_slot = None  # self.slot when we last checked for a gap
+        self.catchup_peer = 0
+        self.learners = {}  # {address: when it last asked us for decisions}
+        # a welcome may come with decisions past its snapshot
+        self.execute_decided()
+        self.set_timer(CATCHUP_INTERVAL, self.catch_up)
+        if leader:
+            # move on if it never shows up; a seed only bootstraps
+            # JOIN_RETRANSMIT * 2 after welcoming the rest, so wait that too
+            self.leader_alive(grace=JOIN_RETRANSMIT * 2)
 
     # making proposals
 
     def do_Invoke(self, sender, caller, client_id, input_value):
         proposal = Proposal(caller, client_id, input_value)
-        slot = next((s for s, p in self.proposals.items() if p == proposal), None)  # iteritems --> items
-        # propose, or re-propose if this proposal already has a slot
-        self.propose(proposal, slot)
+        key = (caller, client_id)
+        if key in self.sessions:
+            # a retransmission of a finished request; just answer it again
+            self.reply(proposal)
+        elif key in self.applying:
+            pass  # committed; it is answered once applied
+        elif key in self.proposed:
+            # re-propose the slot this request already has - once, rather
+            # than again for each request batched with it, as those are
+            # retransmitted at about the same time
+            slot = self.proposed[key]
+            since = self.node.network.now - self.proposed_at[slot]
+            if since >= self.node.request_rtt.timeout(INVOKE_RETRANSMIT) / 2:
+                self.propose(self.proposals[slot], slot)
+        elif key not in self.batch:
+            self.batch[key] = proposal
+            if len(self.batch) >= INVOKE_BATCH_SIZE:
+                self.flush_batch()
+            elif not self.batch_timer:
+                self.batch_timer = self.set_timer(INVOKE_BATCH_WINDOW, self.flush_batch)
+
+    def flush_batch(self):
+        """Propose the requests gathered since the last flush in a single slot"""
+        if self.batch_timer:
+            self.batch_timer.cancel()
+            self.batch_timer = None
+        proposals = tuple(self.batch.values())
+        self.batch = OrderedDict()
+        if len(proposals) == 1:
+            self.propose(proposals[0])
+        elif proposals:
+            self.propose(Batch(proposals=proposals))
+
+    def do_Read(self, sender, caller, client_id, input_value):
+        key = (caller, client_id)
+        # once a read is on its way into a slot, keep re-proposing it so the
+        # slot gets filled
+        if self.holds_lease() and key not in self.proposed and key not in self.batch:
+            # no other leader can decide anything while the lease lasts, so
+            # our state is up to date once what we've committed is applied;
+            # answer without using a slot
+            self.read(caller, client_id, input_value)
+        elif sender == self.node.address and self.latest_leader not in (None, self.node.address):
+            # the leader's replica may be able to answer from its lease
+            self.node.send([self.latest_leader], Read(caller=caller, client_id=client_id,
+                                                      input_value=input_value))
+        else:
+            # no lease to be had; order the read in the log like any request
+            self.do_Invoke(sender, caller, client_id, input_value)
+
+    def read(self, caller, client_id, input_value):
+        """Answer a read from the local state, once what we've committed is
+        applied"""
+        self.applier.submit(lambda: self.execute_fn(self.state, thaw(input_value))[1],
+                            lambda output: self.node.send(
+                                [caller], Invoked(client_id=client_id, output=output)))
+
+    def do_Lease(self, sender, expires, slot):
+        if sender == self.node.address:
+            self.lease_expires = expires
+            self.lease_slot = slot
+
+    def holds_lease(self):
+        """True if our leader holds a lease and we have executed everything
+        decided so far: slots before the leader was adopted are below
+        lease_slot, and its own decisions reach us first, over the local link"""
+        return (self.node.network.now < self.lease_expires and
+                self.slot >= self.lease_slot and self.slot > self.last_decided)
 
     def propose(self, proposal, slot=None):
         """Send (or resend, if slot is specified) a proposal to the leader"""
         if not slot:
             slot, self.next_slot = self.next_slot, self.next_slot + 1
         self.proposals[slot] = proposal
+        self.proposed_at[slot] = self.node.network.now
+        for request in unbatch(proposal):
+            self.proposed[request.caller, request.client_id] = slot
         # find a leader we think is working - either the latest we know of, or
         # ourselves (which may trigger a scout to make us the leader)
         leader = self.latest_leader or self.node.address
@@ -220,19 +568,28 @@ class Replica(Role):
     def do_Decision(self, sender, slot, proposal):
         assert not self.decisions.get(self.slot, None), \
                 "next slot to commit is already decided"
+        if slot < self.compacted_slot:
+            return  # executed everywhere and forgotten
         if slot in self.decisions:
             assert self.decisions[slot] == proposal, \
                 "slot %d already decided with %r!" % (slot, self.decisions[slot])
             return
         self.decisions[slot] = proposal
+        self.last_decided = max(self.last_decided, slot)
         self.next_slot = max(self.next_slot, slot + 1)
+        learners = self.live_learners() if self.learners else None
+        if learners:
+            self.node.send(learners, Decision(slot=slot, proposal=proposal))
 
         # re-propose our proposal in a new slot if it lost its slot and wasn't a no-op
         our_proposal = self.proposals.get(slot)
-        if our_proposal is not None and our_proposal != proposal and our_proposal.caller:
+        if our_proposal is not None and our_proposal != proposal and our_proposal != NOOP_PROPOSAL:
             self.propose(our_proposal)
 
-        # execute any pending, decided proposals
+        self.execute_decided()
+
+    def execute_decided(self):
+        """Execute any pending, decided proposals"""
         while True:
             commit_proposal = self.decisions.get(self.slot)
             if not commit_proposal:
@@ -240,19 +597,137 @@ class Replica(Role):
             commit_slot, self.slot = self.slot, self.slot + 1
 
             self.commit(commit_slot, commit_proposal)
+            if self.slot >= self.snapshot_slot + SNAPSHOT_INTERVAL:
+                self.take_snapshot()
 
     def commit(self, slot, proposal):
         """Actually commit a proposal that is decided and in sequence"""
-        decided_proposals = [p for s, p in self.decisions.items() if s < slot]
-        if proposal in decided_proposals:
+        requests = [r for r in unbatch(proposal) if self.commit_request(slot, r)]
+        if requests:
+            # perform the client operations, replying once they're done
+            self.applier.submit(functools.partial(self.apply, [r.input for r in requests]),
+                                functools.partial(self.applied, requests))
+
+    def commit_request(self, slot, proposal):
+        """Return True if this request is to be applied"""
+        if proposal.caller is None:
+            return False  # no-op
+        key = (proposal.caller, proposal.client_id)
+        self.proposed.pop(key, None)
+        if key in self.sessions or key in self.applying:
             self.logger.info("not committing duplicate proposal %r at slot %d", proposal, slot)
-            return  # duplicate
-
+            if key in self.sessions:
+                self.reply(proposal)
+            return False
         self.logger.info("committing %r at slot %d" % (proposal, slot))
-        if proposal.caller is not None:
-            # perform a client operation
-            self.state, output = self.execute_fn(self.state, proposal.input)
-            self.node.send([proposal.caller], Invoked(client_id=proposal.client_id, output=output))
+        self.applying.add(key)
+        return True
+
+    def apply(self, inputs):
+        """Run a slot's requests through the state machine; called by the applier"""
+        self.state, outputs = self.applier.execute(self.execute_fn, self.state,
+                                                   [thaw(i) for i in inputs])
+        return outputs
+
+    def applied(self, requests, outputs):
+        for request, output in zip(requests, outputs):
+            self.applying.discard((request.caller, request.client_id))
+            self.remember(request, output)
+            self.reply(request)
+
+    def remember(self, proposal, output):
+        """Record a committed request, evicting the oldest sessions beyond
+        SESSION_LIMIT; every replica commits in the same order, so they all
+        evict the same sessions"""
+        self.sessions[proposal.caller, proposal.client_id] = output
+        while len(self.sessions) > SESSION_LIMIT:
+            self.sessions.popitem(last=False)
+
+    def reply(self, proposal):
+        output = self.sessions[proposal.caller, proposal.client_id]
+        self.node.send([proposal.caller], Invoked(client_id=proposal.client_id, output=output))
+
+    # snapshots and log compaction
+
+    def take_snapshot(self):
+        # the state is frozen by the applier once it has caught up, and the
+        # sessions when that result comes back, so the two agree
+        self.snapshot_slot = slot = self.slot
+        self.applier.submit(lambda: freeze(self.state),
+                            functools.partial(self.snapshot_taken, slot))
+
+    def snapshot_taken(self, slot, state):
+        self.snapshot = Snapshot(slot, state, freeze(self.sessions))
+        self.logger.info("snapshot at slot %d", slot)
+        # tell everyone how far we've got, so they can compact their logs
+        self.node.send(self.peers, Executed(slot=slot))
+
+    def stop(self):
+        self.applier.stop()
+        super(Replica, self).stop()
+
+    def do_Executed(self, sender, slot):
+        if sender not in self.peers:
+            return
+        self.peer_slots[sender] = max(slot, self.peer_slots.get(sender, 0))
+        if len(self.peer_slots) < len(self.peers):
+            return
+        # every peer has executed everything below this slot
+        low_slot = min(self.peer_slots.values())
+        if low_slot > self.compacted_slot:
+            self.node.send([self.node.address], Compact(slot=low_slot))
+
+    def do_Compact(self, sender, slot):
+        self.compacted_slot = max(self.compacted_slot, slot)
+        # keep the decisions after our snapshot, to welcome new nodes
+        keep_from = min(slot, self.snapshot.slot)
+        for s in [s for s in self.decisions if s < keep_from]:
+            del self.decisions[s]
+        for s in [s for s in self.proposals if s < slot]:
+            del self.proposals[s]
+            self.proposed_at.pop(s, None)
+
+    # catching up on missed decisions
+
+    def catch_up(self):
+        """If we have made no progress since the last check while later slots
+        have been decided (or executed elsewhere, or proposed by us, whose
+        decisions may have been lost), ask our peers for the decisions we are
+        missing, a chunk of slots from each"""
+        self.set_timer(CATCHUP_INTERVAL, self.catch_up)
+        stalled, self.catchup_slot = self.slot == self.catchup_slot, self.slot
+        end = max([self.last_decided + 1, max(self.proposals or [0]) + 1] +
+                  list(self.peer_slots.values()))
+        others = [p for p in self.peers if p != self.node.address]
+        if not stalled or self.slot >= end or not others:
+            return
+        chunks = [s for s in range(self.slot, end, CATCHUP_CHUNK)
+                  if any(slot not in self.decisions
+                         for slot in range(s, min(s + CATCHUP_CHUNK, end)))]
+        for slot in chunks[:CATCHUP_WINDOW]:
+            peer = others[self.catchup_peer % len(others)]
+            self.catchup_peer += 1
+            self.logger.info("catching up on slots %d-%d from %s", slot, slot + CATCHUP_CHUNK - 1, peer)
+            self.node.send([peer], Catchup(slot=slot, count=CATCHUP_CHUNK))
+
+    def do_Catchup(self, sender, slot, count):
+        if sender not in self.peers:
+            return
+        decisions = dict((s, self.decisions[s]) for s in range(slot, slot + count)
+                         if s in self.decisions)
+        if decisions:
+            self.node.send([sender], CaughtUp(decisions=decisions))
+
+    def do_Relay(self, sender, decisions, relay_to):
+        if relay_to:
+            self.node.send(relay_to, Relay(decisions=decisions, relay_to=()))
+        for slot in sorted(decisions):
+            self.do_Decision(sender, slot, decisions[slot])
+
+    def do_CaughtUp(self, sender, decisions):
+        for slot in sorted(decisions):
+            if slot >= self.slot:
+                self.do_Decision(sender, slot, decisions[slot])
 
     # tracking the leader
 
@@ -264,12 +739,23 @@ class Replica(Role):
         self.latest_leader = leader
         self.leader_alive()
 
-    def do_Active(self, sender):
-        if sender != self.latest_leader:
+    def do_Active(self, sender, ballot_num, lease_start, rto):
+        # besides our own leader, follow any leader with a ballot at least as
+        # high as we've seen; we may have given up on it after lost ACTIVEs
+        if sender != self.latest_leader and ballot_num < self.latest_leader_ballot:
             return
+        self.latest_leader = sender
+        self.latest_leader_ballot = max(ballot_num, self.latest_leader_ballot)
+        self.latest_leader_rto = rto
         self.leader_alive()
 
-    def leader_alive(self):
+    def do_Preempted(self, sender, slots, preempted_by):
+        # our leader lost out (perhaps to another's lease); follow the winner
+        if sender == self.node.address and preempted_by.leader in self.peers:
+            self.latest_leader = preempted_by.leader
+            self.leader_alive()
+
+    def leader_alive(self, grace=0):
         if self.latest_leader_timeout:
             self.latest_leader_timeout.cancel()
 
@@ -277,68 +763,249 @@ class Replica(Role):
             idx = self.peers.index(self.latest_leader)
             self.latest_leader = self.peers[(idx + 1) % len(self.peers)]
             self.logger.debug("leader timed out; tring the next one, %s", self.latest_leader)
-        self.latest_leader_timeout = self.set_timer(LEADER_TIMEOUT, reset_leader)
+        # two heartbeat intervals, so a single lost ACTIVE isn't taken for a
+        # dead leader, plus the leader's retransmit timeout to cover its
+        # round-trip time and the variation in it
+        self.latest_leader_timeout = self.set_timer(
+            LEADER_TIMEOUT + (self.latest_leader_rto or 0) + grace, reset_leader)
 
     # adding new cluster members
 
     def do_Join(self, sender):
         if sender in self.peers:
-            self.node.send([sender], Welcome(
-                state=self.state, slot=self.slot, decisions=self.decisions))
+            self.welcome(sender)
+
+    def welcome(self, sender):
+        snapshot = self.snapshot
+        self.node.send([sender], Welcome(
+            state=snapshot.state, slot=snapshot.slot, sessions=snapshot.sessions,
+            decisions=dict((s, p) for s, p in self.decisions.items() if s >= snapshot.slot)))
+
+    # feeding learners
+
+    def do_Learn(self, sender, slot, sent_at):
+        """A learner (re)subscribes to the decisions we hear of, telling us
+        how far it has got; send what it is missing, and how far we have got"""
+        if sender in self.peers:
+            return
+        self.learners[sender] = self.node.network.now
+        if slot is None or (slot < self.slot and slot not in self.decisions):
+            # new, or behind what we have compacted away
+            self.welcome(sender)
+        elif slot < self.slot:
+            decisions = dict((s, self.decisions[s])
+                             for s in range(slot, min(slot + CATCHUP_CHUNK, self.slot))
+                             if s in self.decisions)
+            self.node.send([sender], CaughtUp(decisions=decisions))
+        self.node.send([sender], Progress(slot=self.slot, sent_at=sent_at))
+
+    def live_learners(self):
+        """The learners still subscribed, forgetting those that stopped renewing"""
+        expired = self.node.network.now - LEARNER_TIMEOUT
+        for learner in [l for l, renewed in self.learners.items() if renewed < expired]:
+            del self.learners[learner]
+        return list(self.learners)
+
+def quorums(peers):
+    """The phase-1 (PREPARE) and phase-2 (ACCEPT) quorum sizes for peers.
+    Flexible Paxos only needs every phase-1 quorum to intersect every
+    phase-2 quorum, so a small phase-2 quorum for steady-state writes can be
+    paid for with a larger phase-1 quorum at leader changes."""
+    majority = len(peers) // 2 + 1
+    phase1, phase2 = PHASE1_QUORUM or majority, PHASE2_QUORUM or majority
+    if not (0 < phase1 <= len(peers) and 0 < phase2 <= len(peers)):
+        raise ValueError("quorums of %d and %d don't fit %d peers" % (phase1, phase2, len(peers)))
+    if phase1 + phase2 <= len(peers):
+        raise ValueError("phase-1 quorums of %d and phase-2 quorums of %d of %d peers "
+                         "need not intersect" % (phase1, phase2, len(peers)))
+    return phase1, phase2
 
 class Commander(Role):
+    """Phase 2 for all of a leader's in-flight slots: one role per leader,
+    with the outstanding ACCEPTs indexed by their slots, a heap of when each
+    is due for retransmission, and a single retransmit timer, so the cost
+    of each message doesn't grow with the number of slots in flight"""
 
-    def __init__(self, node, ballot_num, slot, proposal, peers):
+    def __init__(self, node, peers):
         super(Commander, self).__init__(node)
-        self.ballot_num = ballot_num
-        self.slot = slot
-        self.proposal = proposal
-        self.acceptors = set([])
         self.peers = peers
-        self.quorum = len(peers) / 2 + 1
-
-    def start(self):
-        self.node.send(set(self.peers) - self.acceptors, Accept(
-                            slot=self.slot, ballot_num=self.ballot_num, proposal=self.proposal))
-        self.set_timer(ACCEPT_RETRANSMIT, self.start)
+        self.quorum = quorums(peers)[1]
+        self.in_flight = {}  # {slots: InFlight}
+        # [(due, slots)]; entries whose slots were since decided, preempted or
+        # sent again are skipped when they come up
+        self.due = []
+        self.retransmit_timer = None
+        self.retransmit_at = None
+
+    def accept(self, ballot_num, proposals):
+        slots = tuple(sorted(proposals))
+        sent_to = self.thrifty_peers()
+        self.schedule(slots, InFlight(ballot_num=ballot_num, proposals=proposals, acceptors=set(),
+                                      sent_at=self.node.network.now, retransmits=0,
+                                      sent_to=sent_to, due=None))
+        self.node.send(sent_to, Accept(ballot_num=ballot_num, proposals=proposals))
+
+    def thrifty_peers(self):
+        """Who gets the first ACCEPT: every peer, or in THRIFTY mode just
+        enough of the fastest to make a quorum"""
+        if not THRIFTY:
+            return self.peers
+        return self.node.rtt.fastest(self.peers, self.quorum)
+
+    def retransmit_timeout(self):
+        return self.node.rtt.timeout(self.peers, ACCEPT_RETRANSMIT)
+
+    def schedule(self, slots, in_flight):
+        """Track in_flight, due for retransmission after the retransmit
+        timeout, backed off for each time it has already been retransmitted"""
+        due = in_flight.sent_at + backoff(self.retransmit_timeout(), in_flight.retransmits)
+        self.in_flight[slots] = in_flight._replace(due=due)
+        heapq.heappush(self.due, (due, slots))
+        if self.retransmit_at is None or due < self.retransmit_at:
+            self.set_retransmit_timer()
+
+    def set_retransmit_timer(self):
+        if self.retransmit_timer:
+            self.retransmit_timer.cancel()
+        self.retransmit_timer = self.retransmit_at = None
+        while self.due:
+            due, slots = self.due[0]
+            in_flight = self.in_flight.get(slots)
+            if in_flight and in_flight.due == due:
+                self.retransmit_at = due
+                self.retransmit_timer = self.set_timer(due - self.node.network.now, self.retransmit)
+                return
+            heapq.heappop(self.due)
 
-    def finished(self, ballot_num, preempted):
-        if preempted:
-            self.node.send([self.node.address], Preempted(slot=self.slot, preempted_by=ballot_num))
-        else:
-            self.node.send([self.node.address], Decided(slot=self.slot))
-        self.stop()
+    def send_accept(self, in_flight):
+        self.node.send(set(self.peers) - in_flight.acceptors, Accept(
+                            ballot_num=in_flight.ballot_num, proposals=in_flight.proposals))
 
-    def do_Accepted(self, sender, slot, ballot_num):
-        if slot != self.slot:
-            return
-        if ballot_num == self.ballot_num:
-            self.acceptors.add(sender)
-            if len(self.acceptors) < self.quorum:
+    def retransmit(self):
+        now = self.node.network.now
+        self.retransmit_timer = None
+        while self.due and self.due[0][0] <= now:
+            due, slots = heapq.heappop(self.due)
+            in_flight = self.in_flight.get(slots)
+            if not in_flight or in_flight.due != due:
+                continue
+            if not in_flight.retransmits:
+                for peer in set(in_flight.sent_to) - in_flight.acceptors:
+                    self.node.rtt.miss(peer)
+            # widen to every peer that hasn't answered
+            self.send_accept(in_flight)
+            self.schedule(slots, in_flight._replace(sent_at=now,
+                                                    retransmits=in_flight.retransmits + 1))
+        self.set_retransmit_timer()
+
+    def do_Accepted(self, sender, slots, ballot_num):
+        in_flight = self.in_flight.get(slots)
+        if not in_flight:
+            return  # already finished
+        if ballot_num == in_flight.ballot_num:
+            if not in_flight.retransmits and sender not in in_flight.acceptors:
+                self.node.rtt.sample(sender, self.node.network.now - in_flight.sent_at)
+            in_flight.acceptors.add(sender)
+            if len(in_flight.acceptors) < self.quorum:
                 return
-            self.node.send(self.peers, Decision(slot=self.slot, proposal=self.proposal))
-            self.finished(ballot_num, False)
-        else:
-            self.finished(ballot_num, True)
+            self.disseminate(in_flight.proposals, in_flight.acceptors)
+            del self.in_flight[slots]
+            self.node.send([self.node.address], Decided(slots=slots))
+        elif ballot_num > in_flight.ballot_num:
+            # give up on everything sent with a ballot this one supersedes
+            preempted = [s for s, f in self.in_flight.items() if f.ballot_num < ballot_num]
+            for s in preempted:
+                del self.in_flight[s]
+            self.node.send([self.node.address], Preempted(
+                slots=tuple(sorted(itertools.chain(*preempted))), preempted_by=ballot_num))
+
+    def disseminate(self, decisions, acceptors):
+        """Send newly decided proposals to every peer: directly, or as one
+        RELAY to DECISION_RELAYS of the acceptors that just answered, which
+        pass it on to a share of the rest each, so our egress per decision
+        doesn't grow with the cluster"""
+        if not DECISION_RELAYS:
+            for slot in sorted(decisions):
+                self.node.send(self.peers, Decision(slot=slot, proposal=decisions[slot]))
+            return
+        if self.node.address in self.peers:
+            self.node.send([self.node.address], Relay(decisions=decisions, relay_to=()))
+        others = [p for p in self.peers if p != self.node.address]
+        relays = self.node.rtt.fastest([p for p in others if p in acceptors],
+                                       DECISION_RELAYS) or others
+        rest = [p for p in others if p not in relays]
+        for i, relay in enumerate(relays):
+            self.node.send([relay], Relay(decisions=decisions,
+                                          relay_to=tuple(rest[i::len(relays)])))
 
 class Scout(Role):
 
-    def __init__(self, node, ballot_num, peers):
+    def __init__(self, node, ballot_num, peers, slot):
         super(Scout, self).__init__(node)
         self.ballot_num = ballot_num
+        self.slot = slot  # only accepted proposals from here on are of interest
         self.accepted_proposals = {}
         self.acceptors = set([])
+        self.refusals = {}  # acceptor -> its ballot, for the pre-vote
         self.peers = peers
-        self.quorum = len(peers) / 2 + 1
+        self.quorum = quorums(peers)[0]
         self.retransmit_timer = None
+        self.sent_at = node.network.now  # of the first PREPARE, for round-trip times
+        self.sent_to = peers
+        self.retransmits = 0
+        # first ask whether a quorum would promise, without raising ballots
+        self.pre_voting = PRE_VOTE
 
     def start(self):
         self.logger.info("scout starting")
         self.send_prepare()
 
     def send_prepare(self):
-        self.node.send(self.peers, Prepare(ballot_num=self.ballot_num))
-        self.retransmit_timer = self.set_timer(PREPARE_RETRANSMIT, self.send_prepare)
+        if self.retransmits:
+            # widen to every peer that hasn't promised
+            self.sent_to = [p for p in self.peers if p not in self.acceptors]
+        elif THRIFTY:
+            self.sent_to = self.node.rtt.fastest(self.peers, self.quorum)
+        if self.pre_voting:
+            self.node.send(self.sent_to, PreVote(ballot_num=self.ballot_num))
+        else:
+            self.node.send(self.sent_to, Prepare(ballot_num=self.ballot_num, slot=self.slot))
+        timeout = self.node.rtt.timeout(self.peers, PREPARE_RETRANSMIT)
+        self.retransmit_timer = self.set_timer(backoff(timeout, self.retransmits), self.retransmit)
+
+    def retransmit(self):
+        if not self.retransmits:
+            for peer in set(self.sent_to) - self.acceptors:
+                self.node.rtt.miss(peer)
+        self.retransmits += 1
+        self.send_prepare()
+
+    def do_PreVoted(self, sender, requested, ballot_num, granted):
+        if not self.pre_voting or requested != self.ballot_num:
+            return  # a reply to an earlier scout's pre-vote
+        if not self.retransmits and sender not in self.acceptors and sender not in self.refusals:
+            self.node.rtt.sample(sender, self.node.network.now - self.sent_at)
+        if not granted:
+            # a higher ballot, or another leader's lease: a PREPARE to this
+            # acceptor would fail too, but the others may still make a quorum
+            self.refusals[sender] = ballot_num
+            if len(self.peers) - len(self.refusals) < self.quorum:
+                self.node.send([self.node.address],
+                               Preempted(slots=None, preempted_by=max(self.refusals.values())))
+                self.stop()
+            return
+        self.refusals.pop(sender, None)
+        self.acceptors.add(sender)
+        if len(self.acceptors) >= self.quorum:
+            # a quorum would promise; now ask for the promises
+            self.retransmit_timer.cancel()
+            self.pre_voting = False
+            self.acceptors = set()
+            self.refusals = {}
+            self.sent_at = self.node.network.now
+            self.sent_to = self.peers
+            self.retransmits = 0
+            self.send_prepare()
 
     def update_accepted(self, accepted_proposals):
         acc = self.accepted_proposals
@@ -347,22 +1014,24 @@ class Scout(Role):
                 acc[slot] = (ballot_num, proposal)
 
     def do_Promise(self, sender, ballot_num, accepted_proposals):
+        if not self.retransmits and sender not in self.acceptors:
+            self.node.rtt.sample(sender, self.node.network.now - self.sent_at)
         if ballot_num == self.ballot_num:
             self.logger.info("got matching promise; need %d" % self.quorum)
             self.update_accepted(accepted_proposals)
             self.acceptors.add(sender)
             if len(self.acceptors) >= self.quorum:
                 # strip the ballot numbers from self.accepted_proposals, now that it
-                # represents a majority
+                # represents a phase-1 quorum
                 accepted_proposals = dict((s, p) for s, (b, p) in self.accepted_proposals.items())
                 # We're adopted; note that this does *not* mean that no other leader is active.
-                # Any such conflicts will be handled by the commanders.
+                # Any such conflicts will be handled by the commander.
                 self.node.send([self.node.address],
                                Adopted(ballot_num=ballot_num, accepted_proposals=accepted_proposals))
                 self.stop()
         else:
             # this acceptor has promised another leader a higher ballot number, so we've lost
-            self.node.send([self.node.address], Preempted(slot=None, preempted_by=ballot_num))
+            self.node.send([self.node.address], Preempted(slots=None, preempted_by=ballot_num))
             self.stop()
 
 class Leader(Role):
@@ -372,49 +1041,128 @@ class Leader(Role):
         self.ballot_num = Ballot(0, node.address)
         self.active = False
         self.proposals = {}
-        self.commander_cls = commander_cls
+        self.commander = commander_cls(node, peers)
         self.scout_cls = scout_cls
         self.scouting = False
         self.peers = peers
+        self.executed_slot = 0  # as of the local replica's latest snapshot
+        self.batch = {}  # {slot: proposal} waiting to be sent in one ACCEPT
+        self.batch_timer = None
+        self.lease_start = None  # when the current round of ACTIVEs went out
+        self.lease_grants = set()
+        self.lease_slot = 0  # first slot we may have decided ourselves
+        self.preemptions = 0  # since we were last adopted
 
     def start(self):
         # reminder others we're active before LEADER_TIMEOUT expires
         def active():
             if self.active:
-                self.node.send(self.peers, Active())
+                self.send_active()
             self.set_timer(LEADER_TIMEOUT / 2.0, active)
         active()
 
+    def send_active(self):
+        # each round of ACTIVEs also renews our lease with the acceptors
+        self.lease_start = self.node.network.now
+        self.lease_grants = set()
+        self.node.send(self.peers, Active(ballot_num=self.ballot_num, lease_start=self.lease_start,
+                                          rto=self.node.rtt.timeout(self.peers, None)))
+
     def spawn_scout(self):
         assert not self.scouting
         self.scouting = True
-        self.scout_cls(self.node, self.ballot_num, self.peers).start()
+        if not self.preemptions:
+            self.start_scout()
+            return
+        # competing leaders that scouted again straight away would go on
+        # preempting each other; back off for a random, exponentially growing
+        # time, so that one of them gets through
+        timeout = self.node.rtt.timeout(self.peers, PREPARE_RETRANSMIT)
+        delay = self.node.network.rnd.uniform(0, backoff(timeout, self.preemptions - 1))
+        self.logger.info("backing off for %.3fs before scouting", delay)
+        self.set_timer(delay, self.start_scout)
+
+    def start_scout(self):
+        self.scout_cls(self.node, self.ballot_num, self.peers, self.executed_slot).start()
 
     def do_Adopted(self, sender, ballot_num, accepted_proposals):
         self.scouting = False
+        self.preemptions = 0
         self.proposals.update(accepted_proposals)
-        # note that we don't re-spawn commanders here; if there are undecided
-        # proposals, the replicas will re-propose
+        self.lease_slot = max(accepted_proposals or [0]) + 1
         self.logger.info("leader becoming active")
         self.active = True
-
-    def spawn_commander(self, ballot_num, slot):
-        proposal = self.proposals[slot]
-        self.commander_cls(self.node, ballot_num, slot, proposal, self.peers).start()
-
-    def do_Preempted(self, sender, slot, preempted_by):
-        if not slot:  # from the scout
+        # finish what earlier leaders got accepted, with our ballot; the
+        # replicas' re-proposals of those slots are ignored, as already being
+        # proposed, and the other slots they re-propose themselves
+        slots = sorted(accepted_proposals)
+        for i in range(0, len(slots), ACCEPT_BATCH_SIZE):
+            self.commander.accept(self.ballot_num, dict(
+                (s, accepted_proposals[s]) for s in slots[i:i + ACCEPT_BATCH_SIZE]))
+        self.send_active()  # take the lease now, rather than at the next heartbeat
+
+    def do_LeaseGranted(self, sender, ballot_num, lease_start):
+        # every round of ACTIVEs is distinct, so each grant is a clean sample
+        self.node.rtt.sample(sender, self.node.network.now - lease_start)
+        if not self.active or ballot_num != self.ballot_num or lease_start != self.lease_start:
+            return  # a grant for an earlier round
+        self.lease_grants.add(sender)
+        # the grants must cover an acceptor of every phase-1 quorum
+        if len(self.lease_grants) == len(self.peers) - quorums(self.peers)[0] + 1:
+            self.node.send([self.node.address], Lease(expires=lease_start + LEASE_DURATION,
+                                                      slot=self.lease_slot))
+
+    def flush_batch(self):
+        if self.batch_timer:
+            self.batch_timer.cancel()
+            self.batch_timer = None
+        if self.batch:
+            self.logger.info("sending ACCEPT for slots %s" % (sorted(self.batch),))
+            self.commander.accept(self.ballot_num, self.batch)
+            self.batch = {}
+
+    def do_Compact(self, sender, slot):
+        for s in [s for s in self.proposals if s < slot]:
+            del self.proposals[s]
+
+    def do_Executed(self, sender, slot):
+        if sender == self.node.address:
+            self.executed_slot = max(self.executed_slot, slot)
+
+    def do_Preempted(self, sender, slots, preempted_by):
+        if not slots:  # from the scout
             self.scouting = False
         self.logger.info("leader preempted by %s", preempted_by.leader)
         self.active = False
-        self.ballot_num = Ballot((preempted_by or self.ballot_num).n + 1, self.ballot_num.leader)
+        self.preemptions += 1
+        # the slots given up on go back to the replicas to re-propose;
+        # forget them, or those proposals would be ignored as already made
+        for slot in slots or ():
+            self.proposals.pop(slot, None)
+        # the batch was never sent and the new ballot is not adopted yet, so
+        # forget it; the replicas will re-propose those slots
+        for slot in self.batch:
+            del self.proposals[slot]
+        self.batch = {}
+        self.flush_batch()
+        # an acceptor refusing us for another leader's lease may answer with
+        # an older ballot than ours
+        preempted_by = max(preempted_by or self.ballot_num, self.ballot_num)
+        self.ballot_num = Ballot(preempted_by.n + 1, self.ballot_num.leader)
 
     def do_Propose(self, sender, slot, proposal):
-        if slot not in self.proposals:
+        if slot < self.executed_slot:
+            # already decided, and our scouts no longer ask about it; the
+            # proposer will learn the decision from its peers
+            self.logger.info("got PROPOSE for executed slot %d; ignored" % (slot,))
+        elif slot not in self.proposals:
             if self.active:
                 self.proposals[slot] = proposal
-                self.logger.info("spawning commander for slot %d" % (slot,))
-                self.spawn_commander(self.ballot_num, slot)
+                self.batch[slot] = proposal
+                if len(self.batch) >= ACCEPT_BATCH_SIZE:
+                    self.flush_batch()
+                elif not self.batch_timer:
+                    self.batch_timer = self.set_timer(ACCEPT_BATCH_WINDOW, self.flush_batch)
             else:
                 if not self.scouting:
                     self.logger.info("got PROPOSE when not active - scouting")
@@ -428,8 +1176,10 @@ class Bootstrap(Role):
 
     def __init__(self, node, peers, execute_fn,
                  replica_cls=Replica, acceptor_cls=Acceptor, leader_cls=Leader,
-                 commander_cls=Commander, scout_cls=Scout):
+                 commander_cls=Commander, scout_cls=Scout, applier_cls=Applier, wal=None,
+                 leader=None):
         super(Bootstrap, self).__init__(node)
+        quorums(peers)  # refuse to start with quorums that don't intersect
         self.execute_fn = execute_fn
         self.peers = peers
         self.peers_cycle = itertools.cycle(peers)
@@ -438,33 +1188,51 @@ class Bootstrap(Role):
         self.leader_cls = leader_cls
         self.commander_cls = commander_cls
         self.scout_cls = scout_cls
+        self.applier_cls = applier_cls
+        self.wal = wal  # the acceptor's write-ahead log, if any (see wal.py)
+        self.leader = leader  # the peer that scouts at once, and is proposed to first
 
     def start(self):
         self.join()
 
     def join(self):
-        self.node.send([next(self.peers_cycle)], Join())
-        self.set_timer(JOIN_RETRANSMIT, self.join)
+        peer = next(self.peers_cycle)
+        self.node.send([peer], Join())
+        self.set_timer(self.node.rtt.timeout([peer], JOIN_RETRANSMIT), self.join)
 
-    def do_Welcome(self, sender, state, slot, decisions):
-        self.acceptor_cls(self.node)
+    def do_Welcome(self, sender, state, slot, decisions, sessions):
+        self.acceptor_cls(self.node, wal=self.wal)
         self.replica_cls(self.node, execute_fn=self.execute_fn, peers=self.peers,
-                         state=state, slot=slot, decisions=decisions)
-        self.leader_cls(self.node, peers=self.peers, commander_cls=self.commander_cls,
-                        scout_cls=self.scout_cls).start()
+                         state=thaw(state), slot=slot, decisions=thaw(decisions),
+                         sessions=thaw(sessions), applier_cls=self.applier_cls,
+                         leader=self.leader)
+        leader = self.leader_cls(self.node, peers=self.peers, commander_cls=self.commander_cls,
+                                 scout_cls=self.scout_cls)
+        leader.start()
+        if self.leader == self.node.address:
+            # take the lead now, rather than whichever peer proposes first
+            leader.spawn_scout()
         self.stop()
 
 class Seed(Role):
 
-    def __init__(self, node, initial_state, execute_fn, peers, bootstrap_cls=Bootstrap):
+    def __init__(self, node, initial_state, execute_fn, peers, bootstrap_cls=Bootstrap,
+                 applier_cls=Applier, wal=None, leader=None):
         super(Seed, self).__init__(node)
+        quorums(peers)  # refuse to start with quorums that don't intersect
         self.initial_state = initial_state
         self.execute_fn = execute_fn
         self.peers = peers
         self.bootstrap_cls = bootstrap_cls
+        self.applier_cls = applier_cls
+        self.wal = wal
+        self.leader = leader
         self.seen_peers = set([])
         self.exit_timer = None
 
+    def start(self):
+        pass  # nothing to do until the first JOIN arrives
+
     def do_Join(self, sender):
         self.seen_peers.add(sender)
         if len(self.seen_peers) <= len(self.peers) / 2:
@@ -472,7 +1240,7 @@ class Seed(Role):
 
         # cluster is ready - welcome everyone
         self.node.send(list(self.seen_peers), Welcome(
-            state=self.initial_state, slot=1, decisions={}))
+            state=self.initial_state, slot=1, decisions={}, sessions={}))
 
         # stick around for long enough that we don't hear any new JOINs from
         # the newly formed cluster
@@ -482,57 +1250,103 @@ class Seed(Role):
 
     def finish(self):
         # bootstrap this node into the cluster we just seeded
-        bs = self.bootstrap_cls(self.node, peers=self.peers, execute_fn=self.execute_fn)
+        bs = self.bootstrap_cls(self.node, peers=self.peers, execute_fn=self.execute_fn,
+                                applier_cls=self.applier_cls, wal=self.wal, leader=self.leader)
         bs.start()
         self.stop()
 
-class Requester(Role):
+class Requester(object):
+    """One client request: start() sends input n to the local replica through
+    the node's Client, which calls callback with the output"""
 
     client_ids = itertools.count(start=100000)
 
-    def __init__(self, node, n, callback):
-        super(Requester, self).__init__(node)
+    def __init__(self, node, n, callback, read_only=False):
+        self.node = node
         self.client_id = next(self.client_ids)#self.client_ids.next()
         self.n = n
-        self.output = None
         self.callback = callback
+        # a read-only input must leave the state unchanged; it may be answered
+        # from the leader's state without taking a slot
+        self.message_cls = Read if read_only else Invoke
 
     def start(self):
-        self.node.send([self.node.address], Invoke(caller=self.node.address,
-                                                   client_id=self.client_id, input_value=self.n))
-        self.invoke_timer = self.set_timer(INVOKE_RETRANSMIT, self.start)
+        client = self.node.client or Client(self.node)
+        client.invoke(self.message_cls(caller=self.node.address, client_id=self.client_id,
+                                       input_value=self.n), self.callback)
+
+class Client(Role):
+    """Every request outstanding from a node: one role, with the requests
+    indexed by client id and a retransmit timer each, so that an INVOKED
+    costs the same however many requests are outstanding"""
+
+    def __init__(self, node):
+        super(Client, self).__init__(node)
+        node.client = self
+        self.outstanding = {}  # {client_id: Outstanding}
+
+    def invoke(self, message, callback):
+        self.send(message, callback, self.node.network.now, 0)
+
+    def send(self, message, callback, sent_at, retransmits):
+        self.node.send([self.node.address], message)
+        # back off exponentially while there's no answer, as TCP does
+        timeout = backoff(self.node.request_rtt.timeout(INVOKE_RETRANSMIT), retransmits)
+        timer = self.set_timer(timeout, functools.partial(self.retransmit, message.client_id))
+        self.outstanding[message.client_id] = Outstanding(
+            message=message, callback=callback, timer=timer, sent_at=sent_at,
+            retransmits=retransmits)
+
+    def retransmit(self, client_id):
+        outstanding = self.outstanding[client_id]
+        self.send(outstanding.message, outstanding.callback, outstanding.sent_at,
+                  outstanding.retransmits + 1)
 
     def do_Invoked(self, sender, client_id, output):
-        if client_id != self.client_id:
-            return
+        outstanding = self.outstanding.pop(client_id, None)
+        if not outstanding:
+            return  # not ours, or already answered
         self.logger.debug("received output %r" % (output,))
-        self.invoke_timer.cancel()
-        self.callback(output)
-        self.stop()
+        if not outstanding.retransmits:
+            self.node.request_rtt.sample(self.node.network.now - outstanding.sent_at)
+        outstanding.timer.cancel()
+        outstanding.callback(thaw(output))
 
 class Member(object):
 
     def __init__(self, state_machine, network, peers, seed=None,
-                 seed_cls=Seed, bootstrap_cls=Bootstrap):
+                 seed_cls=Seed, bootstrap_cls=Bootstrap, window=INVOKE_WINDOW, address=None,
+                 applier_cls=Applier, wal=None, leader=None):
         self.network = network
-        self.node = network.new_node()
+        self.node = network.new_node(address=address)
         if seed is not None:
             self.startup_role = seed_cls(self.node, initial_state=seed, peers=peers,
-                                      execute_fn=state_machine)
+                                      execute_fn=state_machine, applier_cls=applier_cls,
+                                      wal=wal, leader=leader)
         else:
-            self.startup_role = bootstrap_cls(self.node, execute_fn=state_machine, peers=peers)
-        self.requester = None
+            self.startup_role = bootstrap_cls(self.node, execute_fn=state_machine, peers=peers,
+                                              applier_cls=applier_cls, wal=wal, leader=leader)
+        # bounds the outstanding requests; invoke_async blocks when it's used up
+        self.window = threading.BoundedSemaphore(window)
 
     def start(self):
         self.startup_role.start()
         self.thread = threading.Thread(target=self.network.run)
         self.thread.start()
 
-    def invoke(self, input_value, request_cls=Requester):
-        assert self.requester is None
-        q = Queue()#.Queue()
-        self.requester = request_cls(self.node, input_value, q.put)
-        self.requester.start()
-        output = q.get()
-        self.requester = None
-        return output
+    def invoke_async(self, input_value, request_cls=Requester, read_only=False):
+        """Start a request from any thread, returning a Future for its output"""
+        self.window.acquire()
+        future = Future()
+
+        def done(output):
+            self.window.release()
+            future.set_result(output)
+
+        # roles only run on the network's thread
+        self.network.call_soon(lambda: request_cls(
+            self.node, input_value, done, read_only=read_only).start())
+        return future
+
+    def invoke(self, input_value, request_cls=Requester, read_only=False):
+        return self.invoke_async(input_value, request_cls, read_only).result()
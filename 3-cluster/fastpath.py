@@ -0,0 +1,452 @@
+from collections import OrderedDict, namedtuple
+import functools
+import operator
+
+from cluster import (ACCEPT_RETRANSMIT, CATCHUP_INTERVAL, NOOP_PROPOSAL, NULL_BALLOT,
+                     SESSION_LIMIT, SNAPSHOT_INTERVAL, Acceptor, Ballot, Bootstrap, Invoked,
+                     Member, Proposal, Replica, Seed, freeze, thaw)
+from roundtrip import backoff
+
+# a FastReplica's state: the state machine's own, {key: instances of that
+# key's log applied to it}, and {key: {(caller, client_id): output}} for the
+# requests applied from that log, oldest first, so that snapshots carry all three
+FastState = namedtuple('FastState', ['state', 'instances', 'sessions'])
+
+# message types
+FastAccept = namedtuple('FastAccept', ['key', 'instance', 'ballot_num', 'proposal'])
+FastAccepted = namedtuple('FastAccepted', ['key', 'instance', 'ballot_num', 'accepted_ballot',
+                                           'proposal'])
+FastPrepare = namedtuple('FastPrepare', ['key', 'instance', 'ballot_num'])
+FastPromise = namedtuple('FastPromise', ['key', 'instance', 'ballot_num', 'accepted_ballot',
+                                         'proposal'])
+FastDecision = namedtuple('FastDecision', ['key', 'instance', 'proposal'])
+FastExecuted = namedtuple('FastExecuted', ['instances'])
+FastProgress = namedtuple('FastProgress', ['instances'])
+FastCompact = namedtuple('FastCompact', ['instances'])
+
+FAST_BALLOT = Ballot(0, '')  # the round in which acceptors vote for the first proposal to arrive
+
+
+def fast_quorum(peers):
+    """The votes that decide an instance in FAST_BALLOT: enough that any two
+    such quorums and a majority have an acceptor in common"""
+    quorum = len(peers) // 2 + 1
+    return len(peers) - (quorum + 1) // 2 + 1
+
+
+def execute_unkeyed(execute_fn, state, input_value):
+    """Run a request from the leader's log against a FastState"""
+    inner, output = execute_fn(state.state, input_value)
+    return state._replace(state=inner), output
+
+
+class FastAcceptor(Acceptor):
+    """An Acceptor that also votes in the instances of FastReplica's per-key
+    logs, each a Paxos instance of its own.  In FAST_BALLOT it accepts
+    whichever proposal reaches it first; the higher ballots are for settling
+    an instance that proposal didn't decide."""
+
+    def __init__(self, node, wal=None):
+        self.votes = {}  # {(key, instance): [promised ballot, accepted ballot, proposal]}
+        super(FastAcceptor, self).__init__(node, wal=wal)
+
+    def replay(self, records):
+        for record in records:
+            if record[0] == 'vote':
+                self.votes[record[1], record[2]] = list(record[3:])
+            else:
+                super(FastAcceptor, self).replay([record])
+
+    def records(self):
+        return super(FastAcceptor, self).records() + [
+            ('vote', key, instance) + tuple(vote) for (key, instance), vote in self.votes.items()]
+
+    def vote(self, key, instance):
+        return self.votes.setdefault((key, instance), [NULL_BALLOT, NULL_BALLOT, None])
+
+    def do_FastPrepare(self, sender, key, instance, ballot_num):
+        vote = self.vote(key, instance)
+        if ballot_num > vote[0]:
+            vote[0] = ballot_num
+            self.log(('vote', key, instance) + tuple(vote))
+        self.reply([sender], FastPromise(key=key, instance=instance, ballot_num=vote[0],
+                                         accepted_ballot=vote[1], proposal=vote[2]))
+
+    def do_FastAccept(self, sender, key, instance, ballot_num, proposal):
+        vote = self.vote(key, instance)
+        if ballot_num == FAST_BALLOT:
+            # first come, first voted for, unless someone is already settling it
+            accept = vote[0] <= FAST_BALLOT and vote[1] == NULL_BALLOT
+        else:
+            accept = ballot_num >= vote[0]
+        if accept:
+            vote[:] = [ballot_num, ballot_num, proposal]
+            self.log(('vote', key, instance) + tuple(vote))
+        self.reply([sender], FastAccepted(key=key, instance=instance, ballot_num=vote[0],
+                                          accepted_ballot=vote[1], proposal=vote[2]))
+
+    def do_FastCompact(self, sender, instances):
+        for key, instance in [v for v in self.votes if v[1] < instances.get(v[0], 0)]:
+            del self.votes[key, instance]
+        if self.wal:
+            self.wal.checkpoint(self.records())
+
+
+class Instance(object):
+    """A FastReplica's attempt at getting one instance of a key's log decided"""
+
+    def __init__(self, key, number, proposal, sent_at):
+        self.key = key
+        self.number = number
+        self.proposal = proposal  # ours, or None if we only want to learn the decision
+        self.value = proposal  # what we are asking the acceptors to accept
+        self.ballot_num = FAST_BALLOT
+        self.preempted_by = NULL_BALLOT
+        self.phase = FastAccept  # or FastPrepare; None once decided
+        self.replies = {}  # {acceptor: (accepted ballot, proposal)} in this phase
+        self.sent_at = sent_at  # of the fast round, for round-trip times
+        self.retransmits = 0
+        self.timer = None
+
+
+class FastReplica(Replica):
+    """A Replica that decides requests with a key in a log of that key's own,
+    without going through the leader: the generalized-consensus idea that
+    requests on different keys commute, so only those on the same key need
+    ordering.  key_fn gives the key an input reads or writes, or None for
+    inputs that go through the leader's log as usual; those must commute
+    with every keyed input.
+
+    A request's replica sends it straight to the acceptors for the next
+    instance of its key, in FAST_BALLOT.  If a fast quorum (see fast_quorum)
+    votes for it, it is decided after one round trip.  If another request on
+    the same key got votes for the same instance, or the round times out, the
+    replica settles the instance with a classic Paxos round, in a ballot of
+    its own, and a request that lost goes into a later instance through a
+    classic round as well.  Each key's instances are applied in order; keys
+    don't wait for each other.
+
+    This is an experiment, used only when asked for.  A fast quorum is most
+    of the replicas, and reads go through it too, without the leader's
+    lease; so on a lossy network of many replicas it can be slower than the
+    leader's log, as in run.py's simulation."""
+
+    def __init__(self, node, execute_fn, state, slot, decisions, peers,
+                 key_fn=operator.itemgetter(1), **kwargs):
+        if not isinstance(state, FastState):
+            state = FastState(state, {}, {})  # the seed's initial state
+        state = FastState(thaw(state.state), dict(state.instances),
+                          dict((key, OrderedDict(thaw(sessions)))
+                               for key, sessions in state.sessions.items()))
+        self.key_fn = key_fn
+        self.keyed_execute_fn = execute_fn
+        self.quorum = len(peers) // 2 + 1
+        self.fast_quorum = fast_quorum(peers)
+        self.next_instance = dict(state.instances)  # {key: next instance to apply}
+        self.next_proposal = dict(state.instances)  # {key: next instance to propose in}
+        self.fast_decisions = {}  # {(key, instance): proposal} not yet applied
+        self.instances = {}  # {(key, instance): Instance} we are trying to decide
+        self.fast_proposed = set()  # (caller, client_id) of our requests not yet applied
+        # state.sessions as applied so far, for answering retransmissions
+        self.fast_sessions = dict((key, OrderedDict(sessions))
+                                  for key, sessions in state.sessions.items())
+        self.fast_applied_count = 0  # since the last snapshot
+        self.peer_instances = {}  # {peer: instances applied in its latest snapshot}
+        self.compacted_instances = {}
+        self.stalled = set()  # (key, instance) waited on at the last check
+        self.progressed = set()  # keys applied further since the last check
+        self.peer_progress = {}  # {key: instances a peer has applied, beyond ours}
+        super(FastReplica, self).__init__(node, functools.partial(execute_unkeyed, execute_fn),
+                                          state, slot, decisions, peers, **kwargs)
+        self.set_timer(CATCHUP_INTERVAL, self.fast_catch_up)
+
+    # making proposals
+
+    def do_Invoke(self, sender, caller, client_id, input_value):
+        key = self.key_fn(input_value)
+        if key is None:
+            return super(FastReplica, self).do_Invoke(sender, caller, client_id, input_value)
+        proposal = Proposal(caller, client_id, input_value)
+        if (caller, client_id) in self.fast_sessions.get(key, ()):
+            self.reply(proposal)
+        elif (caller, client_id) in self.applying:
+            pass  # decided; it is answered once applied
+        elif (caller, client_id) not in self.fast_proposed:
+            self.fast_proposed.add((caller, client_id))
+            self.propose_fast(key, freeze(proposal))
+
+    def do_Read(self, sender, caller, client_id, input_value):
+        if self.key_fn(input_value) is None:
+            return super(FastReplica, self).do_Read(sender, caller, client_id, input_value)
+        # a lease only covers the leader's log; order the read in its key's
+        self.do_Invoke(sender, caller, client_id, input_value)
+
+    def propose_fast(self, key, proposal, fast=True):
+        number = max(self.next_proposal.get(key, 0), self.next_instance.get(key, 0))
+        self.next_proposal[key] = number + 1
+        inst = self.instances[key, number] = Instance(key, number, proposal,
+                                                      self.node.network.now)
+        self.logger.info("proposing %s at instance %d of %r" % (proposal, number, key))
+        if fast:
+            self.send_phase(inst)
+        else:
+            self.recover(inst)
+
+    def send_phase(self, inst):
+        """(Re)send the current phase's message to the acceptors yet to reply"""
+        peers = [p for p in self.peers if p not in inst.replies]
+        if inst.phase is FastPrepare:
+            message = FastPrepare(key=inst.key, instance=inst.number, ballot_num=inst.ballot_num)
+        else:
+            message = FastAccept(key=inst.key, instance=inst.number,
+                                 ballot_num=inst.ballot_num, proposal=inst.value)
+        self.node.send(peers, message)
+        timeout = self.node.rtt.timeout(self.peers, ACCEPT_RETRANSMIT)
+        if inst.timer:
+            inst.timer.cancel()
+        inst.timer = self.set_timer(backoff(timeout, inst.retransmits),
+                                    functools.partial(self.timed_out, inst))
+
+    def timed_out(self, inst):
+        inst.timer = None
+        inst.retransmits += 1
+        # the votes missing from a fast round were most likely just lost;
+        # ask again once before settling the instance in a classic round
+        uncontested = all(p == inst.value for b, p in inst.replies.values())
+        if inst.ballot_num == FAST_BALLOT and uncontested and inst.retransmits == 1:
+            self.send_phase(inst)
+        elif inst.ballot_num == FAST_BALLOT or inst.preempted_by > inst.ballot_num:
+            self.recover(inst)
+        else:
+            self.send_phase(inst)
+
+    def recover(self, inst):
+        """Settle an instance with a classic round, in a ballot above any seen"""
+        n = max(inst.ballot_num.n, inst.preempted_by.n) + 1
+        inst.ballot_num = Ballot(n, self.node.address)
+        inst.phase = FastPrepare
+        inst.replies = {}
+        self.send_phase(inst)
+
+    def do_FastPromise(self, sender, key, instance, ballot_num, accepted_ballot, proposal):
+        inst = self.instances.get((key, instance))
+        if not inst or inst.phase is not FastPrepare:
+            return
+        if ballot_num > inst.ballot_num:
+            inst.preempted_by = max(inst.preempted_by, ballot_num)
+        elif ballot_num == inst.ballot_num:
+            inst.replies[sender] = (accepted_ballot, proposal)
+            if len(inst.replies) >= self.quorum:
+                inst.value = self.recovered_value(inst)
+                inst.phase = FastAccept
+                inst.replies = {}
+                self.send_phase(inst)
+
+    def recovered_value(self, inst):
+        """The proposal that a classic round must propose, given a quorum of
+        promises: the one accepted in the highest ballot if that was a
+        classic ballot; in FAST_BALLOT, the one proposal that may have got a
+        fast quorum of votes; failing that, ours"""
+        replies = list(inst.replies.values())
+        highest = max(b for b, p in replies)
+        if highest > FAST_BALLOT:
+            return next(p for b, p in replies if b == highest)
+        votes = [p for b, p in replies if b == FAST_BALLOT]
+        # a fast quorum leaves at least this many votes among these replies
+        needed = len(replies) - (len(self.peers) - self.fast_quorum)
+        for proposal in votes:
+            if votes.count(proposal) >= needed:
+                return proposal
+        if inst.proposal is not None:
+            return inst.proposal
+        return votes[0] if votes else NOOP_PROPOSAL
+
+    def do_FastAccepted(self, sender, key, instance, ballot_num, accepted_ballot, proposal):
+        inst = self.instances.get((key, instance))
+        if not inst or inst.phase is not FastAccept:
+            return
+        if inst.ballot_num == FAST_BALLOT and not inst.retransmits and sender not in inst.replies:
+            self.node.rtt.sample(sender, self.node.network.now - inst.sent_at)
+        if inst.ballot_num != FAST_BALLOT and ballot_num > inst.ballot_num:
+            inst.preempted_by = max(inst.preempted_by, ballot_num)
+            return
+        inst.replies[sender] = (accepted_ballot, proposal)
+        chosen = self.chosen(inst.replies.values())
+        if chosen is not None:
+            inst.phase = None
+            inst.timer.cancel()
+            self.node.send(self.peers, FastDecision(key=key, instance=instance, proposal=chosen))
+        elif inst.ballot_num == FAST_BALLOT:
+            ours = list(inst.replies.values()).count((FAST_BALLOT, inst.value))
+            if ours + len(self.peers) - len(inst.replies) < self.fast_quorum:
+                # another request on this key got votes here too
+                self.logger.info("collision at instance %d of %r" % (instance, key))
+                self.recover(inst)
+            elif len(inst.replies) == self.quorum:
+                # the rest are late, or lost; don't wait for them longer than
+                # the slowest of these took, which may be far less than the
+                # default timeout for peers we have no round-trip times for
+                timeout = self.node.rtt.timeout(list(inst.replies), ACCEPT_RETRANSMIT)
+                if inst.timer.expires > self.node.network.now + timeout:
+                    inst.timer.cancel()
+                    inst.timer = self.set_timer(timeout, functools.partial(self.timed_out, inst))
+
+    def chosen(self, replies):
+        """The proposal these replies show to have been decided, if any"""
+        replies = list(replies)
+        for ballot_num, proposal in replies:
+            needed = self.fast_quorum if ballot_num == FAST_BALLOT else self.quorum
+            if ballot_num != NULL_BALLOT and replies.count((ballot_num, proposal)) >= needed:
+                return proposal
+
+    # handling decided proposals
+
+    def do_FastDecision(self, sender, key, instance, proposal):
+        if instance < self.next_instance.get(key, 0):
+            return  # applied already
+        self.fast_decisions[key, instance] = proposal
+        self.next_proposal[key] = max(self.next_proposal.get(key, 0), instance + 1)
+        inst = self.instances.pop((key, instance), None)
+        if inst:
+            if inst.timer:
+                inst.timer.cancel()
+            if inst.proposal is not None and inst.proposal != proposal:
+                # lost the instance to a conflicting request; another fast
+                # round would likely collide again, so use a classic one
+                self.propose_fast(key, inst.proposal, fast=False)
+        self.apply_fast_decided(key)
+
+    def reply(self, proposal):
+        key = self.key_fn(proposal.input)
+        if key is None:
+            return super(FastReplica, self).reply(proposal)
+        output = self.fast_sessions[key][proposal.caller, proposal.client_id]
+        self.node.send([proposal.caller], Invoked(client_id=proposal.client_id, output=output))
+
+    def apply_fast_decided(self, key):
+        number = self.next_instance.get(key, 0)
+        while (key, number) in self.fast_decisions:
+            proposal = self.fast_decisions.pop((key, number))
+            if proposal.caller is not None:
+                self.applying.add((proposal.caller, proposal.client_id))
+            self.progressed.add(key)
+            self.applier.submit(functools.partial(self.apply_fast, key, number, proposal),
+                                functools.partial(self.fast_applied, key, proposal))
+            number += 1
+        self.next_instance[key] = number
+
+    def apply_fast(self, key, number, proposal):
+        """Run a decided instance through the state machine; called by the
+        applier.  A request decided in an earlier instance of its key too,
+        proposed again by another replica or after a lost decision, gets
+        that instance's output without running again.  The sessions that
+        tell are kept and evicted per key, in the key's log order, which
+        every replica applies alike whatever the order across keys."""
+        state, output = self.state.state, None
+        if proposal.caller is not None:
+            request = (proposal.caller, proposal.client_id)
+            sessions = self.state.sessions.setdefault(key, OrderedDict())
+            if request in sessions:
+                output = sessions[request]
+            else:
+                state, output = self.keyed_execute_fn(state, thaw(proposal.input))
+                sessions[request] = output
+                while len(sessions) > SESSION_LIMIT:
+                    sessions.popitem(last=False)
+        self.state.instances[key] = number + 1
+        self.state = self.state._replace(state=state)
+        return output
+
+    def fast_applied(self, key, proposal, output):
+        if proposal.caller is not None:
+            self.applying.discard((proposal.caller, proposal.client_id))
+            sessions = self.fast_sessions.setdefault(key, OrderedDict())
+            sessions[proposal.caller, proposal.client_id] = output
+            while len(sessions) > SESSION_LIMIT:
+                sessions.popitem(last=False)
+            if (proposal.caller, proposal.client_id) in self.fast_proposed:
+                self.fast_proposed.discard((proposal.caller, proposal.client_id))
+                self.reply(proposal)
+        self.fast_applied_count += 1
+        if self.fast_applied_count >= SNAPSHOT_INTERVAL:
+            self.fast_applied_count = 0
+            self.take_snapshot()
+
+    # snapshots and compaction
+
+    def snapshot_taken(self, slot, state):
+        super(FastReplica, self).snapshot_taken(slot, state)
+        self.node.send(self.peers, FastExecuted(instances=state.instances))
+
+    def do_FastExecuted(self, sender, instances):
+        if sender not in self.peers:
+            return
+        self.peer_instances[sender] = instances
+        if len(self.peer_instances) < len(self.peers):
+            return
+        # every peer has applied the instances of each key below these
+        low = {}
+        for key in instances:
+            number = min(p.get(key, 0) for p in self.peer_instances.values())
+            if number > self.compacted_instances.get(key, 0):
+                low[key] = self.compacted_instances[key] = number
+        if low:
+            self.node.send([self.node.address], FastCompact(instances=low))
+
+    # catching up on missed decisions
+
+    def fast_catch_up(self):
+        """Settle the instances that applying a key has waited on since the
+        last check, with later instances of the key decided or applied by a
+        peer; the FASTDECISION may have been lost, or its proposer may have
+        failed mid-round.  Tell the peers how far we have applied the keys
+        that moved on since the last check, so that a lost decision for the
+        last instance of a key is noticed too."""
+        self.set_timer(CATCHUP_INTERVAL, self.fast_catch_up)
+        if self.progressed:
+            self.node.send([p for p in self.peers if p != self.node.address], FastProgress(
+                instances=dict((key, self.next_instance[key]) for key in self.progressed)))
+            self.progressed = set()
+        self.peer_progress = dict((key, number) for key, number in self.peer_progress.items()
+                                  if number > self.next_instance.get(key, 0))
+        waiting = set((key, self.next_instance.get(key, 0))
+                      for key in [k for k, _ in self.fast_decisions] + list(self.peer_progress))
+        for key, number in waiting & self.stalled:
+            if (key, number) not in self.instances:
+                inst = self.instances[key, number] = Instance(key, number, None,
+                                                              self.node.network.now)
+                self.logger.info("settling instance %d of %r" % (number, key))
+                self.recover(inst)
+        self.stalled = waiting
+
+    def do_FastProgress(self, sender, instances):
+        if sender not in self.peers:
+            return
+        for key, number in instances.items():
+            if number > max(self.next_instance.get(key, 0), self.peer_progress.get(key, 0)):
+                self.peer_progress[key] = number
+
+
+class FastBootstrap(Bootstrap):
+
+    def __init__(self, node, peers, execute_fn, replica_cls=FastReplica,
+                 acceptor_cls=FastAcceptor, **kwargs):
+        super(FastBootstrap, self).__init__(node, peers, execute_fn, replica_cls=replica_cls,
+                                            acceptor_cls=acceptor_cls, **kwargs)
+
+
+class FastSeed(Seed):
+
+    def __init__(self, node, initial_state, execute_fn, peers, bootstrap_cls=FastBootstrap,
+                 **kwargs):
+        super(FastSeed, self).__init__(node, initial_state, execute_fn, peers,
+                                       bootstrap_cls=bootstrap_cls, **kwargs)
+
+
+class FastMember(Member):
+    """A Member whose requests with a key take FastReplica's fast path"""
+
+    def __init__(self, state_machine, network, peers, seed=None, seed_cls=FastSeed,
+                 bootstrap_cls=FastBootstrap, **kwargs):
+        super(FastMember, self).__init__(state_machine, network, peers, seed=seed,
+                                         seed_cls=seed_cls, bootstrap_cls=bootstrap_cls, **kwargs)
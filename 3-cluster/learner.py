@@ -0,0 +1,94 @@
+from cluster import (CATCHUP_INTERVAL, JOIN_RETRANSMIT, LEARNER_TIMEOUT, Bootstrap, Invoke,
+                     Learn, Proposal, Read, Replica, Snapshot, freeze, thaw)
+
+LEARNER_STALENESS = 1.0  # how far a learner may lag its feed and still answer reads
+
+
+class Learner(Replica):
+    """A replica that doesn't vote.  It subscribes to a full replica, its
+    feed, which passes on each decision it hears of, and answers reads from
+    its own state while that is no more than LEARNER_STALENESS behind the
+    feed's.  Learners aren't among the peers, so they don't count toward any
+    quorum."""
+
+    def __init__(self, node, execute_fn, state, slot, decisions, peers, feed, **kwargs):
+        self.feed = feed
+        self.feed_heard = node.network.now
+        self.fresh_at = None  # our state is as fresh as the feed's was then
+        self.progress = None  # a PROGRESS not yet caught up to, as (slot, sent_at)
+        super(Learner, self).__init__(node, execute_fn, state, slot, decisions, peers, **kwargs)
+
+    def do_Invoke(self, sender, caller, client_id, input_value):
+        if (caller, client_id) in self.sessions:
+            self.reply(Proposal(caller, client_id, input_value))
+        else:
+            self.node.send([self.feed], Invoke(caller=caller, client_id=client_id,
+                                               input_value=input_value))
+
+    def do_Read(self, sender, caller, client_id, input_value):
+        if self.fresh_at is not None and self.node.network.now - self.fresh_at <= LEARNER_STALENESS:
+            self.read(caller, client_id, input_value)
+        else:
+            self.node.send([self.feed], Read(caller=caller, client_id=client_id,
+                                             input_value=input_value))
+
+    def execute_decided(self):
+        super(Learner, self).execute_decided()
+        if self.progress and self.slot >= self.progress[0]:
+            self.fresh_at = self.progress[1]
+            self.progress = None
+
+    def do_Progress(self, sender, slot, sent_at):
+        # when it answered, the feed had executed everything below slot, so
+        # once we have too, our state is at least as fresh as its was when we asked
+        if sender != self.feed:
+            return
+        self.feed_heard = self.node.network.now
+        if self.fresh_at is None or sent_at > self.fresh_at:
+            self.progress = (slot, sent_at)
+            self.execute_decided()
+
+    def snapshot_taken(self, slot, state):
+        # no one else waits on our snapshots; just forget what they cover
+        self.snapshot = Snapshot(slot, state, freeze(self.sessions))
+        self.do_Compact(self.node.address, slot)
+
+    def catch_up(self):
+        """Renew our subscription, telling the feed how far we have got so it
+        can send what we're missing; if it has gone quiet, move to the next
+        peer"""
+        self.set_timer(CATCHUP_INTERVAL, self.catch_up)
+        now = self.node.network.now
+        if now - self.feed_heard > LEARNER_TIMEOUT:
+            self.feed = self.peers[(self.peers.index(self.feed) + 1) % len(self.peers)]
+            self.feed_heard = now
+            self.logger.info("feed timed out; trying the next one, %s", self.feed)
+        self.node.send([self.feed], Learn(slot=self.slot, sent_at=now))
+
+
+class LearnerBootstrap(Bootstrap):
+    """Start a Learner on this node, from the WELCOME of whichever peer
+    answers first; a later WELCOME, sent when the learner has fallen behind
+    the feed's compacted log, starts it again from that snapshot"""
+
+    def __init__(self, node, peers, execute_fn, replica_cls=Learner, **kwargs):
+        super(LearnerBootstrap, self).__init__(node, peers, execute_fn,
+                                               replica_cls=replica_cls, **kwargs)
+        self.learner = None
+
+    def join(self):
+        if self.learner:
+            return
+        peer = next(self.peers_cycle)
+        self.node.send([peer], Learn(slot=None, sent_at=self.node.network.now))
+        self.set_timer(self.node.rtt.timeout([peer], JOIN_RETRANSMIT), self.join)
+
+    def do_Welcome(self, sender, state, slot, decisions, sessions):
+        if self.learner:
+            if slot <= self.learner.slot:
+                return
+            self.learner.stop()
+        self.learner = self.replica_cls(
+            self.node, execute_fn=self.execute_fn, peers=self.peers, feed=sender,
+            state=thaw(state), slot=slot, decisions=thaw(decisions),
+            sessions=thaw(sessions), applier_cls=self.applier_cls)
@@ -0,0 +1,126 @@
+import pickle
+
+from cluster import Network
+
+
+def message_size(message):
+    """Bytes the message takes on the wire, pickled as AsyncioNetwork sends it"""
+    return len(pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+
+
+# A link model is anything with transit(network, sender, dest, message),
+# returning the seconds a message takes from sender to dest, or None if it is
+# lost; pass one as Network(seed, link=...).  Models draw from network.rnd,
+# so a simulation still replays exactly from its seed.  Some wrap another
+# model, so they compose: Partition(Bandwidth(Topology(...), ...)), say.
+
+
+class Uniform(object):
+    """delay ± jitter, uniformly distributed, losing a fraction drop of the
+    messages: the Network's own model, but with parameters"""
+
+    def __init__(self, delay=Network.PROP_DELAY, jitter=Network.PROP_JITTER,
+                 drop=Network.DROP_PROB):
+        self.delay = delay
+        self.jitter = jitter
+        self.drop = drop
+
+    def transit(self, network, sender, dest, message):
+        if network.rnd.uniform(0, 1.0) > self.drop:
+            return self.delay + network.rnd.uniform(-self.jitter, self.jitter)
+
+
+class HeavyTailed(object):
+    """At least delay, with a Pareto tail of index alpha above it, losing a
+    fraction drop of the messages.  Most messages take about delay, but a
+    few take many times that, as queues fill and links retransmit: with
+    alpha=2, half take under 1.41 * delay, but one in a hundred over
+    10 * delay.  The lower alpha, the heavier the tail."""
+
+    def __init__(self, delay, alpha=2.0, drop=0):
+        self.delay = delay
+        self.alpha = alpha
+        self.drop = drop
+
+    def transit(self, network, sender, dest, message):
+        if network.rnd.uniform(0, 1.0) > self.drop:
+            return self.delay * network.rnd.paretovariate(self.alpha)
+
+
+class Bandwidth(object):
+    """Adds serialization and queueing to another link model: a message
+    waits for the messages sent before it, then takes its size over
+    bandwidth (bytes per second) to send, before propagating as the other
+    model says.
+
+    With shared, a node's messages to every destination queue for the same
+    network interface, so a broadcast takes as long to send as all its
+    copies; otherwise each destination has a queue of its own.  With a
+    buffer (bytes), messages that would queue beyond it are dropped, as a
+    full router queue drops them."""
+
+    def __init__(self, link, bandwidth, shared=True, buffer=None):
+        self.link = link
+        self.bandwidth = bandwidth
+        self.shared = shared
+        self.buffer = buffer
+        self.busy_until = {}  # queue -> when it will have sent everything in it
+        self.sized = None, 0  # last message sized; a broadcast sends the same one to each dest
+
+    def transit(self, network, sender, dest, message):
+        if message is not self.sized[0]:
+            self.sized = message, message_size(message)
+        size = self.sized[1]
+        queue = sender if self.shared else (sender, dest)
+        free_at = max(self.busy_until.get(queue, network.now), network.now)
+        if self.buffer is not None and (free_at - network.now) * self.bandwidth + size > self.buffer:
+            return None
+        self.busy_until[queue] = sent_at = free_at + size / float(self.bandwidth)
+        delay = self.link.transit(network, sender, dest, message)
+        if delay is not None:
+            return sent_at - network.now + delay
+
+
+class Partition(object):
+    """Loses every message on the links that have been cut, and otherwise
+    follows another link model.  cut() severs links in one direction only,
+    so partitions can be asymmetric: a leader that still reaches its
+    followers, but no longer hears from them, say."""
+
+    def __init__(self, link):
+        self.link = link
+        self.cuts = set()  # (sender, dest)
+
+    def cut(self, senders, dests, both_ways=False):
+        """Lose messages from each of senders to each of dests, and back too
+        if both_ways"""
+        self.cuts.update((s, d) for s in senders for d in dests if s != d)
+        if both_ways:
+            self.cut(dests, senders)
+
+    def heal(self):
+        self.cuts.clear()
+
+    def transit(self, network, sender, dest, message):
+        if (sender, dest) not in self.cuts:
+            return self.link.transit(network, sender, dest, message)
+
+
+class Topology(object):
+    """A wide-area deployment.  regions maps each address to its region,
+    and links maps pairs of regions to the model of the links between them,
+    used both ways unless the reverse pair is given too.  Messages within a
+    region follow local, a fast datacenter network by default."""
+
+    def __init__(self, regions, links, local=None):
+        self.regions = regions
+        self.links = links
+        self.local = local or Uniform(delay=0.0005, jitter=0.0002, drop=0)
+
+    def transit(self, network, sender, dest, message):
+        here, there = self.regions[sender], self.regions[dest]
+        if here == there:
+            link = self.local
+        else:
+            link = self.links.get((here, there)) or self.links[there, here]
+        return link.transit(network, sender, dest, message)
@@ -0,0 +1,64 @@
+RTO_MIN = 0.01  # bounds on retransmit times derived from round-trip times
+RTO_MAX = 10.0
+
+
+def backoff(timeout, retransmits):
+    """timeout, doubled for each retransmission as TCP does, up to RTO_MAX"""
+    # cap the exponent too; a float can't hold 2 ** 1024
+    return min(timeout * 2 ** min(retransmits, 32), RTO_MAX)
+
+
+class RoundTripTime(object):
+    """A smoothed round-trip time and its variation, kept as TCP keeps them
+    (RFC 6298).  Callers only sample exchanges that were not retransmitted,
+    since a reply to a retransmission is ambiguous (Karn)."""
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+
+    def sample(self, rtt):
+        if self.srtt is not None:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        else:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+
+    def timeout(self, default):
+        """How long to wait for a reply before retransmitting, or default if
+        there has been no sample yet"""
+        if self.srtt is None:
+            return default
+        return min(max(self.srtt + 4 * self.rttvar, RTO_MIN), RTO_MAX)
+
+
+class RoundTripTimes(object):
+    """A RoundTripTime for each peer, and how many replies each has missed
+    since it was last sampled"""
+
+    def __init__(self):
+        self.peers = {}
+        self.misses = {}
+
+    def sample(self, peer, rtt):
+        self.misses.pop(peer, None)
+        self.peers.setdefault(peer, RoundTripTime()).sample(rtt)
+
+    def fastest(self, peers, count):
+        """The count peers with the lowest smoothed round-trip times, leaving
+        out those that have missed replies since their last sample; peers not
+        yet sampled come first, so that they get measured"""
+        srtt = lambda p: self.peers[p].srtt if p in self.peers else 0
+        return sorted(peers, key=lambda p: (self.misses.get(p, 0), srtt(p)))[:count]
+
+    def miss(self, peer):
+        self.misses[peer] = self.misses.get(peer, 0) + 1
+
+    def timeout(self, peers, default):
+        """How long to wait for replies from all of peers before retransmitting,
+        or default if none of them has been sampled yet"""
+        rtos = [self.peers[p].timeout(None) for p in peers if p in self.peers]
+        if not rtos:
+            return default
+        return max(rtos)
@@ -0,0 +1,70 @@
+from cluster import *
+from applier import PartitionedApplier, ThreadedApplier
+from asyncio_network import AsyncioNetwork
+from concurrent.futures import ProcessPoolExecutor
+from run import key_value_state_machine
+from sharding import Router, group_address
+import functools
+import sys
+import time
+
+BASE_PORT = 10000
+
+def main():
+    """usage: run_asyncio.py <node-index> <cluster-size> [<requests> [<window> [<groups> [<workers>]]]]
+
+    Start one cluster member per process on localhost; node 0 seeds the
+    cluster.  The key space is split between <groups> (default 1) Paxos
+    groups, each with its own leader.  With <workers>, each slot's requests
+    are applied by key on a pool of that many processes.  With a request
+    count, the member then issues that many requests, up to <window>
+    (default 1) at a time, and reports commit latency and throughput."""
+    logging.basicConfig(
+        format="%(name)s - %(message)s", level=logging.WARNING)
+
+    index, size = int(sys.argv[1]), int(sys.argv[2])
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    window = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    groups = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+    workers = int(sys.argv[6]) if len(sys.argv) > 6 else 0
+    applier_cls = ThreadedApplier
+    if workers:
+        applier_cls = functools.partial(PartitionedApplier, executor=ProcessPoolExecutor(workers))
+    peers = ['N%d' % i for i in range(size)]
+    addresses = dict((group_address(p, g), ('127.0.0.1', BASE_PORT + g * size + i))
+                     for g in range(groups) for i, p in enumerate(peers))
+    network = AsyncioNetwork(addresses, local=[group_address(peers[index], g)
+                                               for g in range(groups)])
+
+    keys = ['k%d' % n for n in range(10)]
+    split_keys = [keys[g * len(keys) // groups] for g in range(1, groups)]
+    member = Router(key_value_state_machine, network, peers, peers[index], split_keys,
+                    seed={} if index == 0 else None, window=max(1, window // groups),
+                    applier_cls=applier_cls)
+    member.start()
+    if not requests:
+        member.thread.join()
+        return
+
+    # wait for every group to have a leader, so the cluster's startup isn't timed
+    for key in [keys[0]] + split_keys:
+        member.invoke(('get', key))
+
+    latencies = []
+    started = time.time()
+    futures = []
+    for n in range(requests):
+        future = member.invoke_async(('set', 'k%d' % (n % 10), n))
+        future.add_done_callback(lambda f, t=time.time(): latencies.append(time.time() - t))
+        futures.append(future)
+    for future in futures:
+        future.result()
+    elapsed = time.time() - started
+    latencies.sort()
+    print("%d requests in %.3fs: %.1f ops/s, median latency %.2fms, p99 %.2fms" % (
+        requests, elapsed, requests / elapsed,
+        latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
+    network.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import bisect
+import copy
+import operator
+import threading
+
+from cluster import Member
+
+
+def group_address(address, group):
+    """The address of a group's roles on the node at ``address``"""
+    return '%s/%d' % (address, group)
+
+
+class Router(object):
+    """Several independent Paxos groups placed on the same nodes, each owning
+    a range of keys, with requests sent to the group that owns their key.
+    ``address`` is this node's address among ``peers``.
+
+    ``split_keys`` divides the key space: group 0 owns the keys below
+    ``split_keys[0]``, group ``i`` those from ``split_keys[i-1]`` up to
+    ``split_keys[i]``, and the last group everything after.  Each group is a
+    Member with its own log and leader, at this node's ``group_address``, so
+    the groups decide slots in parallel rather than queueing behind one
+    leader.  The groups' preferred leaders are spread over the peers, group
+    ``g`` led from ``peers[g % len(peers)]``, so that no one node leads them
+    all.  ``key_fn`` picks the key out of a request's input."""
+
+    def __init__(self, state_machine, network, peers, address, split_keys, seed=None,
+                 key_fn=operator.itemgetter(1), member_cls=Member, **kwargs):
+        self.network = network
+        self.split_keys = sorted(split_keys)
+        self.key_fn = key_fn
+        self.members = []
+        for group in range(len(self.split_keys) + 1):
+            self.members.append(member_cls(
+                state_machine, network, [group_address(p, group) for p in peers],
+                seed=copy.deepcopy(seed), address=group_address(address, group),
+                leader=group_address(peers[group % len(peers)], group), **kwargs))
+
+    def group(self, input_value):
+        return bisect.bisect_right(self.split_keys, self.key_fn(input_value))
+
+    def start(self):
+        # the groups share the network, so there is only one thread to run it
+        for member in self.members:
+            member.startup_role.start()
+        self.thread = threading.Thread(target=self.network.run)
+        self.thread.start()
+
+    def invoke_async(self, input_value, **kwargs):
+        return self.members[self.group(input_value)].invoke_async(input_value, **kwargs)
+
+    def invoke(self, input_value, **kwargs):
+        return self.invoke_async(input_value, **kwargs).result()
@@ -19,11 +19,15 @@ class FakeNetwork(Network):
 
     def tick(self, seconds):
         until = self.now + seconds
+        self.schedule_pending()
         self.timers.sort()
         while self.timers and self.timers[0].expires <= until:
             timer = self.timers.pop(0)
+            timer.on_cancel = None
             self.now = timer.expires
-            if not timer.cancelled:
+            if timer.cancelled:
+                self.cancelled_timers -= 1
+            else:
                 timer.callback()
         self.now = until
 
@@ -20,7 +20,7 @@ class Tests(utils.ComponentTestCase):
         self.ac.ballot_num = Ballot(10, 10)
         self.node.fake_message(Prepare(
                                # newer than the acceptor's ballot_num
-                               ballot_num=Ballot(19, 19)), sender='SC')
+                               ballot_num=Ballot(19, 19), slot=0), sender='SC')
         self.assertMessage(['F999'], Accepting(leader='SC'))
         accepted_proposals = {33: (Ballot(19, 19), proposal)}
         self.verifyAcceptedProposals(accepted_proposals)
@@ -31,13 +31,25 @@ class Tests(utils.ComponentTestCase):
                            accepted_proposals=accepted_proposals))
         self.assertState(Ballot(19, 19), {33: (Ballot(19, 19), proposal)})
 
+    def test_prepare_from_slot(self):
+        """On PREPARE, Acceptor only returns the proposals accepted at or after
+        the slot the scout asks for"""
+        proposal = Proposal('cli', 123, 'INC')
+        self.ac.accepted_proposals = {32: (Ballot(19, 19), proposal),
+                                      33: (Ballot(19, 19), proposal)}
+        self.ac.ballot_num = Ballot(19, 19)
+        self.node.fake_message(Prepare(ballot_num=Ballot(19, 19), slot=33), sender='SC')
+        self.assertMessage(['SC'], Promise(
+                           ballot_num=Ballot(19, 19),
+                           accepted_proposals={33: (Ballot(19, 19), proposal)}))
+
     def test_prepare_old_ballot(self):
         """On PREPARE with an old ballot, Acceptor returns a PROMISE with the
         existing (newer) ballot and does not send an ACCEPTING"""
         self.ac.ballot_num = Ballot(10, 10)
         self.node.fake_message(Prepare(
                                # older than the acceptor's ballot_num
-                               ballot_num=Ballot(5, 10)), sender='SC')
+                               ballot_num=Ballot(5, 10), slot=0), sender='SC')
         accepted_proposals = {}
         self.verifyAcceptedProposals(accepted_proposals)
         self.assertMessage(['SC'], Promise(
@@ -52,11 +64,10 @@ class Tests(utils.ComponentTestCase):
         proposal = Proposal('cli', 123, 'INC')
         self.ac.ballot_num = Ballot(10, 10)
         self.node.fake_message(Accept(
-                               slot=33,
                                ballot_num=Ballot(19, 19),
-                               proposal=proposal), sender='CMD')
+                               proposals={33: proposal}), sender='CMD')
         self.assertMessage(['CMD'], Accepted(
-                           slot=33,
+                           slots=(33,),
                            # replies with updated ballot_num
                            ballot_num=Ballot(19, 19)))
         # and state records acceptance of proposal
@@ -68,12 +79,87 @@ class Tests(utils.ComponentTestCase):
         proposal = Proposal('cli', 123, 'INC')
         self.ac.ballot_num = Ballot(10, 10)
         self.node.fake_message(Accept(
-                               slot=33,
                                ballot_num=Ballot(5, 5),
-                               proposal=proposal), sender='CMD')
+                               proposals={33: proposal}), sender='CMD')
         self.assertMessage(['CMD'], Accepted(
-                           slot=33,
+                           slots=(33,),
                            # replies with newer ballot_num
                            ballot_num=Ballot(10, 10)))
         # and doesn't accept the proposal
         self.assertState(Ballot(10, 10), {})
+
+    def test_accept_batch(self):
+        """On ACCEPT for several slots, Acceptor records them all and returns a
+        single ACCEPTED covering every slot"""
+        proposal1 = Proposal('cli', 123, 'INC')
+        proposal2 = Proposal('cli', 124, 'DEC')
+        self.ac.ballot_num = Ballot(10, 10)
+        self.node.fake_message(Accept(
+                               ballot_num=Ballot(19, 19),
+                               proposals={34: proposal2, 33: proposal1}), sender='CMD')
+        self.assertMessage(['CMD'], Accepted(
+                           slots=(33, 34),
+                           ballot_num=Ballot(19, 19)))
+        self.assertState(Ballot(19, 19), {33: (Ballot(19, 19), proposal1),
+                                          34: (Ballot(19, 19), proposal2)})
+
+    def test_compact(self):
+        """On COMPACT, Acceptor forgets accepted proposals below the slot"""
+        proposal = Proposal('cli', 123, 'INC')
+        self.ac.accepted_proposals = {32: (Ballot(19, 19), proposal),
+                                      33: (Ballot(19, 19), proposal)}
+        self.node.fake_message(Compact(slot=33))
+        self.assertEqual(self.ac.accepted_proposals, {33: (Ballot(19, 19), proposal)})
+
+    def test_active_grants_lease(self):
+        """On ACTIVE from the leader it last promised, Acceptor grants a lease"""
+        self.ac.ballot_num = Ballot(19, 'LDR')
+        self.node.fake_message(Active(ballot_num=Ballot(19, 'LDR'), lease_start=999.5, rto=None),
+                               sender='LDR')
+        self.assertMessage(['LDR'], LeaseGranted(ballot_num=Ballot(19, 'LDR'), lease_start=999.5))
+        self.assertEqual(self.ac.lease_expires, self.network.now + LEASE_DURATION)
+
+    def test_active_old_ballot(self):
+        """On ACTIVE from a superseded leader, Acceptor grants nothing"""
+        self.ac.ballot_num = Ballot(20, 'OTHER')
+        self.node.fake_message(Active(ballot_num=Ballot(19, 'LDR'), lease_start=999.5, rto=None),
+                               sender='LDR')
+        self.assertEqual(self.ac.lease_holder, None)
+
+    def test_prepare_leased(self):
+        """While a lease is held, Acceptor refuses PREPAREs from other leaders,
+        but not from the lease holder, and not once the lease expires"""
+        self.ac.ballot_num = Ballot(19, 'LDR')
+        self.node.fake_message(Active(ballot_num=Ballot(19, 'LDR'), lease_start=999.5, rto=None),
+                               sender='LDR')
+        self.assertMessage(['LDR'], LeaseGranted(ballot_num=Ballot(19, 'LDR'), lease_start=999.5))
+
+        self.node.fake_message(Prepare(ballot_num=Ballot(20, 'SC'), slot=0), sender='SC')
+        self.assertMessage(['SC'], Promise(ballot_num=Ballot(19, 'LDR'), accepted_proposals={}))
+
+        self.node.fake_message(Prepare(ballot_num=Ballot(20, 'LDR'), slot=0), sender='LDR')
+        self.assertMessage(['F999'], Accepting(leader='LDR'))
+        self.assertMessage(['LDR'], Promise(ballot_num=Ballot(20, 'LDR'), accepted_proposals={}))
+
+        self.network.tick(LEASE_DURATION)
+        self.node.fake_message(Prepare(ballot_num=Ballot(21, 'SC'), slot=0), sender='SC')
+        self.assertMessage(['F999'], Accepting(leader='SC'))
+        self.assertMessage(['SC'], Promise(ballot_num=Ballot(21, 'SC'), accepted_proposals={}))
+
+    def test_pre_vote(self):
+        """A PREVOTE is granted if a PREPARE would be, without promising anything"""
+        self.ac.ballot_num = Ballot(19, 'LDR')
+        self.node.fake_message(PreVote(ballot_num=Ballot(18, 'SC')), sender='SC')
+        self.assertMessage(['SC'], PreVoted(requested=Ballot(18, 'SC'),
+                                            ballot_num=Ballot(19, 'LDR'), granted=False))
+        self.node.fake_message(PreVote(ballot_num=Ballot(20, 'SC')), sender='SC')
+        self.assertMessage(['SC'], PreVoted(requested=Ballot(20, 'SC'),
+                                            ballot_num=Ballot(19, 'LDR'), granted=True))
+        self.assertState(Ballot(19, 'LDR'), {})
+        # not while another leader holds a lease
+        self.node.fake_message(Active(ballot_num=Ballot(19, 'LDR'), lease_start=999.5, rto=None),
+                               sender='LDR')
+        self.assertMessage(['LDR'], LeaseGranted(ballot_num=Ballot(19, 'LDR'), lease_start=999.5))
+        self.node.fake_message(PreVote(ballot_num=Ballot(20, 'SC')), sender='SC')
+        self.assertMessage(['SC'], PreVoted(requested=Ballot(20, 'SC'),
+                                            ballot_num=Ballot(19, 'LDR'), granted=False))
@@ -0,0 +1,77 @@
+from cluster import *
+from asyncio_network import AsyncioNetwork
+import threading
+import unittest
+
+
+class TestComp(Role):
+    join_called = False
+
+    def do_Join(self, sender):
+        self.join_called = True
+        self.sender = sender
+        self.node.network.stop()
+
+
+class AsyncioNetworkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.network = AsyncioNetwork({'S': ('127.0.0.1', 0), 'R': ('127.0.0.1', 0)})
+
+    def run_network(self):
+        thread = threading.Thread(target=self.network.run)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), "network did not stop")
+
+    def test_comm(self):
+        """Node can send a message to another node over UDP"""
+        sender = self.network.new_node('S')
+        receiver = self.network.new_node('R')
+        comp = TestComp(receiver)
+        self.network.set_timer(None, 0.01, lambda: sender.send(['R'], Join()))
+        self.run_network()
+        self.assertTrue(comp.join_called)
+        self.assertEqual(comp.sender, 'S')
+
+    def test_local(self):
+        """Messages a node sends to itself are delivered without the socket"""
+        node = self.network.new_node('S')
+        comp = TestComp(node)
+        node.send(['S'], Join())
+        self.run_network()
+        self.assertTrue(comp.join_called)
+
+    def test_cancel_timeout(self):
+        """Cancelled timers do not fire, and the rest fire in order"""
+        node = self.network.new_node('S')
+        fired = []
+        self.network.set_timer(node.address, 0.02, lambda: fired.append(2))
+        self.network.set_timer(node.address, 0.01, lambda: fired.append(1)).cancel()
+        self.network.set_timer(node.address, 0.03, self.network.stop)
+        self.run_network()
+        self.assertEqual(fired, [2])
+
+    def test_call_soon_before_run(self):
+        """Before the loop runs, call_soon queues the callback for the loop's
+        thread rather than running it on the caller's"""
+        threads = []
+        self.network.call_soon(lambda: threads.append(threading.get_ident()))
+        self.assertEqual(threads, [])
+        self.network.call_soon(self.network.stop)
+        self.run_network()
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_remote_frozen(self):
+        """Messages arrive over UDP as read-only as they do locally"""
+        sender = self.network.new_node('S')
+        receiver = self.network.new_node('R')
+        received = []
+        receiver.receive = lambda sender, message: (received.append(message),
+                                                    self.network.stop())
+        self.network.set_timer(None, 0.01, lambda: sender.send(['R'], Welcome(
+            state={'k': [1]}, slot=1, decisions={}, sessions={})))
+        self.run_network()
+        self.assertRaises(TypeError, received[0].state['k'].append, 2)
+        self.assertEqual(thaw(received[0].state), {'k': [1]})
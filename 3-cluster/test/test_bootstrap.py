@@ -21,6 +21,18 @@ class Tests(utils.ComponentTestCase):
             leader_cls=self.Leader, commander_cls=self.Commander,
             scout_cls=self.Scout)
 
+    def test_quorums(self):
+        """Quorums default to a majority, and any sizes whose phase-1 and
+        phase-2 quorums intersect are accepted; others refuse to start"""
+        peers = ['p1', 'p2', 'p3', 'p4', 'p5']
+        self.assertEqual(quorums(peers), (3, 3))
+        with mock.patch('cluster.PHASE1_QUORUM', 4), mock.patch('cluster.PHASE2_QUORUM', 2):
+            self.assertEqual(quorums(peers), (4, 2))
+        for phase1, phase2 in (3, 2), (2, 3), (6, 1):
+            with mock.patch('cluster.PHASE1_QUORUM', phase1), \
+                    mock.patch('cluster.PHASE2_QUORUM', phase2):
+                self.assertRaises(ValueError, Bootstrap, self.node, peers, self.execute_fn)
+
     def test_retransmit(self):
         """After start(), the bootstrap sends JOIN to each node in sequence until hearing WELCOME"""
         self.bs.start()
@@ -29,13 +41,36 @@ class Tests(utils.ComponentTestCase):
             self.network.tick(JOIN_RETRANSMIT)
         self.assertMessage(['p2'], Join())
 
-        self.node.fake_message(Welcome(state='st', slot='sl', decisions={}))
-        self.Acceptor.assert_called_with(self.node)
+        self.node.fake_message(Welcome(state='st', slot='sl', decisions={}, sessions={}))
+        self.Acceptor.assert_called_with(self.node, wal=None)
         self.Replica.assert_called_with(self.node, execute_fn=self.execute_fn, decisions={},
-                                        state='st', slot='sl', peers=['p1', 'p2', 'p3'])
+                                        state='st', slot='sl', peers=['p1', 'p2', 'p3'],
+                                        sessions={}, applier_cls=Applier, leader=None)
         self.Leader.assert_called_with(self.node, peers=['p1', 'p2', 'p3'],
                                        commander_cls=self.Commander,
                                        scout_cls=self.Scout)
         self.Leader().start.assert_called_with()
         self.assertTimers([])
         self.assertUnregistered()
+
+    def test_wal(self):
+        """A write-ahead log given to the bootstrap goes to its acceptor"""
+        wal = mock.Mock(name='wal')
+        bs = Bootstrap(self.node, ['p1', 'p2', 'p3'], self.execute_fn, replica_cls=self.Replica,
+                       acceptor_cls=self.Acceptor, leader_cls=self.Leader, wal=wal)
+        self.bs.stop()
+        bs.start()
+        self.assertMessage(['p1'], Join())
+        self.node.fake_message(Welcome(state='st', slot='sl', decisions={}, sessions={}))
+        self.Acceptor.assert_called_once_with(self.node, wal=wal)
+
+    def test_preferred_leader(self):
+        """The preferred leader scouts as soon as it is welcomed, and every
+        replica starts out proposing to it"""
+        for leader, scouts in ('F999', True), ('p1', False):
+            leader_cls = mock.Mock(autospec=Leader)
+            bs = Bootstrap(self.node, ['p1', 'F999'], self.execute_fn, replica_cls=self.Replica,
+                           acceptor_cls=self.Acceptor, leader_cls=leader_cls, leader=leader)
+            bs.do_Welcome('p1', state='st', slot=1, decisions={}, sessions={})
+            self.assertEqual(self.Replica.call_args[1]['leader'], leader)
+            self.assertEqual(leader_cls.return_value.spawn_scout.called, scouts)
@@ -1,5 +1,6 @@
 from cluster import *
 from . import utils
+from unittest import mock
 
 
 class Tests(utils.ComponentTestCase):
@@ -7,57 +8,175 @@ class Tests(utils.ComponentTestCase):
     def setUp(self):
         super(Tests, self).setUp()
         self.cb_args = None
-        self.slot = 10
+        self.slots = (10, 11)
         self.proposal = Proposal(caller='cli', client_id=123, input='inc')
+        self.proposal2 = Proposal(caller='cli', client_id=124, input='dec')
         self.ballot_num = Ballot(91, 82)
-        self.cmd = Commander(
-            self.node, ballot_num=self.ballot_num,
-            slot=self.slot, proposal=self.proposal,
-            peers=['p1', 'p2', 'p3'])
-        self.accept_message = Accept(slot=self.slot, ballot_num=self.ballot_num,
-                                     proposal=self.proposal)
+        self.cmd = Commander(self.node, peers=['p1', 'p2', 'p3'])
+        self.accept_message = Accept(ballot_num=self.ballot_num,
+                                     proposals={10: self.proposal, 11: self.proposal2})
+
+    def accept(self):
+        self.cmd.accept(self.ballot_num, {10: self.proposal, 11: self.proposal2})
 
     def test_retransmit(self):
-        """After start(), the commander sends ACCEPT repeatedly to all peers which have not responded"""
-        self.cmd.start()
+        """After accept(), the commander sends ACCEPT repeatedly to all peers
+        which have not responded, backing off each time"""
+        self.accept()
         self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
         self.network.tick(ACCEPT_RETRANSMIT)
         self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
 
         self.node.fake_message(
-                Accepted(slot=self.slot, ballot_num=self.ballot_num), sender='p2')
+                Accepted(slots=self.slots, ballot_num=self.ballot_num), sender='p2')
+        self.network.tick(ACCEPT_RETRANSMIT)
+        self.assertNoMessages()
         self.network.tick(ACCEPT_RETRANSMIT)
         self.assertMessage(['p1', 'p3'], self.accept_message)
+        self.network.tick(ACCEPT_RETRANSMIT * 3)
+        self.assertNoMessages()
         self.network.tick(ACCEPT_RETRANSMIT)
         self.assertMessage(['p1', 'p3'], self.accept_message)
         self.node.fake_message(
-            Accepted(slot=self.slot, ballot_num=self.ballot_num), sender='p1')
+            Accepted(slots=self.slots, ballot_num=self.ballot_num), sender='p1')
 
         # quorum (3/2+1 = 2) reached
-        self.assertMessage(['p1', 'p2', 'p3'], Decision(slot=self.slot, proposal=self.proposal))
-        self.assertMessage(['F999'], Decided(slot=self.slot))
+        self.assertMessage(['p1', 'p2', 'p3'], Decision(slot=10, proposal=self.proposal))
+        self.assertMessage(['p1', 'p2', 'p3'], Decision(slot=11, proposal=self.proposal2))
+        self.assertMessage(['F999'], Decided(slots=self.slots))
+        self.assertEqual(self.cmd.in_flight, {})
+        self.network.tick(ACCEPT_RETRANSMIT)
         self.assertTimers([])
-        self.assertUnregistered()
+
+    def test_retransmit_shared(self):
+        """One timer retransmits every in-flight ACCEPT when it is due"""
+        self.accept()
+        self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
+        self.network.tick(ACCEPT_RETRANSMIT / 2)
+        self.cmd.accept(self.ballot_num, {12: self.proposal})
+        later_message = Accept(ballot_num=self.ballot_num, proposals={12: self.proposal})
+        self.assertMessage(['p1', 'p2', 'p3'], later_message)
+        self.network.tick(ACCEPT_RETRANSMIT / 2)
+        self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
+        self.assertNoMessages()
+        self.assertEqual(self.cmd.retransmit_timer.expires, self.network.now + ACCEPT_RETRANSMIT / 2)
+        self.network.tick(ACCEPT_RETRANSMIT / 2)
+        self.assertMessage(['p1', 'p2', 'p3'], later_message)
+
+    def test_backoff_per_slots(self):
+        """Each in-flight ACCEPT backs off on its own; a new one isn't held
+        up behind one that has been retransmitted"""
+        self.accept()
+        self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
+        self.network.tick(ACCEPT_RETRANSMIT)
+        self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
+        self.cmd.accept(self.ballot_num, {12: self.proposal})
+        later_message = Accept(ballot_num=self.ballot_num, proposals={12: self.proposal})
+        self.assertMessage(['p1', 'p2', 'p3'], later_message)
+        self.network.tick(ACCEPT_RETRANSMIT)
+        self.assertMessage(['p1', 'p2', 'p3'], later_message)
+        self.network.tick(ACCEPT_RETRANSMIT)
+        self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
+        self.assertNoMessages()
+        self.network.tick(ACCEPT_RETRANSMIT)
+        self.assertMessage(['p1', 'p2', 'p3'], later_message)
+        self.cmd.stop()
 
     def test_wrong_slot(self):
-        """Commander ignores ACCEPTED messages for other commanders"""
-        self.cmd.start()
+        """Commander ignores ACCEPTED messages for slots it isn't sending"""
+        self.accept()
         self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
-        other_slot = 999
+        other_slots = (999,)
         self.node.fake_message(
-            Accepted(slot=other_slot, ballot_num=self.ballot_num), sender='p1')
+            Accepted(slots=other_slots, ballot_num=self.ballot_num), sender='p1')
         self.network.tick(ACCEPT_RETRANSMIT)
         # p1 still in the list
         self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
 
+    @mock.patch('cluster.DECISION_RELAYS', 2)
+    def test_relay(self):
+        """With DECISION_RELAYS, the decisions go out as one RELAY to that
+        many of the acceptors that answered, each passing it on to a share of
+        the other peers"""
+        self.cmd.stop()
+        self.cmd = Commander(self.node, peers=['F999', 'p1', 'p2', 'p3', 'p4', 'p5'])
+        self.accept()
+        self.node.sent = []
+        for peer in 'F999', 'p5', 'p1', 'p3':
+            self.node.fake_message(Accepted(slots=self.slots, ballot_num=self.ballot_num),
+                                   sender=peer)
+        decisions = {10: self.proposal, 11: self.proposal2}
+        self.assertMessage(['F999'], Relay(decisions=decisions, relay_to=()))
+        self.assertMessage(['p1'], Relay(decisions=decisions, relay_to=('p2', 'p5')))
+        self.assertMessage(['p3'], Relay(decisions=decisions, relay_to=('p4',)))
+        self.assertMessage(['F999'], Decided(slots=self.slots))
+
+    @mock.patch('cluster.PHASE1_QUORUM', 3)
+    @mock.patch('cluster.PHASE2_QUORUM', 1)
+    def test_phase2_quorum(self):
+        """A slot is decided once PHASE2_QUORUM acceptors accept it"""
+        cmd = Commander(self.node, peers=['p1', 'p2', 'p3'])
+        cmd.accept(self.ballot_num, {10: self.proposal})
+        self.assertMessage(['p1', 'p2', 'p3'], Accept(ballot_num=self.ballot_num,
+                                                      proposals={10: self.proposal}))
+        cmd.do_Accepted(sender='p3', slots=(10,), ballot_num=self.ballot_num)
+        self.assertMessage(['p1', 'p2', 'p3'], Decision(slot=10, proposal=self.proposal))
+        self.assertMessage(['F999'], Decided(slots=(10,)))
+        cmd.stop()
+
     def test_preempted(self):
-        """If the commander receives an ACCEPTED response with a different ballot number, then it
-        is preempted"""
-        self.cmd.start()
+        """If the commander receives an ACCEPTED response with a newer ballot number, then it
+        is preempted, and gives up on every slot sent with an older ballot"""
+        self.accept()
         self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
+        self.cmd.accept(self.ballot_num, {12: self.proposal})
+        self.assertMessage(['p1', 'p2', 'p3'], Accept(ballot_num=self.ballot_num,
+                                                      proposals={12: self.proposal}))
         other_ballot_num = Ballot(99, 99)
         self.node.fake_message(
-            Accepted(slot=self.slot, ballot_num=other_ballot_num), sender='p1')
-        self.assertMessage(['F999'], Preempted(slot=self.slot, preempted_by=other_ballot_num))
+            Accepted(slots=self.slots, ballot_num=other_ballot_num), sender='p1')
+        self.assertMessage(['F999'], Preempted(slots=(10, 11, 12), preempted_by=other_ballot_num))
+        self.assertEqual(self.cmd.in_flight, {})
+        self.network.tick(ACCEPT_RETRANSMIT)
         self.assertTimers([])
-        self.assertUnregistered()
+
+    def test_stale_ballot(self):
+        """An ACCEPTED with an older ballot, answering an earlier ACCEPT for the
+        same slots, is ignored"""
+        self.accept()
+        self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
+        self.node.fake_message(
+            Accepted(slots=self.slots, ballot_num=Ballot(90, 82)), sender='p1')
+        self.assertEqual(self.cmd.in_flight[self.slots].acceptors, set())
+
+    def test_rtt_sample(self):
+        """ACCEPTEDs for ACCEPTs sent only once are round-trip samples, which
+        set the retransmit timeout"""
+        self.accept()
+        self.assertMessage(['p1', 'p2', 'p3'], self.accept_message)
+        self.network.tick(0.1)
+        self.node.fake_message(
+            Accepted(slots=self.slots, ballot_num=self.ballot_num), sender='p1')
+        self.assertAlmostEqual(self.cmd.retransmit_timeout(), 0.3)
+        self.network.tick(ACCEPT_RETRANSMIT - 0.1)
+        self.assertMessage(['p2', 'p3'], self.accept_message)
+        # backed off for the retransmission
+        self.assertAlmostEqual(self.cmd.retransmit_timer.expires, self.network.now + 0.6)
+        # a reply now could be to either ACCEPT, so won't be sampled
+        self.assertEqual(self.cmd.in_flight[self.slots].retransmits, 1)
+
+    @mock.patch('cluster.THRIFTY', True)
+    def test_thrifty(self):
+        """In THRIFTY mode, ACCEPT goes to the fastest quorum first, widening
+        to the other peers that haven't answered when it is retransmitted"""
+        cmd = Commander(self.node, peers=['p1', 'p2', 'p3', 'p4'])
+        for peer, rtt in ('p1', 0.3), ('p2', 0.1), ('p3', 0.2), ('p4', 0.4):
+            self.node.rtt.sample(peer, rtt)
+        cmd.accept(self.ballot_num, {10: self.proposal})
+        accept_message = Accept(ballot_num=self.ballot_num, proposals={10: self.proposal})
+        self.assertMessage(['p1', 'p2', 'p3'], accept_message)
+        cmd.do_Accepted(sender='p2', slots=(10,), ballot_num=self.ballot_num)
+        self.network.tick(cmd.retransmit_timeout())
+        self.assertMessage(['p1', 'p3', 'p4'], accept_message)
+        self.assertEqual(self.node.rtt.fastest(cmd.peers, 3), ['p2', 'p4', 'p3'])
+        cmd.stop()
@@ -0,0 +1,295 @@
+from cluster import *
+from fastpath import *
+from links import Partition, Uniform
+from run import key_value_state_machine
+from . import utils
+from unittest import mock
+import unittest
+
+PEERS = ['F999', 'p1', 'p2', 'p3', 'p4']
+SET = Proposal(caller='cli', client_id=1, input=('set', 'k', 5))
+OTHER = Proposal(caller='cli', client_id=2, input=('set', 'k', 6))
+RECOVERY = Ballot(1, 'F999')
+
+
+class AcceptorTests(utils.ComponentTestCase):
+
+    def setUp(self):
+        super(AcceptorTests, self).setUp()
+        self.ac = FastAcceptor(self.node)
+
+    def accept(self, ballot_num, proposal, instance=0):
+        self.node.fake_message(FastAccept(key='k', instance=instance, ballot_num=ballot_num,
+                                          proposal=proposal), sender='p1')
+
+    def test_fast_vote(self):
+        """In FAST_BALLOT, the acceptor votes for the first proposal to reach it"""
+        self.accept(FAST_BALLOT, SET)
+        self.assertMessage(['p1'], FastAccepted(key='k', instance=0, ballot_num=FAST_BALLOT,
+                                                accepted_ballot=FAST_BALLOT, proposal=SET))
+        self.accept(FAST_BALLOT, OTHER)
+        self.assertMessage(['p1'], FastAccepted(key='k', instance=0, ballot_num=FAST_BALLOT,
+                                                accepted_ballot=FAST_BALLOT, proposal=SET))
+        self.accept(FAST_BALLOT, OTHER, instance=1)
+        self.assertMessage(['p1'], FastAccepted(key='k', instance=1, ballot_num=FAST_BALLOT,
+                                                accepted_ballot=FAST_BALLOT, proposal=OTHER))
+
+    def test_prepare(self):
+        """A FASTPREPARE reports the vote, and ends voting in FAST_BALLOT"""
+        self.node.fake_message(FastPrepare(key='k', instance=0, ballot_num=RECOVERY))
+        self.assertMessage(['F999'], FastPromise(key='k', instance=0, ballot_num=RECOVERY,
+                                                 accepted_ballot=NULL_BALLOT, proposal=None))
+        self.accept(FAST_BALLOT, SET)
+        self.assertMessage(['p1'], FastAccepted(key='k', instance=0, ballot_num=RECOVERY,
+                                                accepted_ballot=NULL_BALLOT, proposal=None))
+
+    def test_classic_accept(self):
+        """A FASTACCEPT in a promised ballot replaces the vote"""
+        self.accept(FAST_BALLOT, SET)
+        self.node.sent = []
+        self.accept(RECOVERY, OTHER)
+        self.assertMessage(['p1'], FastAccepted(key='k', instance=0, ballot_num=RECOVERY,
+                                                accepted_ballot=RECOVERY, proposal=OTHER))
+        self.accept(Ballot(0, 'F999'), SET)
+        self.assertMessage(['p1'], FastAccepted(key='k', instance=0, ballot_num=RECOVERY,
+                                                accepted_ballot=RECOVERY, proposal=OTHER))
+
+    def test_compact(self):
+        """FASTCOMPACT forgets the votes below each key's instance"""
+        for instance in range(3):
+            self.accept(FAST_BALLOT, SET, instance=instance)
+        self.node.sent = []
+        self.node.fake_message(FastCompact(instances={'k': 2, 'j': 5}))
+        self.assertEqual(list(self.ac.votes), [('k', 2)])
+
+    def test_wal(self):
+        """Votes are logged, and restored from the log"""
+        wal = mock.Mock(name='wal')
+        wal.replay.return_value = []
+        self.ac.stop()
+        self.ac = FastAcceptor(self.node, wal=wal)
+        self.accept(FAST_BALLOT, SET)
+        record = ('vote', 'k', 0, FAST_BALLOT, FAST_BALLOT, SET)
+        wal.append.assert_called_once_with(record)
+        self.network.tick(WAL_SYNC_DELAY)
+        self.node.sent = []
+        wal.replay.return_value = [record]
+        self.assertEqual(FastAcceptor(self.node, wal=wal).votes, {('k', 0): list(record[3:])})
+
+
+class ReplicaTests(utils.ComponentTestCase):
+
+    def setUp(self):
+        super(ReplicaTests, self).setUp()
+        self.rep = FastReplica(self.node, key_value_state_machine, state={}, slot=1,
+                               decisions={}, peers=PEERS)
+
+    def tearDown(self):
+        self.assertNoMessages()
+
+    def invoke(self, proposal):
+        self.node.fake_message(Invoke(caller=proposal.caller, client_id=proposal.client_id,
+                                      input_value=proposal.input))
+
+    def replies(self, message_cls, instance, ballot_num, votes):
+        for peer, (accepted_ballot, proposal) in zip(PEERS, votes):
+            self.node.fake_message(message_cls(key='k', instance=instance, ballot_num=ballot_num,
+                                               accepted_ballot=accepted_ballot,
+                                               proposal=proposal), sender=peer)
+
+    def test_fast_quorum(self):
+        """Any two fast quorums and a majority intersect"""
+        self.assertEqual([fast_quorum(range(n)) for n in range(1, 8)], [1, 2, 3, 3, 4, 5, 6])
+
+    def test_fast_path(self):
+        """A request with no conflict is decided by a fast quorum of votes, in
+        one round trip, and answered once applied"""
+        self.invoke(SET)
+        self.assertMessage(PEERS, FastAccept(key='k', instance=0, ballot_num=FAST_BALLOT,
+                                             proposal=SET))
+        self.replies(FastAccepted, 0, FAST_BALLOT, [(FAST_BALLOT, SET)] * 4)
+        self.assertMessage(PEERS, FastDecision(key='k', instance=0, proposal=SET))
+        self.node.fake_message(FastDecision(key='k', instance=0, proposal=SET))
+        self.assertMessage(['cli'], Invoked(client_id=1, output=5))
+        self.assertEqual(self.rep.state, FastState({'k': 5}, {'k': 1}, {'k': {('cli', 1): 5}}))
+        # a retransmission is answered from the session
+        self.invoke(SET)
+        self.assertMessage(['cli'], Invoked(client_id=1, output=5))
+
+    def test_unkeyed(self):
+        """Requests without a key go through the leader's log"""
+        self.rep.key_fn = lambda input_value: None
+        self.invoke(SET)
+        self.network.tick(INVOKE_BATCH_WINDOW)
+        self.assertMessage(['F999'], Propose(slot=1, proposal=SET))
+        self.node.fake_message(Decision(slot=1, proposal=SET))
+        self.assertMessage(['cli'], Invoked(client_id=1, output=5))
+        self.assertEqual(self.rep.state, FastState({'k': 5}, {}, {}))
+
+    def test_duplicate(self):
+        """A request decided in two instances of its key is applied once"""
+        self.node.fake_message(FastDecision(key='k', instance=0, proposal=SET))
+        self.node.fake_message(FastDecision(key='k', instance=1, proposal=OTHER))
+        self.node.fake_message(FastDecision(key='k', instance=2, proposal=SET))
+        sessions = {'k': {('cli', 1): 5, ('cli', 2): 6}}
+        self.assertEqual(self.rep.state, FastState({'k': 6}, {'k': 3}, sessions))
+        self.assertEqual(self.rep.fast_sessions, sessions)
+        self.assertEqual(self.rep.sessions, {})  # those are the leader's log's
+
+    @mock.patch('fastpath.SESSION_LIMIT', 1)
+    def test_sessions_per_key(self):
+        """Sessions are evicted per key, in that key's log order, so requests
+        on other keys, applied in whatever order, can't push them out"""
+        self.node.fake_message(FastDecision(key='k', instance=0, proposal=SET))
+        self.node.fake_message(FastDecision(key='j', instance=0, proposal=Proposal(
+            caller='cli', client_id=3, input=('set', 'j', 7))))
+        self.node.fake_message(FastDecision(key='k', instance=1, proposal=SET))
+        self.assertEqual(self.rep.state, FastState({'k': 5, 'j': 7}, {'k': 2, 'j': 1}, {
+            'k': {('cli', 1): 5}, 'j': {('cli', 3): 7}}))
+        self.node.fake_message(FastDecision(key='k', instance=2, proposal=OTHER))
+        self.node.fake_message(FastDecision(key='k', instance=3, proposal=SET))
+        self.assertEqual(self.rep.state.state, {'k': 5, 'j': 7})  # evicted by OTHER
+
+    def test_slow_votes(self):
+        """Once a majority has voted, the fast round waits for the rest only
+        as long as those took, then asks them again"""
+        self.invoke(SET)
+        self.node.sent = []
+        self.network.tick(0.1)
+        self.replies(FastAccepted, 0, FAST_BALLOT, [(FAST_BALLOT, SET)] * 3)
+        self.network.tick(0.1 + 4 * 0.05)
+        self.assertMessage(PEERS[3:], FastAccept(key='k', instance=0, ballot_num=FAST_BALLOT,
+                                                 proposal=SET))
+
+    def test_collision(self):
+        """Votes for a conflicting request start a classic round, which must
+        propose the request that may have been decided; the loser goes on to
+        the next instance in a classic round of its own"""
+        self.invoke(SET)
+        self.node.sent = []
+        self.replies(FastAccepted, 0, FAST_BALLOT, [(FAST_BALLOT, OTHER)] * 2)
+        self.assertMessage(PEERS, FastPrepare(key='k', instance=0, ballot_num=RECOVERY))
+        self.replies(FastPromise, 0, RECOVERY,
+                     [(FAST_BALLOT, SET), (FAST_BALLOT, OTHER), (FAST_BALLOT, OTHER)])
+        self.assertMessage(PEERS, FastAccept(key='k', instance=0, ballot_num=RECOVERY,
+                                             proposal=OTHER))
+        self.replies(FastAccepted, 0, RECOVERY, [(RECOVERY, OTHER)] * 3)
+        self.assertMessage(PEERS, FastDecision(key='k', instance=0, proposal=OTHER))
+        self.node.fake_message(FastDecision(key='k', instance=0, proposal=OTHER))
+        self.assertMessage(PEERS, FastPrepare(key='k', instance=1, ballot_num=RECOVERY))
+        self.assertEqual(self.rep.state, FastState({'k': 6}, {'k': 1}, {'k': {('cli', 2): 6}}))
+
+    def test_recover_own(self):
+        """A fast round that times out asks again for the missing votes, then
+        settles the instance in a classic round, which proposes our request
+        if no other could have been decided"""
+        self.invoke(SET)
+        self.node.sent = []
+        self.network.tick(ACCEPT_RETRANSMIT)
+        self.assertMessage(PEERS, FastAccept(key='k', instance=0, ballot_num=FAST_BALLOT,
+                                             proposal=SET))
+        self.network.tick(ACCEPT_RETRANSMIT * 2)
+        self.assertMessage(PEERS, FastPrepare(key='k', instance=0, ballot_num=RECOVERY))
+        self.replies(FastPromise, 0, RECOVERY,
+                     [(NULL_BALLOT, None), (FAST_BALLOT, OTHER), (NULL_BALLOT, None)])
+        self.assertMessage(PEERS, FastAccept(key='k', instance=0, ballot_num=RECOVERY,
+                                             proposal=SET))
+
+    def test_preempted(self):
+        """A classic round overtaken by a higher ballot starts again above it"""
+        self.invoke(SET)
+        self.network.tick(ACCEPT_RETRANSMIT * 3)
+        self.node.sent = []
+        self.replies(FastPromise, 0, Ballot(2, 'p1'), [(NULL_BALLOT, None)])
+        self.assertNoMessages()
+        self.network.tick(ACCEPT_RETRANSMIT * 4)
+        self.assertMessage(PEERS, FastPrepare(key='k', instance=0, ballot_num=Ballot(3, 'F999')))
+
+    def test_catch_up(self):
+        """An instance that applying its key has waited on since the last check
+        is settled by a classic round, here with a no-op"""
+        self.node.fake_message(FastDecision(key='k', instance=1, proposal=SET))
+        self.network.tick(CATCHUP_INTERVAL)
+        self.assertNoMessages()
+        self.network.tick(CATCHUP_INTERVAL)
+        self.assertMessage(PEERS, FastPrepare(key='k', instance=0, ballot_num=RECOVERY))
+        self.replies(FastPromise, 0, RECOVERY, [(NULL_BALLOT, None)] * 3)
+        self.assertMessage(PEERS, FastAccept(key='k', instance=0, ballot_num=RECOVERY,
+                                             proposal=NOOP_PROPOSAL))
+        self.node.fake_message(FastDecision(key='k', instance=0, proposal=NOOP_PROPOSAL))
+        self.assertEqual(self.rep.state, FastState({'k': 5}, {'k': 2}, {'k': {('cli', 1): 5}}))
+
+    def test_progress(self):
+        """Replicas tell each other how far they have applied the keys that
+        moved on, and settle the instances a peer has applied before them,
+        even with no later instance decided"""
+        self.node.fake_message(FastDecision(key='k', instance=0, proposal=SET))
+        self.network.tick(CATCHUP_INTERVAL)
+        self.assertMessage(PEERS[1:], FastProgress(instances={'k': 1}))
+        self.node.fake_message(FastProgress(instances={'k': 2, 'j': 1}), sender='p1')
+        self.network.tick(CATCHUP_INTERVAL)
+        self.assertNoMessages()
+        self.network.tick(CATCHUP_INTERVAL)
+        self.assertEqual(sorted(self.node.sent, key=lambda sent: sent[1].key), [
+            (PEERS, FastPrepare(key='j', instance=0, ballot_num=RECOVERY)),
+            (PEERS, FastPrepare(key='k', instance=1, ballot_num=RECOVERY))])
+        self.node.sent = []
+
+    @mock.patch('fastpath.SNAPSHOT_INTERVAL', 1)
+    def test_compact(self):
+        """Snapshots report the instances applied, and once every peer has
+        applied an instance, the acceptors can forget it"""
+        self.node.fake_message(FastDecision(key='k', instance=0, proposal=SET))
+        self.assertMessage(PEERS, Executed(slot=1))
+        self.assertMessage(PEERS, FastExecuted(instances={'k': 1}))
+        self.assertEqual(self.rep.snapshot.state, FastState({'k': 5}, {'k': 1}, {'k': {('cli', 1): 5}}))
+        for peer in PEERS:
+            self.node.fake_message(FastExecuted(instances={'k': 1}), sender=peer)
+        self.assertMessage(['F999'], FastCompact(instances={'k': 1}))
+
+
+class IntegrationTests(unittest.TestCase):
+
+    def test_conflicts(self):
+        """Replicas agree on the order of conflicting requests, decided
+        without a leader, while requests on other keys go on in parallel"""
+        network = Network(1234)
+        peers = ['N%d' % n for n in range(5)]
+        nodes = [network.new_node(address=p) for p in peers]
+        FastSeed(nodes[0], initial_state={}, peers=peers, execute_fn=key_value_state_machine)
+        for node in nodes[1:]:
+            FastBootstrap(node, execute_fn=key_value_state_machine, peers=peers).start()
+        outputs = []
+        for n, node in enumerate(nodes[1:]):
+            for input_value in ('set', 'x', n), ('set', 'k%d' % n, n):
+                network.set_timer(None, 1.0, lambda node=node, input_value=input_value:
+                                  Requester(node, input_value, outputs.append).start())
+            network.set_timer(None, 3.0, lambda node=node: Requester(
+                node, ('get', 'x'), outputs.append, read_only=True).start())
+        network.set_timer(None, 10.0, network.stop)
+        network.run()
+        self.assertEqual(sorted(outputs[:8]), [0, 0, 1, 1, 2, 2, 3, 3])
+        # every node reads the same final value
+        self.assertEqual(len(set(outputs[8:])), 1)
+        self.assertEqual(len(outputs), 12)
+
+    def test_idle_catch_up(self):
+        """A replica that missed the decision for the last instance of a key
+        catches up once it hears a peer has applied it"""
+        link = Partition(Uniform())
+        network = Network(1234, link=link)
+        peers = ['N%d' % n for n in range(5)]
+        nodes = [network.new_node(address=p) for p in peers]
+        FastSeed(nodes[0], initial_state={}, peers=peers, execute_fn=key_value_state_machine)
+        for node in nodes[1:]:
+            FastBootstrap(node, execute_fn=key_value_state_machine, peers=peers).start()
+        outputs = []
+        network.set_timer(None, 1.0, lambda: link.cut(['N1'], ['N4']))
+        network.set_timer(None, 1.0, lambda: Requester(nodes[1], ('set', 'x', 1),
+                                                       outputs.append).start())
+        network.set_timer(None, 3.0, link.heal)
+        network.set_timer(None, 10.0, network.stop)
+        network.run()
+        self.assertEqual(outputs, [1])
+        replica = next(r for r in nodes[4].roles if isinstance(r, FastReplica))
+        self.assertEqual(replica.state.state, {'x': 1})
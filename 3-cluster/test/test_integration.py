@@ -1,4 +1,6 @@
 from cluster import *
+from learner import Learner, LearnerBootstrap, LEARNER_STALENESS
+from unittest import mock
 import unittest
 import itertools
 
@@ -87,6 +89,35 @@ class Tests(unittest.TestCase):
         self.assertEqual((len(results), results and max(results)), (N, N*(N+1)//2), "got %r" % (results,))
 
 
+    @mock.patch('cluster.DECISION_RELAYS', 2)
+    def test_relayed_decisions(self):
+        """Full run with decisions fanning out through relays succeeds."""
+        N = 10
+        nodes = self.setupNetwork(9)
+        results = []
+        for n in range(1, N+1):
+            req = Requester(nodes[n % 8], n, results.append)
+            self.network.set_timer(None, 1.0, req.start)
+
+        self.network.set_timer(None, 10.0, self.network.stop)
+        self.network.run()
+        self.assertEqual((len(results), results and max(results)), (N, N*(N+1)//2), "got %r" % (results,))
+
+    @mock.patch('cluster.PHASE1_QUORUM', 4)
+    @mock.patch('cluster.PHASE2_QUORUM', 2)
+    def test_flexible_quorums(self):
+        """Full run with a large phase-1 and a small phase-2 quorum succeeds."""
+        N = 10
+        nodes = self.setupNetwork(5)
+        results = []
+        for n in range(1, N+1):
+            req = Requester(nodes[n % 4], n, results.append)
+            self.network.set_timer(None, 1.0, req.start)
+
+        self.network.set_timer(None, 10.0, self.network.stop)
+        self.network.run()
+        self.assertEqual((len(results), results and max(results)), (N, N*(N+1)//2), "got %r" % (results,))
+
     def test_failed_nodes(self):
         """Full run with requests and some nodes dying midway through succeeds"""
         N = 10
@@ -105,6 +136,53 @@ class Tests(unittest.TestCase):
         self.assertEqual((len(results), results and max(results)), (N, N*(N+1)/2),
                          "got %r" % (results,))
 
+    def test_mutable_state(self):
+        """State and outputs holding lists and dicts keep their types on every
+        replica, including those that join from a snapshot"""
+        def append(state, input):
+            state['log'].append(input)
+            return state, {'log': list(state['log'])}
+        peers = ['N%d' % n for n in range(3)]
+        nodes = [self.addNode(p) for p in peers]
+        Seed(nodes[0], initial_state={'log': []}, peers=peers, execute_fn=append)
+        for node in nodes[1:]:
+            Bootstrap(node, execute_fn=append, peers=peers).start()
+        outputs = []
+        for n, node in enumerate(nodes):
+            self.network.set_timer(None, n + 1, Requester(node, [n], outputs.append).start)
+        self.network.set_timer(None, 10, self.network.stop)
+        self.network.run()
+        final = outputs[-1]
+        self.assertEqual(sorted(final['log']), [[0], [1], [2]])
+        self.assertIs(type(final['log'][0]), list)
+        for node in nodes:
+            replica = [r for r in node.roles if isinstance(r, Replica)][0]
+            self.assertEqual(replica.state, final)
+
+    def test_learner(self):
+        """A learner follows the cluster without joining its quorums, passing
+        requests on and answering reads from its own state"""
+        nodes = self.setupNetwork(5)
+        learner = self.addNode('L0')
+        LearnerBootstrap(learner, execute_fn=nodes[0].roles[0].execute_fn,
+                         peers=['N%d' % n for n in range(5)]).start()
+        results = []
+        for n in range(1, 6):
+            self.network.set_timer(None, n + 2, Requester(learner, n, results.append).start)
+        self.network.set_timer(None, 10, lambda: Requester(
+            learner, 0, results.append, read_only=True).start())
+        self.network.set_timer(None, 12, self.network.stop)
+        self.network.run()
+        self.assertEqual((len(results), max(results[:5]), results[5]), (6, 15, 15))
+        learner_role = [r for r in learner.roles if isinstance(r, Learner)][0]
+        self.assertEqual(learner_role.state, 15)
+        for node in nodes:
+            for role in node.roles:
+                if isinstance(role, (Commander, Scout)):
+                    self.assertNotIn('L0', role.peers)
+        # the read was answered by the learner itself
+        self.assertGreater(learner_role.fresh_at, 1010 - LEARNER_STALENESS)
+
     def test_failed_leader(self):
         """Full run with requests and a dying leader succeeds."""
         N = 10
@@ -20,18 +20,19 @@ class Tests(utils.ComponentTestCase):
                           commander_cls=Commander,
                           scout_cls=Scout)
 
-    def assertScoutStarted(self, ballot_num):
-        Scout.assert_called_once_with(self.node, ballot_num, ['p1', 'p2'])
-        scout = Scout(self.node, ballot_num, ['p1', 'p2'])
+    def assertScoutStarted(self, ballot_num, slot=0):
+        Scout.assert_called_once_with(self.node, ballot_num, ['p1', 'p2'], slot)
+        scout = Scout(self.node, ballot_num, ['p1', 'p2'], slot)
         scout.start.assert_called_once_with()
 
     def assertNoScout(self):
         self.assertFalse(self.ldr.scouting)
 
-    def assertCommanderStarted(self, ballot_num, slot, proposal):
-        Commander.assert_called_once_with(self.node, ballot_num, slot, proposal, ['p1', 'p2'])
-        cmd = Commander(self.node, ballot_num, slot, proposal, ['p1', 'p2'])
-        cmd.start.assert_called_with()
+    def assertAccepting(self, ballot_num, proposals):
+        self.ldr.commander.accept.assert_called_once_with(ballot_num, proposals)
+
+    def assertNotAccepting(self):
+        self.assertFalse(self.ldr.commander.accept.called)
 
     def activate_leader(self):
         self.ldr.active = True
@@ -53,28 +54,60 @@ class Tests(utils.ComponentTestCase):
         self.assertScoutStarted(Ballot(0, 'F999'))
 
     def test_propose_active(self):
-        """A PROPOSE received while active spawns a commander."""
+        """A PROPOSE received while active is sent for acceptance once the
+        batch window closes."""
         self.activate_leader()
         self.node.fake_message(Propose(slot=10, proposal=PROPOSAL1))
-        self.assertCommanderStarted(Ballot(0, 'F999'), 10, PROPOSAL1)
+        self.assertNotAccepting()
+        self.network.tick(ACCEPT_BATCH_WINDOW)
+        self.assertAccepting(Ballot(0, 'F999'), {10: PROPOSAL1})
+
+    def test_propose_batched(self):
+        """PROPOSEs arriving within the batch window share one ACCEPT."""
+        self.activate_leader()
+        self.node.fake_message(Propose(slot=10, proposal=PROPOSAL1))
+        self.node.fake_message(Propose(slot=11, proposal=PROPOSAL2))
+        self.network.tick(ACCEPT_BATCH_WINDOW)
+        self.assertAccepting(Ballot(0, 'F999'), {10: PROPOSAL1, 11: PROPOSAL2})
+        self.assertTimers([])
+
+    @mock.patch('cluster.ACCEPT_BATCH_SIZE', 2)
+    def test_propose_batch_full(self):
+        """A full batch is sent without waiting for the window."""
+        self.activate_leader()
+        self.node.fake_message(Propose(slot=10, proposal=PROPOSAL1))
+        self.node.fake_message(Propose(slot=11, proposal=PROPOSAL2))
+        self.assertAccepting(Ballot(0, 'F999'), {10: PROPOSAL1, 11: PROPOSAL2})
+        self.assertTimers([])
 
     def test_propose_already(self):
         """A PROPOSE for a slot already in use is ignored"""
         self.activate_leader()
         self.fake_proposal(10, PROPOSAL2)
         self.node.fake_message(Propose(slot=10, proposal=PROPOSAL1))
-        self.assertEqual(Commander.mock_calls, [])
+        self.assertNotAccepting()
 
     def test_commander_finished_preempted(self):
         """When a commander is preempted, the ballot num is incremented, and
         the leader is inactive, but no scout is spawned"""
         self.activate_leader()
         self.node.fake_message(Propose(slot=10, proposal=PROPOSAL1))
-        self.node.fake_message(Preempted(slot=10, preempted_by=Ballot(22, 'XXXX')))
+        self.network.tick(ACCEPT_BATCH_WINDOW)
+        self.node.fake_message(Preempted(slots=(10,), preempted_by=Ballot(22, 'XXXX')))
         self.assertEqual(self.ldr.ballot_num, Ballot(23, 'F999'))
         self.assertNoScout()
         self.assertFalse(self.ldr.active)
 
+    def test_preempted_drops_batch(self):
+        """Proposals still waiting in the batch when the leader is preempted
+        are forgotten, so they can be proposed again later"""
+        self.activate_leader()
+        self.node.fake_message(Propose(slot=10, proposal=PROPOSAL1))
+        self.node.fake_message(Preempted(slots=None, preempted_by=Ballot(22, 'XXXX')))
+        self.network.tick(ACCEPT_BATCH_WINDOW)
+        self.assertNotAccepting()
+        self.assertEqual(self.ldr.proposals, {})
+
     def test_scout_finished_adopted(self):
         """When a scout finishes and the leader is adopted, accepted proposals
         are merged and the leader becomes active"""
@@ -84,16 +117,115 @@ class Tests(utils.ComponentTestCase):
             accepted_proposals={10: PROPOSAL3}))
         self.assertNoScout()
         self.assertTrue(self.ldr.active)
+        # and it asks for a lease straight away
+        self.assertMessage(['p1', 'p2'], Active(ballot_num=Ballot(0, 'F999'),
+                                                lease_start=self.network.now, rto=None))
         self.assertEqual(self.ldr.proposals, {
             9: PROPOSAL2,
             10: PROPOSAL3,
         })
 
+    def test_scout_finished_adopted_accepts(self):
+        """Proposals adopted from the acceptors are sent for acceptance again,
+        with the new ballot"""
+        self.ldr.spawn_scout()
+        self.node.fake_message(Adopted(ballot_num=Ballot(0, 'F999'),
+                                       accepted_proposals={10: PROPOSAL3, 12: PROPOSAL1}))
+        self.node.sent = []
+        self.assertAccepting(Ballot(0, 'F999'), {10: PROPOSAL3, 12: PROPOSAL1})
+
+    def test_preempted_forgets_slots(self):
+        """The slots a preempted commander gave up on are forgotten, so that
+        their re-proposals are accepted under the next ballot"""
+        self.activate_leader()
+        self.node.fake_message(Propose(slot=10, proposal=PROPOSAL1))
+        self.network.tick(ACCEPT_BATCH_WINDOW)
+        self.node.fake_message(Preempted(slots=(10,), preempted_by=Ballot(22, 'XXXX')))
+        self.assertEqual(self.ldr.proposals, {})
+
+    def test_scout_backoff(self):
+        """After being preempted, the leader waits a random time, growing
+        exponentially with further preemptions, before scouting again"""
+        self.node.fake_message(Preempted(slots=None, preempted_by=Ballot(22, 'XXXX')))
+        self.node.fake_message(Propose(slot=10, proposal=PROPOSAL1))
+        self.assertTrue(self.ldr.scouting)
+        self.assertFalse(Scout.called)
+        self.network.tick(PREPARE_RETRANSMIT)
+        self.assertScoutStarted(Ballot(23, 'F999'))
+        self.node.fake_message(Preempted(slots=None, preempted_by=Ballot(30, 'XXXX')))
+        self.assertEqual(self.ldr.preemptions, 2)
+        Scout.reset_mock()
+        # the second wait may run to twice the first; take the longest
+        with mock.patch.object(self.network.rnd, 'uniform', lambda low, high: high):
+            self.node.fake_message(Propose(slot=11, proposal=PROPOSAL2))
+        self.network.tick(PREPARE_RETRANSMIT)
+        self.assertFalse(Scout.called)
+        self.network.tick(PREPARE_RETRANSMIT)
+        self.assertScoutStarted(Ballot(31, 'F999'))
+        self.node.fake_message(Adopted(ballot_num=Ballot(31, 'F999'), accepted_proposals={}))
+        self.assertEqual(self.ldr.preemptions, 0)
+        self.assertMessage(['p1', 'p2'], Active(ballot_num=Ballot(31, 'F999'),
+                                                lease_start=self.network.now, rto=None))
+
     def test_scout_finished_preempted(self):
         """When a scout finishes and the leader is preempted, the leader is inactive
         and its ballot_num is updated."""
         self.ldr.spawn_scout()
-        self.node.fake_message(Preempted(slot=None, preempted_by=Ballot(22, 'F999')))
+        self.node.fake_message(Preempted(slots=None, preempted_by=Ballot(22, 'F999')))
         self.assertNoScout()
         self.assertEqual(self.ldr.ballot_num, Ballot(23, 'F999'))
         self.assertFalse(self.ldr.active)
+
+    def test_compact(self):
+        """On COMPACT, the leader forgets proposals below the slot"""
+        self.fake_proposal(9, PROPOSAL1)
+        self.fake_proposal(10, PROPOSAL2)
+        self.node.fake_message(Compact(slot=10))
+        self.assertEqual(self.ldr.proposals, {10: PROPOSAL2})
+
+    def test_scout_from_executed_slot(self):
+        """Scouts only ask about slots from the local replica's latest snapshot on"""
+        self.node.fake_message(Executed(slot=7), sender='p1')
+        self.node.fake_message(Executed(slot=5), sender='F999')
+        self.node.fake_message(Propose(slot=10, proposal=PROPOSAL1))
+        self.assertScoutStarted(Ballot(0, 'F999'), 5)
+
+    def test_propose_executed(self):
+        """A PROPOSE for a slot below the scouted range is ignored"""
+        self.activate_leader()
+        self.node.fake_message(Executed(slot=5), sender='F999')
+        self.node.fake_message(Propose(slot=4, proposal=PROPOSAL1))
+        self.network.tick(ACCEPT_BATCH_WINDOW)
+        self.assertNotAccepting()
+        self.assertEqual(self.ldr.proposals, {})
+
+    def test_lease(self):
+        """Once enough acceptors to leave out every phase-1 quorum grant the
+        latest round's lease, the leader tells its replica how long the lease
+        lasts and where its own slots begin"""
+        self.ldr.spawn_scout()
+        self.node.fake_message(Adopted(ballot_num=Ballot(0, 'F999'),
+                                       accepted_proposals={10: PROPOSAL3}))
+        start = self.network.now
+        self.assertMessage(['p1', 'p2'], Active(ballot_num=Ballot(0, 'F999'), lease_start=start,
+                                                rto=None))
+        self.network.tick(0.1)
+        # grants for an earlier round don't count
+        self.node.fake_message(LeaseGranted(ballot_num=Ballot(0, 'F999'), lease_start=start - 0.5),
+                               sender='p2')
+        self.assertNoMessages()
+        # a phase-1 quorum of two peers is both of them, so one grant will do
+        self.node.fake_message(LeaseGranted(ballot_num=Ballot(0, 'F999'), lease_start=start),
+                               sender='p1')
+        self.assertMessage(['F999'], Lease(expires=start + LEASE_DURATION, slot=11))
+        self.node.fake_message(LeaseGranted(ballot_num=Ballot(0, 'F999'), lease_start=start),
+                               sender='p2')
+        self.assertNoMessages()
+
+    def test_lease_refused(self):
+        """A scout refused for another leader's lease, and so preempted by an
+        older ballot, still moves the leader's ballot forward"""
+        self.ldr.ballot_num = Ballot(5, 'F999')
+        self.ldr.spawn_scout()
+        self.node.fake_message(Preempted(slots=None, preempted_by=Ballot(3, 'XXXX')))
+        self.assertEqual(self.ldr.ballot_num, Ballot(6, 'F999'))
@@ -0,0 +1,100 @@
+from cluster import *
+from learner import *
+from . import utils
+from unittest import mock
+
+PROPOSAL2 = Proposal(caller='cli', client_id=222, input='two')
+
+
+class Tests(utils.ComponentTestCase):
+
+    def setUp(self):
+        super(Tests, self).setUp()
+        self.execute_fn = mock.Mock(name='execute_fn', return_value=('state2', 'out'))
+        self.learner = Learner(self.node, self.execute_fn, state='state', slot=2,
+                               decisions={}, peers=['p1', 'p2'], feed='p1')
+
+    def read(self):
+        self.node.fake_message(Read(caller='cli', client_id=555, input_value='get'))
+
+    def test_renew(self):
+        """The learner renews its subscription with its feed, moving to the
+        next peer when the feed goes quiet"""
+        self.network.tick(CATCHUP_INTERVAL)
+        self.assertMessage(['p1'], Learn(slot=2, sent_at=CATCHUP_INTERVAL))
+        self.node.fake_message(Progress(slot=2, sent_at=CATCHUP_INTERVAL), sender='p1')
+        for _ in range(3):
+            self.network.tick(CATCHUP_INTERVAL)
+            self.assertMessage(['p1'], Learn(slot=2, sent_at=self.network.now))
+        self.network.tick(CATCHUP_INTERVAL)
+        self.assertMessage(['p2'], Learn(slot=2, sent_at=self.network.now))
+        self.assertEqual(self.learner.feed, 'p2')
+
+    def test_read(self):
+        """Reads are answered locally once we have caught up with the feed,
+        and passed on to it once that is more than LEARNER_STALENESS ago"""
+        self.read()
+        self.assertMessage(['p1'], Read(caller='cli', client_id=555, input_value='get'))
+        self.node.fake_message(Progress(slot=3, sent_at=0), sender='p1')
+        self.read()
+        self.assertMessage(['p1'], Read(caller='cli', client_id=555, input_value='get'))
+        # the PROGRESS of another peer says nothing about ours
+        self.node.fake_message(Progress(slot=2, sent_at=0), sender='p2')
+        self.read()
+        self.assertMessage(['p1'], Read(caller='cli', client_id=555, input_value='get'))
+        self.node.fake_message(Decision(slot=2, proposal=PROPOSAL2))
+        self.assertMessage(['cli'], Invoked(client_id=222, output='out'))
+        self.read()
+        self.assertMessage(['cli'], Invoked(client_id=555, output='out'))
+        self.execute_fn.assert_called_with('state2', 'get')
+        self.network.tick(LEARNER_STALENESS + 0.1)
+        self.node.sent = []  # renewals
+        self.read()
+        self.assertMessage(['p1'], Read(caller='cli', client_id=555, input_value='get'))
+
+    def test_invoke(self):
+        """Requests are passed on to the feed, unless already answered"""
+        self.node.fake_message(Invoke(caller='cli', client_id=222, input_value='two'))
+        self.assertMessage(['p1'], Invoke(caller='cli', client_id=222, input_value='two'))
+        self.node.fake_message(Decision(slot=2, proposal=PROPOSAL2))
+        self.assertMessage(['cli'], Invoked(client_id=222, output='out'))
+        self.node.fake_message(Invoke(caller='cli', client_id=222, input_value='two'))
+        self.assertMessage(['cli'], Invoked(client_id=222, output='out'))
+
+    @mock.patch('cluster.SNAPSHOT_INTERVAL', 1)
+    def test_snapshot(self):
+        """A learner forgets the decisions its snapshots cover, without
+        telling anyone"""
+        self.node.fake_message(Decision(slot=2, proposal=PROPOSAL2))
+        self.assertMessage(['cli'], Invoked(client_id=222, output='out'))
+        self.assertEqual(self.learner.snapshot, Snapshot(3, 'state2', {('cli', 222): 'out'}))
+        self.assertEqual((self.learner.decisions, self.learner.compacted_slot), ({}, 3))
+
+
+class BootstrapTests(utils.ComponentTestCase):
+
+    def setUp(self):
+        super(BootstrapTests, self).setUp()
+        self.Learner = mock.Mock(autospec=Learner)
+        self.bs = LearnerBootstrap(self.node, ['p1', 'p2'], 'execute_fn',
+                                   replica_cls=self.Learner)
+
+    def test_bootstrap(self):
+        """The bootstrap asks each peer in turn until a WELCOME, then starts a
+        learner fed by that peer, and starts another on a later WELCOME"""
+        self.bs.start()
+        self.assertMessage(['p1'], Learn(slot=None, sent_at=0))
+        self.network.tick(JOIN_RETRANSMIT)
+        self.assertMessage(['p2'], Learn(slot=None, sent_at=JOIN_RETRANSMIT))
+        self.node.fake_message(Welcome(state='st', slot=5, decisions={}, sessions={}), sender='p2')
+        self.Learner.assert_called_once_with(
+            self.node, execute_fn='execute_fn', peers=['p1', 'p2'], feed='p2', state='st',
+            slot=5, decisions={}, sessions={}, applier_cls=Applier)
+        self.network.tick(JOIN_RETRANSMIT)
+        self.assertNoMessages()
+        self.Learner.return_value.slot = 5
+        self.node.fake_message(Welcome(state='st', slot=5, decisions={}, sessions={}), sender='p1')
+        self.assertEqual(self.Learner.call_count, 1)
+        self.node.fake_message(Welcome(state='st2', slot=9, decisions={}, sessions={}), sender='p1')
+        self.Learner.return_value.stop.assert_called_once_with()
+        self.assertEqual(self.Learner.call_args[1]['state'], 'st2')
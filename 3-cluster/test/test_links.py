@@ -0,0 +1,108 @@
+from cluster import *
+from links import *
+import unittest
+
+MESSAGE = Accepting(leader='N0')
+
+
+class Fixed(object):
+    """Always the same delay"""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def transit(self, network, sender, dest, message):
+        return self.delay
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.network = Network(1234)
+
+    def transits(self, link, count, sender='A', dest='B'):
+        return [link.transit(self.network, sender, dest, MESSAGE) for _ in range(count)]
+
+    def test_uniform(self):
+        """Uniform with the Network's parameters replays the default network"""
+        other = Network(1234)
+        self.assertEqual(self.transits(Uniform(), 100),
+                         [other.transit('A', 'B', MESSAGE) for _ in range(100)])
+
+    def test_heavy_tailed(self):
+        """HeavyTailed is never faster than its delay, usually close to it,
+        and sometimes far slower"""
+        transits = sorted(self.transits(HeavyTailed(0.01, alpha=2), 10000))
+        self.assertGreaterEqual(transits[0], 0.01)
+        self.assertAlmostEqual(transits[5000], 0.0141, places=3)
+        self.assertGreater(transits[-100], 0.08)
+        self.assertEqual(self.transits(HeavyTailed(0.01, drop=1.0), 10), [None] * 10)
+
+    def test_bandwidth(self):
+        """Messages queue behind each other, each taking its size over the
+        bandwidth to send, and the queue drains as time passes"""
+        size = message_size(MESSAGE)
+        link = Bandwidth(Fixed(0.1), bandwidth=size * 100)
+        self.assertEqual([round(t, 6) for t in self.transits(link, 3)], [0.11, 0.12, 0.13])
+        # a shared queue holds messages to other destinations too
+        self.assertAlmostEqual(link.transit(self.network, 'A', 'C', MESSAGE), 0.14)
+        self.assertAlmostEqual(link.transit(self.network, 'B', 'A', MESSAGE), 0.11)
+        self.network.now += 1
+        self.assertAlmostEqual(link.transit(self.network, 'A', 'B', MESSAGE), 0.11)
+
+    def test_bandwidth_per_destination(self):
+        """Without shared, each destination has a queue of its own"""
+        link = Bandwidth(Fixed(0.1), bandwidth=message_size(MESSAGE) * 100, shared=False)
+        self.assertAlmostEqual(self.transits(link, 2)[-1], 0.12)
+        self.assertAlmostEqual(link.transit(self.network, 'A', 'C', MESSAGE), 0.11)
+
+    def test_bandwidth_buffer(self):
+        """Messages that would queue beyond the buffer are dropped"""
+        size = message_size(MESSAGE)
+        link = Bandwidth(Fixed(0.1), bandwidth=size * 100, buffer=size * 2)
+        transits = self.transits(link, 3)
+        self.assertEqual(transits[2], None)
+        self.network.now += 0.01
+        self.assertAlmostEqual(link.transit(self.network, 'A', 'B', MESSAGE), 0.12)
+
+    def test_partition(self):
+        """A cut loses messages one way only, unless cut both ways, until healed"""
+        link = Partition(Fixed(0.1))
+        link.cut(['A'], ['B', 'C'])
+        self.assertEqual(self.transits(link, 1, 'A', 'B'), [None])
+        self.assertEqual(self.transits(link, 1, 'B', 'A'), [0.1])
+        link.cut(['B'], ['C'], both_ways=True)
+        self.assertEqual(self.transits(link, 1, 'C', 'B'), [None])
+        link.heal()
+        self.assertEqual(self.transits(link, 1, 'A', 'B'), [0.1])
+
+    def test_topology(self):
+        """Each pair of regions has its own link, used both ways unless the
+        reverse is given, and each region a local one"""
+        link = Topology({'A': 'us', 'B': 'us', 'C': 'eu', 'D': 'ap'},
+                        {('us', 'eu'): Fixed(0.04), ('us', 'ap'): Fixed(0.08),
+                         ('ap', 'us'): Fixed(0.09)}, local=Fixed(0.001))
+        self.assertEqual([link.transit(self.network, s, d, MESSAGE)
+                          for s, d in ['AB', 'AC', 'CA', 'AD', 'DA']],
+                         [0.001, 0.04, 0.04, 0.08, 0.09])
+
+    def test_cluster(self):
+        """A cluster spread over regions, on heavy-tailed links of limited
+        bandwidth, decides every request"""
+        peers = ['N%d' % n for n in range(5)]
+        wan = Topology(dict(zip(peers, ['us', 'us', 'eu', 'eu', 'ap'])),
+                       {('us', 'eu'): HeavyTailed(0.04, drop=0.01),
+                        ('us', 'ap'): HeavyTailed(0.08, drop=0.01),
+                        ('eu', 'ap'): HeavyTailed(0.12, drop=0.01)})
+        network = Network(1234, link=Bandwidth(wan, bandwidth=1000000))
+        nodes = [network.new_node(address=p) for p in peers]
+        add = lambda state, input: (state + input, state + input)
+        Seed(nodes[0], initial_state=0, peers=peers, execute_fn=add)
+        for node in nodes[1:]:
+            Bootstrap(node, execute_fn=add, peers=peers).start()
+        outputs = []
+        for node in nodes:
+            network.set_timer(None, 1.0, lambda node=node: Requester(node, 1, outputs.append).start())
+        network.set_timer(None, 10.0, network.stop)
+        network.run()
+        self.assertEqual(sorted(outputs), [1, 2, 3, 4, 5])
@@ -6,7 +6,7 @@ import unittest
 
 class FakeRequest(object):
 
-    def __init__(self, node, input_value, callback):
+    def __init__(self, node, input_value, callback, read_only=False):
         self.node = node
         self.input_value = input_value
         self.callback = callback
@@ -31,7 +31,8 @@ class Tests(unittest.TestCase):
                            peers=['p1', 'p2'], **self.cls_args)
         self.failIf(self.Seed.called)
         self.Bootstrap.assert_called_with(
-            self.network.node, execute_fn=self.state_machine, peers=['p1', 'p2'])
+            self.network.node, execute_fn=self.state_machine, peers=['p1', 'p2'],
+            applier_cls=Applier, wal=None, leader=None)
 
     def test_Member(self):
         """With a seed, the Member constructor builds a Node and a ClusterSeed"""
@@ -41,7 +42,7 @@ class Tests(unittest.TestCase):
         self.failIf(self.Bootstrap.called)
         self.Seed.assert_called_with(
             self.network.node, initial_state=44, peers=['p1', 'p2'],
-            execute_fn=self.state_machine)
+            execute_fn=self.state_machine, applier_cls=Applier, wal=None, leader=None)
 
     def test_start(self):
         """Member.start starts the role and node in self.thread"""
@@ -53,9 +54,21 @@ class Tests(unittest.TestCase):
         self.failUnless(self.network.ran)
 
     def test_invoke(self):
-        """Member.invoke makes a new Request, starts it, and waits for its callback to be called."""
+        """Member.invoke_async makes a new Request on the network's thread, starts it,
+        and returns a future for the output passed to its callback."""
         sh = Member(self.state_machine, network=self.network,
                        peers=['p1', 'p2'], **self.cls_args)
-        res = sh.invoke('ROTATE', request_cls=FakeRequest)
-        self.assertEqual(sh.requester, None)
-        self.assertEqual(res, ('ROTATED', sh.node, 'ROTATE'))
+        future = sh.invoke_async('ROTATE', request_cls=FakeRequest)
+        self.assertFalse(future.done())
+        self.network.tick(0)
+        self.assertEqual(future.result(), ('ROTATED', sh.node, 'ROTATE'))
+
+    def test_invoke_window(self):
+        """Member.invoke_async blocks while the window of outstanding requests is full"""
+        sh = Member(self.state_machine, network=self.network,
+                       peers=['p1', 'p2'], window=2, **self.cls_args)
+        futures = [sh.invoke_async(n, request_cls=FakeRequest) for n in range(2)]
+        self.assertFalse(sh.window.acquire(blocking=False))
+        self.network.tick(0)
+        self.assertEqual([f.result()[2] for f in futures], [0, 1])
+        self.assertTrue(sh.window.acquire(blocking=False))
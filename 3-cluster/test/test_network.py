@@ -1,5 +1,9 @@
 from cluster import *
 from unittest import mock
+import functools
+import operator
+import pickle
+import threading
 import unittest
 
 
@@ -52,3 +56,101 @@ class NetworkTests(unittest.TestCase):
         nonex.cancel()
         self.network.run()
         self.failUnless(cb.called)
+
+    def test_cancelled_timers_reclaimed(self):
+        """Cancelled timers are dropped from the heap once they outnumber the
+        live ones, long before they would expire"""
+        node = self.network.new_node('C')
+        timers = [self.network.set_timer(node.address, 10 + i, lambda: None) for i in range(10)]
+        for timer in timers[:6]:
+            timer.cancel()
+        self.assertEqual(sorted(t.expires for t in self.network.timers),
+                         [t.expires for t in timers[6:]])
+        self.assertEqual(self.network.cancelled_timers, 0)
+        # cancelling a timer that has already fired doesn't count
+        fired = self.network.set_timer(node.address, 0, lambda: self.kill(node))
+        self.network.run()
+        fired.cancel()
+        self.assertEqual(self.network.cancelled_timers, 0)
+
+    def test_call_soon_from_thread(self):
+        """call_soon from another thread leaves the timers to the network's
+        thread, which runs the callback"""
+        node = self.network.new_node('T')
+        cb = mock.Mock(side_effect=lambda: self.kill(node))
+        thread = threading.Thread(target=self.network.call_soon, args=(cb,))
+        thread.start()
+        thread.join()
+        self.assertEqual(self.network.timers, [])
+        self.network.run()
+        self.failUnless(cb.called)
+
+    def test_simultaneous_timers(self):
+        """Timers expiring at the same time fire in the order they were set"""
+        node = self.network.new_node('T')
+        fired = []
+        for i in range(20):
+            self.network.set_timer(node.address, 0.01, functools.partial(fired.append, i))
+        self.network.run()
+        self.assertEqual(fired, list(range(20)))
+
+    def test_dispatch(self):
+        """Node.receive calls the handlers of the roles registered when the
+        message arrives, passing the message fields"""
+        node = self.network.new_node('D')
+        calls = []
+
+        class Decider(Role):
+            def do_Decision(self, sender, slot, proposal):
+                calls.append((self, sender, slot, proposal))
+                Decider(node)  # registered too late for this message
+                self.stop()
+
+        first, second = Decider(node), Decider(node)
+        node.receive('S', Decision(slot=3, proposal=NOOP_PROPOSAL))
+        self.assertEqual(calls, [(first, 'S', 3, NOOP_PROPOSAL), (second, 'S', 3, NOOP_PROPOSAL)])
+        self.assertEqual(len(node.handlers['Decision']), 2)
+        node.receive('S', Join())  # no handlers
+
+    def test_send_shares_frozen_copy(self):
+        """A broadcast delivers one read-only copy of the message to every
+        destination, unaffected by later changes to the sender's data"""
+        self.network.DROP_PROB = 0
+        sender = self.network.new_node('S')
+        received = []
+        for address in 'AB':
+            node = self.network.new_node(address)
+            node.receive = lambda sender, message: received.append(message)
+        decisions = {1: Proposal('cli', 1, ['x'])}
+        sender.send(['A', 'B'], Welcome(state={'k': [1]}, slot=2, decisions=decisions, sessions={}))
+        decisions[2] = Proposal('cli', 2, 'y')
+        self.network.run()
+        self.assertEqual(len(received), 2)
+        self.assertIs(received[0], received[1])
+        self.assertEqual(received[0].decisions, {1: Proposal('cli', 1, ['x'])})
+        self.assertRaises(TypeError, received[0].decisions[1].input.append, 'z')
+        self.assertRaises(TypeError, operator.setitem, received[0].decisions, 2, None)
+        self.assertRaises(TypeError, operator.setitem, received[0].state, "k", None)
+
+    def test_thaw(self):
+        """thaw gives back a mutable copy of a frozen payload"""
+        frozen = freeze({'k': {'j': 1}})
+        thawed = thaw(frozen)
+        thawed['k']['j'] = 2
+        self.assertEqual(frozen, {'k': {'j': 1}})
+        self.assertEqual(thawed, {'k': {'j': 2}})
+
+    def test_thaw_types(self):
+        """Thawing a frozen payload, even one that crossed the wire, gives
+        back the types it was frozen from"""
+        value = Proposal('cli', 1, {'l': [1, {2}], 't': ([3],), 's': frozenset([4])})
+        frozen = pickle.loads(pickle.dumps(freeze(value)))
+        self.assertRaises(TypeError, frozen.input['l'].append, 5)
+        self.assertRaises(TypeError, frozen.input['l'][1].add, 5)
+        thawed = thaw(frozen)
+        self.assertEqual(thawed, value)
+        self.assertIs(type(thawed), Proposal)
+        self.assertEqual([type(v) for v in (thawed.input, thawed.input['l'], thawed.input['l'][1],
+                                            thawed.input['t'], thawed.input['t'][0],
+                                            thawed.input['s'])],
+                         [dict, list, set, tuple, list, frozenset])
@@ -1,6 +1,10 @@
 from cluster import *
+from applier import PartitionedApplier, ThreadedApplier, execute_in_order
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from run import key_value_state_machine
 from . import utils
 from unittest import mock
+import threading
 
 PROPOSAL1 = Proposal(caller='test', client_id=111, input='one')
 PROPOSAL2 = Proposal(caller='test', client_id=222, input='two')
@@ -23,11 +27,14 @@ class Tests(utils.ComponentTestCase):
 
     @mock.patch.object(Replica, 'propose')
     def test_INVOKE_new(self, propose):
-        """An INVOKE with a new proposal results in a proposal"""
+        """An INVOKE with a new proposal results in a proposal once the batch
+        window closes"""
         self.node.fake_message(Invoke(
             caller=PROPOSAL2.caller, client_id=PROPOSAL2.client_id,
             input_value=PROPOSAL2.input))
-        propose.assert_called_with(PROPOSAL2, None)
+        self.failIf(propose.called)
+        self.network.tick(INVOKE_BATCH_WINDOW)
+        propose.assert_called_once_with(PROPOSAL2)
 
     @mock.patch.object(Replica, 'propose')
     def test_INVOKE_repeat(self, propose):
@@ -35,6 +42,44 @@ class Tests(utils.ComponentTestCase):
         self.rep.proposals[1] = PROPOSAL1
         self.failIf(propose.called)
 
+    def test_INVOKE_batched(self):
+        """INVOKEs arriving within the batch window share one slot"""
+        for proposal in PROPOSAL2, PROPOSAL3:
+            self.node.fake_message(Invoke(caller=proposal.caller, client_id=proposal.client_id,
+                                          input_value=proposal.input))
+        self.network.tick(INVOKE_BATCH_WINDOW)
+        self.assertMessage(['F999'], Propose(slot=2, proposal=Batch((PROPOSAL2, PROPOSAL3))))
+
+    @mock.patch('cluster.INVOKE_BATCH_SIZE', 2)
+    def test_INVOKE_batch_full(self):
+        """A full batch is proposed without waiting for the window"""
+        for proposal in PROPOSAL2, PROPOSAL3:
+            self.node.fake_message(Invoke(caller=proposal.caller, client_id=proposal.client_id,
+                                          input_value=proposal.input))
+        self.assertMessage(['F999'], Propose(slot=2, proposal=Batch((PROPOSAL2, PROPOSAL3))))
+        self.assertEqual(self.rep.batch_timer, None)
+
+    def test_INVOKE_proposed(self):
+        """An INVOKE for a request that already has a slot re-proposes that
+        slot, batch and all - once for every request in the batch, as they
+        are retransmitted together"""
+        self.rep.propose(Batch((PROPOSAL2, PROPOSAL3)))
+        self.assertMessage(['F999'], Propose(slot=2, proposal=Batch((PROPOSAL2, PROPOSAL3))))
+        self.network.tick(INVOKE_RETRANSMIT)
+        for proposal in PROPOSAL3, PROPOSAL2:
+            self.node.fake_message(Invoke(caller=proposal.caller, client_id=proposal.client_id,
+                                          input_value=proposal.input))
+        self.assertMessage(['F999'], Propose(slot=2, proposal=Batch((PROPOSAL2, PROPOSAL3))))
+        self.assertNoMessages()
+
+    def test_commit_batch(self):
+        """Committing a batch executes each request in order and answers each caller"""
+        self.execute_fn.side_effect = lambda state, input: (state + input, input)
+        self.rep.commit(2, Batch((PROPOSAL2, PROPOSAL3)))
+        self.assertEqual(self.rep.state, 'statetwotre')
+        self.assertMessage(['test'], Invoked(client_id=222, output='two'))
+        self.assertMessage(['test'], Invoked(client_id=333, output='tre'))
+
     def test_propose_new(self):
         """A proposeal without a specified slot gets the next slot and is
         proposed to self"""
@@ -87,6 +132,12 @@ class Tests(utils.ComponentTestCase):
         self.assertEqual(self.rep.next_slot, 2)
         self.assertFalse(commit.called)
 
+    def test_RELAY(self):
+        """A RELAY is passed on, and its decisions handled as DECISIONs"""
+        self.node.fake_message(Relay(decisions={3: PROPOSAL3}, relay_to=('p2',)), sender='p1')
+        self.assertMessage(['p2'], Relay(decisions={3: PROPOSAL3}, relay_to=()))
+        self.assertEqual(self.rep.decisions[3], PROPOSAL3)
+
     @mock.patch.object(Replica, 'commit')
     def test_DECISION_repeat_conflict(self, commit):
         """On DECISION for a committed slot with a *non*-matching proposal, do nothing"""
@@ -97,9 +148,387 @@ class Tests(utils.ComponentTestCase):
         """A JOIN from a cluster member gets a warm WELCOME."""
         self.node.fake_message(Join(), sender='F999')
         self.assertMessage(['F999'], Welcome(state='state', slot=2,
-                           decisions={1: PROPOSAL1}))
+                           decisions={}, sessions={}))
 
     def test_join_unknown(self):
         """A JOIN from elsewhere gets nothing."""
         self.node.fake_message(Join(), sender='999')
         self.assertNoMessages()
+
+    def test_learn(self):
+        """A LEARN gets the decisions the learner is missing - a WELCOME if it
+        is new or behind our compacted log - and how far we have got"""
+        self.node.fake_message(Learn(slot=None, sent_at=5), sender='L1')
+        self.assertMessage(['L1'], Welcome(state='state', slot=2, decisions={}, sessions={}))
+        self.assertMessage(['L1'], Progress(slot=2, sent_at=5))
+        self.node.fake_message(Learn(slot=1, sent_at=6), sender='L1')
+        self.assertMessage(['L1'], CaughtUp(decisions={1: PROPOSAL1}))
+        self.assertMessage(['L1'], Progress(slot=2, sent_at=6))
+        self.node.fake_message(Learn(slot=0, sent_at=7), sender='L1')
+        self.assertMessage(['L1'], Welcome(state='state', slot=2, decisions={}, sessions={}))
+        self.assertMessage(['L1'], Progress(slot=2, sent_at=7))
+        # decisions we no longer hold are left out, rather than failing
+        self.rep.decisions[3] = PROPOSAL3
+        self.rep.slot = 4
+        self.node.fake_message(Learn(slot=1, sent_at=8), sender='L1')
+        self.assertMessage(['L1'], CaughtUp(decisions={1: PROPOSAL1, 3: PROPOSAL3}))
+        self.assertMessage(['L1'], Progress(slot=4, sent_at=8))
+        # peers don't subscribe
+        self.node.fake_message(Learn(slot=None, sent_at=5), sender='p1')
+        self.assertNoMessages()
+
+    def test_learn_feed(self):
+        """Decisions are passed on to learners until they stop renewing"""
+        self.node.fake_message(Learn(slot=2, sent_at=0), sender='L1')
+        self.assertMessage(['L1'], Progress(slot=2, sent_at=0))
+        self.node.fake_message(Decision(slot=3, proposal=PROPOSAL3))
+        self.assertMessage(['L1'], Decision(slot=3, proposal=PROPOSAL3))
+        self.network.now += LEARNER_TIMEOUT + 0.1
+        self.node.fake_message(Decision(slot=4, proposal=PROPOSAL4))
+        self.assertEqual(self.rep.learners, {})
+
+    def test_commit(self):
+        """Committing a proposal executes it and sends the output to the caller"""
+        self.execute_fn.return_value = ('state2', 'out')
+        self.rep.commit(2, PROPOSAL2)
+        self.execute_fn.assert_called_once_with('state', 'two')
+        self.assertEqual(self.rep.state, 'state2')
+        self.assertMessage(['test'], Invoked(client_id=222, output='out'))
+
+    def test_commit_duplicate(self):
+        """A proposal committed a second time is answered from the session
+        table instead of being executed again"""
+        self.execute_fn.return_value = ('state2', 'out')
+        self.rep.commit(2, PROPOSAL2)
+        self.assertMessage(['test'], Invoked(client_id=222, output='out'))
+        self.rep.commit(3, PROPOSAL2)
+        self.assertEqual(self.execute_fn.call_count, 1)
+        self.assertMessage(['test'], Invoked(client_id=222, output='out'))
+
+    def test_commit_duplicate_from_welcome(self):
+        """Proposals in the session table from a WELCOME are not executed again"""
+        rep = Replica(self.node, self.execute_fn, state='state', slot=2, decisions={},
+                      peers=['p1', 'F999'], sessions={('test', 111): 'out'})
+        rep.commit(2, PROPOSAL1)
+        self.assertFalse(self.execute_fn.called)
+        self.assertMessage(['test'], Invoked(client_id=111, output='out'))
+        rep.stop()
+
+    @mock.patch.object(Replica, 'propose')
+    def test_INVOKE_finished(self, propose):
+        """An INVOKE for a request that has already been committed is answered
+        from the session table without a new proposal"""
+        self.execute_fn.return_value = ('state2', 'out')
+        self.rep.commit(2, PROPOSAL2)
+        self.assertMessage(['test'], Invoked(client_id=222, output='out'))
+        self.node.fake_message(Invoke(
+            caller=PROPOSAL2.caller, client_id=PROPOSAL2.client_id,
+            input_value=PROPOSAL2.input))
+        self.assertMessage(['test'], Invoked(client_id=222, output='out'))
+        self.assertFalse(propose.called)
+
+    @mock.patch('cluster.SESSION_LIMIT', 2)
+    def test_session_eviction(self):
+        """The session table forgets the oldest sessions beyond SESSION_LIMIT"""
+        self.execute_fn.return_value = ('state', 'out')
+        for slot, proposal in [(2, PROPOSAL2), (3, PROPOSAL3), (4, PROPOSAL4)]:
+            self.rep.commit(slot, proposal)
+            self.node.sent.pop()
+        self.assertEqual(list(self.rep.sessions), [('test', 333), ('test', 444)])
+
+    @mock.patch('cluster.SNAPSHOT_INTERVAL', 2)
+    def test_snapshot(self):
+        """Every SNAPSHOT_INTERVAL slots the replica snapshots its state and
+        tells its peers how far it has executed"""
+        self.execute_fn.side_effect = lambda state, input: (state + input, input)
+        self.node.fake_message(Decision(slot=2, proposal=PROPOSAL2))
+        self.assertMessage(['test'], Invoked(client_id=222, output='two'))
+        self.node.fake_message(Decision(slot=3, proposal=PROPOSAL3))
+        self.assertMessage(['test'], Invoked(client_id=333, output='tre'))
+        self.assertMessage(['p1', 'F999'], Executed(slot=4))
+        self.assertEqual(self.rep.snapshot, Snapshot(
+            4, 'statetwotre', {('test', 222): 'two', ('test', 333): 'tre'}))
+
+    def test_executed(self):
+        """Once every peer has reported its progress, the lowest slot is
+        sent to the local roles for compaction"""
+        self.node.fake_message(Executed(slot=5), sender='p1')
+        self.assertNoMessages()
+        self.node.fake_message(Executed(slot=3), sender='F999')
+        self.assertMessage(['F999'], Compact(slot=3))
+        self.node.fake_message(Compact(slot=3))
+        self.node.fake_message(Executed(slot=2), sender='F999')  # out of date
+        self.assertNoMessages()
+
+    def test_compact(self):
+        """COMPACT forgets proposals below the slot, and decisions below both
+        the slot and the latest snapshot"""
+        self.rep.decisions.update({0: PROPOSAL4, 3: PROPOSAL3})
+        self.rep.proposals.update({1: PROPOSAL1, 3: PROPOSAL3})
+        self.node.fake_message(Compact(slot=5))
+        self.assertEqual(self.rep.decisions, {3: PROPOSAL3})
+        self.assertEqual(self.rep.proposals, {})
+
+    @mock.patch.object(Replica, 'commit')
+    def test_DECISION_compacted(self, commit):
+        """A DECISION for a compacted slot is ignored"""
+        self.node.fake_message(Compact(slot=2))
+        self.node.fake_message(Decision(slot=1, proposal=PROPOSAL2))
+        self.assertFalse(commit.called)
+
+    @mock.patch('cluster.SNAPSHOT_INTERVAL', 2)
+    def test_join_snapshot(self):
+        """A JOIN is welcomed with the latest snapshot and the decisions after it"""
+        self.execute_fn.side_effect = lambda state, input: (state + input, input)
+        for slot, proposal in [(2, PROPOSAL2), (3, PROPOSAL3), (4, PROPOSAL4)]:
+            self.node.fake_message(Decision(slot=slot, proposal=proposal))
+        self.node.sent = []
+        self.node.fake_message(Join(), sender='p1')
+        self.assertMessage(['p1'], Welcome(
+            state='statetwotre', slot=4, decisions={4: PROPOSAL4},
+            sessions={('test', 222): 'two', ('test', 333): 'tre'}))
+
+    def test_welcome_executes_suffix(self):
+        """A replica created with decisions past its slot executes them"""
+        self.execute_fn.return_value = ('state2', 'out')
+        rep = Replica(self.node, self.execute_fn, state='state', slot=2,
+                      decisions={2: PROPOSAL2}, peers=['p1', 'F999'])
+        self.assertEqual((rep.slot, rep.state), (3, 'state2'))
+        self.assertMessage(['test'], Invoked(client_id=222, output='out'))
+        # and proposes past them
+        self.assertEqual(rep.next_slot, 3)
+        rep.stop()
+
+    def grant_lease(self, slot=2):
+        self.node.fake_message(Lease(expires=self.network.now + LEASE_DURATION, slot=slot))
+
+    def test_READ_leased(self):
+        """With a lease and nothing decided left to execute, a READ is answered
+        from the local state"""
+        self.execute_fn.return_value = ('state', 'out')
+        self.grant_lease()
+        self.node.fake_message(Read(caller='cli', client_id=555, input_value='get'), sender='p1')
+        self.execute_fn.assert_called_once_with('state', 'get')
+        self.assertMessage(['cli'], Invoked(client_id=555, output='out'))
+
+    @mock.patch.object(Replica, 'propose')
+    def test_READ_behind(self, propose):
+        """With a lease but decided slots still to execute, a READ is proposed"""
+        self.grant_lease()
+        self.node.fake_message(Decision(slot=3, proposal=PROPOSAL3))
+        self.node.fake_message(Read(caller='cli', client_id=555, input_value='get'), sender='p1')
+        self.network.tick(INVOKE_BATCH_WINDOW)
+        self.assertFalse(self.execute_fn.called)
+        propose.assert_called_with(Proposal('cli', 555, 'get'))
+
+    @mock.patch.object(Replica, 'propose')
+    def test_READ_lease_expired(self, propose):
+        """Once the lease expires, a READ from elsewhere is proposed"""
+        self.grant_lease()
+        self.network.tick(LEASE_DURATION)
+        self.node.fake_message(Read(caller='cli', client_id=555, input_value='get'), sender='p1')
+        self.network.tick(INVOKE_BATCH_WINDOW)
+        self.assertFalse(self.execute_fn.called)
+        propose.assert_called_with(Proposal('cli', 555, 'get'))
+
+    def test_READ_forward(self):
+        """A local READ without a lease is passed on to the leader"""
+        self.rep.latest_leader = 'p1'
+        self.node.fake_message(Read(caller='F999', client_id=555, input_value='get'))
+        self.assertMessage(['p1'], Read(caller='F999', client_id=555, input_value='get'))
+
+    def test_PREEMPTED(self):
+        """When the local leader is preempted, proposals go to the winner"""
+        self.node.fake_message(Preempted(slots=None, preempted_by=Ballot(3, 'p1')))
+        self.assertEqual(self.rep.latest_leader, 'p1')
+        self.rep.propose(PROPOSAL2)
+        self.assertMessage(['p1'], Propose(slot=2, proposal=PROPOSAL2))
+
+    def test_preferred_leader(self):
+        """Proposals go to the preferred leader from the start, until it has
+        been silent for LEADER_TIMEOUT and the time a seed takes to join"""
+        self.rep.stop()
+        rep = Replica(self.node, self.execute_fn, state='state', slot=2, decisions={},
+                      peers=['p1', 'F999'], leader='p1')
+        rep.propose(PROPOSAL2)
+        self.assertMessage(['p1'], Propose(slot=2, proposal=PROPOSAL2))
+        self.network.tick(LEADER_TIMEOUT)
+        self.assertEqual(rep.latest_leader, 'p1')  # it may be the seed, still joining
+        self.network.tick(JOIN_RETRANSMIT * 2)
+        self.assertEqual(rep.latest_leader, 'F999')
+        self.node.sent = []  # catching up with the peers meanwhile
+        rep.stop()
+
+    def test_leader_timeout(self):
+        """A leader is given up on after two missed ACTIVEs plus the
+        retransmit timeout it reports"""
+        self.node.fake_message(Accepting(leader='p1'))
+        self.node.fake_message(Active(ballot_num=Ballot(3, 'p1'), lease_start=0, rto=0.2),
+                               sender='p1')
+        self.network.tick(LEADER_TIMEOUT + 0.1)
+        self.assertEqual(self.rep.latest_leader, 'p1')
+        self.network.tick(0.1)
+        self.assertEqual(self.rep.latest_leader, 'F999')
+
+    def test_catchup(self):
+        """A replica that makes no progress for an interval while later slots
+        are decided asks a peer for the missing decisions"""
+        self.node.fake_message(Decision(slot=5, proposal=PROPOSAL4))
+        self.network.tick(CATCHUP_INTERVAL)
+        self.assertNoMessages()
+        self.network.tick(CATCHUP_INTERVAL)
+        self.assertMessage(['p1'], Catchup(slot=2, count=CATCHUP_CHUNK))
+
+    @mock.patch('cluster.CATCHUP_CHUNK', 2)
+    def test_catchup_chunks(self):
+        """Catch-up asks for missing slots in chunks, several at a time, and
+        not for chunks that are already decided"""
+        rep = Replica(self.node, self.execute_fn, state='state', slot=2,
+                      decisions={1: PROPOSAL1, 4: PROPOSAL2, 5: PROPOSAL3, 12: PROPOSAL4},
+                      peers=['p1', 'p2', 'F999'])
+        self.rep.stop()
+        self.network.tick(CATCHUP_INTERVAL * 2)
+        self.assertMessage(['p1'], Catchup(slot=2, count=2))
+        self.assertMessage(['p2'], Catchup(slot=6, count=2))
+        self.assertMessage(['p1'], Catchup(slot=8, count=2))
+        self.assertMessage(['p2'], Catchup(slot=10, count=2))
+        rep.stop()
+
+    def test_CATCHUP(self):
+        """A replica answers CATCHUP with the decisions it has in the range"""
+        self.node.fake_message(Decision(slot=3, proposal=PROPOSAL3))
+        self.node.fake_message(Catchup(slot=1, count=2), sender='p1')
+        self.assertMessage(['p1'], CaughtUp(decisions={1: PROPOSAL1}))
+        self.node.fake_message(Catchup(slot=4, count=2), sender='p1')
+
+    @mock.patch.object(Replica, 'commit')
+    def test_CAUGHTUP(self, commit):
+        """Decisions that come back from catch-up are executed in order"""
+        self.node.fake_message(CaughtUp(decisions={3: PROPOSAL3, 2: PROPOSAL2, 1: PROPOSAL1}),
+                               sender='p1')
+        self.assertEqual(commit.call_args_list, [mock.call(2, PROPOSAL2), mock.call(3, PROPOSAL3)])
+        self.assertEqual(self.rep.slot, 4)
+
+    def test_ACTIVE(self):
+        """After giving up on a leader, a replica follows its ACTIVEs again, but
+        not those of a leader with an older ballot"""
+        self.node.fake_message(Active(ballot_num=Ballot(3, 'p1'), lease_start=0, rto=None),
+                               sender='p1')
+        self.network.tick(LEADER_TIMEOUT)
+        self.assertEqual(self.rep.latest_leader, 'F999')
+        self.node.fake_message(Active(ballot_num=Ballot(2, 'F999'), lease_start=0, rto=None),
+                               sender='F999')
+        self.node.fake_message(Active(ballot_num=Ballot(3, 'p1'), lease_start=0, rto=None),
+                               sender='p1')
+        self.assertEqual(self.rep.latest_leader, 'p1')
+        self.node.fake_message(Active(ballot_num=Ballot(2, 'F999'), lease_start=0, rto=None),
+                               sender='F999')
+        self.assertEqual(self.rep.latest_leader, 'p1')
+
+
+class DeferredApplier(Applier):
+    """An applier that runs its jobs only when the test says so"""
+
+    def __init__(self, node):
+        super(DeferredApplier, self).__init__(node)
+        self.jobs = []
+
+    def submit(self, fn, callback):
+        self.jobs.append((fn, callback))
+
+    def run(self):
+        jobs, self.jobs = self.jobs, []
+        for fn, callback in jobs:
+            callback(fn())
+
+
+class ApplierTests(utils.ComponentTestCase):
+
+    def setUp(self):
+        super(ApplierTests, self).setUp()
+        self.execute_fn = mock.Mock(name='execute_fn', side_effect=lambda state, input: (state + input, input))
+        self.rep = Replica(self.node, self.execute_fn, state='state', slot=2, decisions={},
+                           peers=['p1', 'F999'], applier_cls=DeferredApplier)
+
+    def tearDown(self):
+        self.assertNoMessages()
+
+    def test_commit_deferred(self):
+        """Committed requests are applied, and answered, by the applier while
+        the replica goes on committing"""
+        self.node.fake_message(Decision(slot=2, proposal=PROPOSAL2))
+        self.node.fake_message(Decision(slot=3, proposal=PROPOSAL3))
+        self.assertEqual(self.rep.slot, 4)
+        self.assertFalse(self.execute_fn.called)
+        # a retransmission meanwhile is neither proposed again nor answered yet
+        self.node.fake_message(Invoke(caller='test', client_id=222, input_value='two'))
+        self.network.tick(INVOKE_BATCH_WINDOW)
+        self.rep.applier.run()
+        self.assertEqual(self.rep.state, 'statetwotre')
+        self.assertMessage(['test'], Invoked(client_id=222, output='two'))
+        self.assertMessage(['test'], Invoked(client_id=333, output='tre'))
+
+    def test_duplicate_while_applying(self):
+        """A request decided again before it is applied is only applied once"""
+        self.node.fake_message(Decision(slot=2, proposal=PROPOSAL2))
+        self.node.fake_message(Decision(slot=3, proposal=PROPOSAL2))
+        self.rep.applier.run()
+        self.assertEqual(self.execute_fn.call_count, 1)
+        self.assertMessage(['test'], Invoked(client_id=222, output='two'))
+
+    @mock.patch('cluster.SNAPSHOT_INTERVAL', 2)
+    def test_snapshot_deferred(self):
+        """A snapshot holds the state and sessions once everything before it
+        is applied"""
+        self.node.fake_message(Decision(slot=2, proposal=PROPOSAL2))
+        self.node.fake_message(Decision(slot=3, proposal=PROPOSAL3))
+        self.assertEqual(self.rep.snapshot.slot, 2)
+        self.rep.applier.run()
+        self.assertEqual(self.rep.snapshot, Snapshot(4, 'statetwotre', {
+            ('test', 222): 'two', ('test', 333): 'tre'}))
+        self.assertMessage(['test'], Invoked(client_id=222, output='two'))
+        self.assertMessage(['test'], Invoked(client_id=333, output='tre'))
+        self.assertMessage(['p1', 'F999'], Executed(slot=4))
+
+    def test_threaded(self):
+        """ThreadedApplier runs jobs in order on its own thread, and their
+        callbacks on the network's"""
+        applier = ThreadedApplier(self.node)
+        results = []
+        for n in range(3):
+            applier.submit(lambda n=n: (n, threading.get_ident()), results.append)
+        applier.stop()
+        applier.thread.join()
+        self.assertEqual(results, [])
+        self.network.tick(0)
+        self.assertEqual([n for n, thread in results], [0, 1, 2])
+        self.assertNotEqual(results[0][1], threading.get_ident())
+
+    def test_threaded_error(self):
+        """An execute_fn that raises on a ThreadedApplier's thread raises on
+        the network's, as with Applier, and later slots are still applied"""
+        self.rep.stop()
+        self.execute_fn.side_effect = lambda state, input: (state + input, 1 // (input != 'two'))
+        rep = Replica(self.node, self.execute_fn, state='state', slot=2, decisions={},
+                      peers=['p1', 'F999'], applier_cls=ThreadedApplier)
+        self.node.fake_message(Decision(slot=2, proposal=PROPOSAL2))
+        self.node.fake_message(Decision(slot=3, proposal=PROPOSAL3))
+        rep.applier.stop()
+        rep.applier.thread.join()
+        self.assertRaises(ZeroDivisionError, self.network.tick, 0)
+        self.network.tick(0)
+        self.assertEqual(rep.state, 'statetre')
+        self.assertMessage(['test'], Invoked(client_id=333, output=1))
+
+    def test_partitioned(self):
+        """PartitionedApplier applies each key's requests in order, in
+        parallel with other keys, to the same state and outputs as in turn"""
+        inputs = [('set', 'a', 1), ('set', 'b', 2), ('get', 'a'), ('set', 'a', 3), ('get', 'b')]
+        expected = execute_in_order(key_value_state_machine, {'c': 0}, inputs)
+        for executor_cls in ThreadPoolExecutor, ProcessPoolExecutor:
+            with executor_cls(2) as executor:
+                applier = PartitionedApplier(self.node, executor)
+                self.assertEqual(applier.execute(key_value_state_machine, {'c': 0}, inputs),
+                                 expected)
+                applier.stop()
+        self.assertEqual(expected, ({'a': 3, 'b': 2, 'c': 0}, [1, 2, 1, 3, 2]))
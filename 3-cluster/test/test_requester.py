@@ -11,12 +11,13 @@ class Tests(utils.ComponentTestCase):
         super(Tests, self).setUp()
         self.callback = mock.Mock(name='callback')
         with mock.patch.object(Requester, 'client_ids') as client_ids:
-            client_ids.next.return_value = CLIENT_ID
+            client_ids.__next__.return_value = CLIENT_ID
             self.req = Requester(self.node, 10, self.callback)
         self.assertEqual(self.req.client_id, CLIENT_ID)
 
     def test_function(self):
-        """Requester should repeatedly send INVOKE until receiving a matching INVOKED"""
+        """Requester should repeatedly send INVOKE, backing off, until receiving
+        a matching INVOKED"""
         self.req.start()
         self.assertMessage(['F999'], Invoke(caller='F999', client_id=CLIENT_ID, input_value=10))
         self.network.tick(INVOKE_RETRANSMIT)
@@ -24,8 +25,55 @@ class Tests(utils.ComponentTestCase):
         # non-matching
         self.node.fake_message(Invoked(client_id=333, output=22))
         self.network.tick(INVOKE_RETRANSMIT)
+        self.assertNoMessages()
+        self.network.tick(INVOKE_RETRANSMIT)
         self.assertMessage(['F999'], Invoke(caller='F999', client_id=CLIENT_ID, input_value=10))
         self.failIf(self.callback.called)
         self.node.fake_message(Invoked(client_id=CLIENT_ID, output=20))
         self.callback.assert_called_with(20)
-        self.assertUnregistered()
+        self.assertEqual(self.node.client.outstanding, {})
+        self.network.tick(INVOKE_RETRANSMIT * 4)
+        self.assertNoMessages()
+        # the reply to a retransmitted request is not a round-trip sample
+        self.assertEqual(self.node.request_rtt.timeout(None), None)
+
+    def test_rtt_sample(self):
+        """An INVOKED for a request sent once is a round-trip sample, and later
+        requests retransmit after the timeout derived from it"""
+        self.req.start()
+        self.network.tick(0.1)
+        self.node.fake_message(Invoked(client_id=CLIENT_ID, output=20))
+        self.assertAlmostEqual(self.node.request_rtt.timeout(None), 0.3)
+        req = Requester(self.node, 11, self.callback)
+        req.start()
+        self.network.tick(0.3)
+        self.assertMessage(['F999'], Invoke(caller='F999', client_id=CLIENT_ID, input_value=10))
+        self.assertMessage(['F999'], Invoke(caller='F999', client_id=req.client_id, input_value=11))
+        self.assertMessage(['F999'], Invoke(caller='F999', client_id=req.client_id, input_value=11))
+
+    def test_shared_client(self):
+        """Every request from a node goes through the one Client role, which
+        passes each INVOKED to its own request's callback"""
+        callbacks = [mock.Mock(name='callback%d' % n) for n in range(3)]
+        reqs = [Requester(self.node, n, callbacks[n]) for n in range(3)]
+        for req in reqs:
+            req.start()
+            self.assertMessage(['F999'], Invoke(caller='F999', client_id=req.client_id,
+                                                input_value=req.n))
+        self.assertEqual(self.node.roles, [self.node.client])
+        self.node.fake_message(Invoked(client_id=reqs[1].client_id, output=11))
+        callbacks[1].assert_called_once_with(11)
+        self.assertFalse(callbacks[0].called or callbacks[2].called)
+        self.assertEqual(sorted(self.node.client.outstanding),
+                         [reqs[0].client_id, reqs[2].client_id])
+        for req in reqs[0], reqs[2]:
+            self.node.fake_message(Invoked(client_id=req.client_id, output=0))
+
+    def test_read_only(self):
+        """A read-only Requester sends READ rather than INVOKE"""
+        req = Requester(self.node, ('get', 'k'), self.callback, read_only=True)
+        req.start()
+        self.assertMessage(['F999'], Read(caller='F999', client_id=req.client_id,
+                                          input_value=('get', 'k')))
+        self.node.fake_message(Invoked(client_id=req.client_id, output=20))
+        self.callback.assert_called_with(20)
@@ -0,0 +1,27 @@
+from roundtrip import *
+import unittest
+
+
+class RoundTripTests(unittest.TestCase):
+
+    def test_round_trip_times(self):
+        """Retransmit timeouts follow the smoothed round-trip time and its
+        variation, for the slowest of the peers waited on"""
+        rtt = RoundTripTimes()
+        self.assertEqual(rtt.timeout(['A'], 1.0), 1.0)
+        rtt.sample('A', 0.1)
+        self.assertAlmostEqual(rtt.timeout(['A'], 1.0), 0.1 + 4 * 0.05)
+        rtt.sample('A', 0.1)
+        self.assertAlmostEqual(rtt.timeout(['A'], 1.0), 0.1 + 4 * 0.0375)
+        rtt.sample('B', 0.4)
+        self.assertAlmostEqual(rtt.timeout(['A', 'B', 'C'], 1.0), 0.4 + 4 * 0.2)
+        rtt.sample('C', 0)
+        self.assertEqual(rtt.timeout(['C'], 1.0), RTO_MIN)
+        rtt.sample('B', 100)
+        self.assertEqual(rtt.timeout(['B'], 1.0), RTO_MAX)
+
+    def test_backoff(self):
+        """Retransmit timeouts double with each retransmission, up to RTO_MAX,
+        however many there have been"""
+        self.assertEqual([backoff(0.5, n) for n in range(6)], [0.5, 1, 2, 4, 8, RTO_MAX])
+        self.assertEqual(backoff(0.5, 5000), RTO_MAX)
@@ -11,8 +11,9 @@ class Tests(utils.ComponentTestCase):
 
     def setUp(self):
         super(Tests, self).setUp()
-        self.sct = Scout(self.node, Ballot(10, 10),
-                         peers=['p1', 'p2', 'p3'])
+        with mock.patch('cluster.PRE_VOTE', False):
+            self.sct = Scout(self.node, Ballot(10, 10),
+                             peers=['p1', 'p2', 'p3'], slot=1)
 
     @mock.patch.object(Scout, 'send_prepare')
     def test_start(self, send_prepare):
@@ -23,16 +24,16 @@ class Tests(utils.ComponentTestCase):
     def test_send_prepare(self):
         """send_prepare does what it says, repeatedly"""
         self.sct.send_prepare()
-        self.assertMessage(['p1', 'p2', 'p3'], Prepare(ballot_num=Ballot(10, 10)))
+        self.assertMessage(['p1', 'p2', 'p3'], Prepare(ballot_num=Ballot(10, 10), slot=1))
         self.assertNoMessages()
         self.network.tick(PREPARE_RETRANSMIT)
-        self.assertMessage(['p1', 'p2', 'p3'], Prepare(ballot_num=Ballot(10, 10)))
+        self.assertMessage(['p1', 'p2', 'p3'], Prepare(ballot_num=Ballot(10, 10), slot=1))
 
     def test_PROMISE(self):
         """After a quorum of matching PROMISEs, the scout finishes and sends an ADOPTED
         containing only the highest-numbered accepted proposals"""
         self.sct.send_prepare()
-        self.assertMessage(['p1', 'p2', 'p3'], Prepare(ballot_num=Ballot(10, 10)))
+        self.assertMessage(['p1', 'p2', 'p3'], Prepare(ballot_num=Ballot(10, 10), slot=1))
         for acceptor in 'p1', 'p3':
             accepted_proposals = {
                 'p1': {1: (Ballot(5, 5), PROPOSAL1), 2: (Ballot(6, 6), PROPOSAL2)},
@@ -45,16 +46,89 @@ class Tests(utils.ComponentTestCase):
                                              accepted_proposals={1: PROPOSAL1, 2: PROPOSAL2}))
         self.assertUnregistered()
 
+    @mock.patch('cluster.PHASE1_QUORUM', 3)
+    @mock.patch('cluster.PHASE2_QUORUM', 1)
+    def test_phase1_quorum(self):
+        """The scout is adopted once PHASE1_QUORUM acceptors promise"""
+        self.sct.stop()
+        Scout(self.node, Ballot(10, 10), peers=['p1', 'p2', 'p3'], slot=1)
+        for acceptor in 'p1', 'p2', 'p3':
+            self.assertNoMessages()
+            self.node.fake_message(Promise(ballot_num=Ballot(10, 10), accepted_proposals={}),
+                                   sender=acceptor)
+        self.assertMessage(['F999'], Adopted(ballot_num=Ballot(10, 10), accepted_proposals={}))
+
+    def test_pre_vote(self):
+        """With PRE_VOTE, the scout first asks whether a quorum would promise,
+        and only then sends PREPARE"""
+        self.sct.stop()
+        sct = Scout(self.node, Ballot(10, 10), peers=['p1', 'p2', 'p3'], slot=1)
+        sct.start()
+        self.assertMessage(['p1', 'p2', 'p3'], PreVote(ballot_num=Ballot(10, 10)))
+        self.network.tick(PREPARE_RETRANSMIT)
+        self.assertMessage(['p1', 'p2', 'p3'], PreVote(ballot_num=Ballot(10, 10)))
+        for acceptor in 'p1', 'p3':
+            self.node.fake_message(PreVoted(requested=Ballot(10, 10), ballot_num=Ballot(9, 9),
+                                            granted=True), sender=acceptor)
+        self.assertMessage(['p1', 'p2', 'p3'], Prepare(ballot_num=Ballot(10, 10), slot=1))
+        self.assertEqual(sct.acceptors, set())
+        self.node.fake_message(PreVoted(requested=Ballot(10, 10), ballot_num=Ballot(9, 9),
+                                        granted=True), sender='p2')
+        self.assertNoMessages()
+        sct.stop()
+
+    def test_pre_vote_refused(self):
+        """Once too many acceptors refuse the pre-vote for the rest to make a
+        quorum, the scout is preempted before it raises any ballot"""
+        self.sct.stop()
+        sct = Scout(self.node, Ballot(10, 10), peers=['p1', 'p2', 'p3'], slot=1)
+        sct.start()
+        self.assertMessage(['p1', 'p2', 'p3'], PreVote(ballot_num=Ballot(10, 10)))
+        self.node.fake_message(PreVoted(requested=Ballot(10, 10), ballot_num=Ballot(9, 'p1'),
+                                        granted=False), sender='p2')
+        self.assertNoMessages()
+        self.node.fake_message(PreVoted(requested=Ballot(10, 10), ballot_num=Ballot(11, 'p1'),
+                                        granted=False), sender='p3')
+        self.assertMessage(['F999'], Preempted(slots=None, preempted_by=Ballot(11, 'p1')))
+        self.assertUnregistered()
+
+    def test_pre_vote_quorum_despite_refusal(self):
+        """A quorum of grants outweighs a refusal"""
+        self.sct.stop()
+        sct = Scout(self.node, Ballot(10, 10), peers=['p1', 'p2', 'p3'], slot=1)
+        sct.start()
+        self.assertMessage(['p1', 'p2', 'p3'], PreVote(ballot_num=Ballot(10, 10)))
+        self.node.fake_message(PreVoted(requested=Ballot(10, 10), ballot_num=Ballot(9, 'p1'),
+                                        granted=False), sender='p2')
+        for acceptor in 'p1', 'p3':
+            self.node.fake_message(PreVoted(requested=Ballot(10, 10), ballot_num=Ballot(9, 9),
+                                            granted=True), sender=acceptor)
+        self.assertMessage(['p1', 'p2', 'p3'], Prepare(ballot_num=Ballot(10, 10), slot=1))
+        sct.stop()
+
+    def test_pre_vote_stale(self):
+        """Replies to an earlier scout's pre-vote count neither way"""
+        self.sct.stop()
+        sct = Scout(self.node, Ballot(10, 10), peers=['p1', 'p2', 'p3'], slot=1)
+        sct.start()
+        self.assertMessage(['p1', 'p2', 'p3'], PreVote(ballot_num=Ballot(10, 10)))
+        for acceptor in 'p1', 'p2', 'p3':
+            self.node.fake_message(PreVoted(requested=Ballot(8, 10), ballot_num=Ballot(9, 'p1'),
+                                            granted=acceptor == 'p1'), sender=acceptor)
+        self.assertNoMessages()
+        self.assertEqual((sct.acceptors, sct.refusals), (set(), {}))
+        sct.stop()
+
     def test_PROMISE_preempted(self):
         """PROMISEs with different ballot_nums mean preemption"""
         self.sct.send_prepare()
-        self.assertMessage(['p1', 'p2', 'p3'], Prepare(ballot_num=Ballot(10, 10)))
+        self.assertMessage(['p1', 'p2', 'p3'], Prepare(ballot_num=Ballot(10, 10), slot=1))
         accepted_proposals = {}
         self.verifyAcceptedProposals(accepted_proposals)
         self.node.fake_message(Promise(
                     ballot_num=Ballot(99, 99),
                     accepted_proposals=accepted_proposals), sender='p2')
-        self.assertMessage(['F999'], Preempted(slot=None, preempted_by=Ballot(99, 99)))
+        self.assertMessage(['F999'], Preempted(slots=None, preempted_by=Ballot(99, 99)))
 
     def test_update_accepted_empty(self):
         """update_accepted does nothing with an empty set of accepted proposals"""
@@ -87,3 +161,20 @@ class Tests(utils.ComponentTestCase):
             9: (Ballot(9, 99), PROPOSAL2),
             10: (Ballot(10, 99), PROPOSAL1),
         })
+
+    @mock.patch('cluster.THRIFTY', True)
+    @mock.patch('cluster.PRE_VOTE', False)
+    def test_send_prepare_thrifty(self):
+        """In THRIFTY mode, PREPARE goes to the fastest quorum, and to every
+        peer that hasn't promised once it has to be retransmitted"""
+        sct = Scout(self.node, Ballot(10, 10), peers=['p1', 'p2', 'p3', 'p4'], slot=1)
+        for peer, rtt in ('p1', 0.3), ('p2', 0.1), ('p3', 0.2):
+            self.node.rtt.sample(peer, rtt)
+        sct.send_prepare()
+        self.assertMessage(['p2', 'p3', 'p4'], Prepare(ballot_num=Ballot(10, 10), slot=1))
+        sct.do_Promise(sender='p2', ballot_num=Ballot(10, 10), accepted_proposals={})
+        self.network.tick(PREPARE_RETRANSMIT)
+        self.assertMessage(['p1', 'p3', 'p4'], Prepare(ballot_num=Ballot(10, 10), slot=1))
+        # the peers that didn't answer in time are tried last from now on
+        self.assertEqual(self.node.rtt.fastest(sct.peers, 2), ['p2', 'p1'])
+        sct.stop()
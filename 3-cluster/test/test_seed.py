@@ -23,16 +23,17 @@ class Tests(utils.ComponentTestCase):
         self.assertNoMessages()  # no quorum
         self.node.fake_message(Join(), sender='p3')
         self.assertMessage(['p1', 'p3'], Welcome(
-                           state='state', slot=1, decisions={}))
+                           state='state', slot=1, decisions={}, sessions={}))
 
         self.network.tick(JOIN_RETRANSMIT)
         self.node.fake_message(Join(), sender='p2')
         self.assertMessage(['p1', 'p2', 'p3'], Welcome(
-                           state='state', slot=1, decisions={}))
+                           state='state', slot=1, decisions={}, sessions={}))
 
         self.network.tick(JOIN_RETRANSMIT * 2)
         self.assertNoMessages()
         self.assertUnregistered()
         self.Bootstrap.assert_called_with(self.node, peers=['p1', 'p2', 'p3'],
-                                          execute_fn=self.execute_fn)
+                                          execute_fn=self.execute_fn, applier_cls=Applier,
+                                          wal=None, leader=None)
         self.Bootstrap().start.assert_called_with()
@@ -0,0 +1,69 @@
+from cluster import *
+from sharding import Router, group_address
+from run import key_value_state_machine
+from . import fake_network
+from unittest import mock
+import unittest
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.network = fake_network.FakeNetwork()
+        self.Member = mock.Mock(name='Member', side_effect=lambda *args, **kwargs: mock.Mock())
+        self.router = Router(key_value_state_machine, self.network, ['p1', 'p2'], 'p1',
+                             split_keys=['p', 'h'], seed={}, member_cls=self.Member)
+
+    def test_groups(self):
+        """Router builds a Member for each key range, on its own addresses"""
+        self.assertEqual(self.Member.call_args_list, [
+            mock.call(key_value_state_machine, self.network, ['p1/%d' % g, 'p2/%d' % g],
+                      seed={}, address='p1/%d' % g, leader='p%d/%d' % (g % 2 + 1, g))
+            for g in range(3)])
+
+    def test_group(self):
+        """Each key belongs to the range between the split keys around it"""
+        self.assertEqual([self.router.group(('get', k)) for k in 'agho' 'pz'],
+                         [0, 0, 1, 1, 2, 2])
+
+    def test_invoke(self):
+        """Requests go to the Member of their key's group"""
+        self.router.invoke_async(('set', 'k', 1), read_only=False)
+        self.router.members[1].invoke_async.assert_called_once_with(('set', 'k', 1),
+                                                                    read_only=False)
+        self.assertFalse(self.router.members[0].invoke_async.called)
+        self.assertFalse(self.router.members[2].invoke_async.called)
+
+    def test_start(self):
+        """Router.start starts every group, and runs the network once"""
+        self.router.start()
+        self.router.thread.join()
+        for member in self.router.members:
+            member.startup_role.start.assert_called_once_with()
+        self.assertTrue(self.network.ran)
+
+
+class IntegrationTests(unittest.TestCase):
+
+    def test_groups(self):
+        """Groups sharing nodes keep separate logs and state"""
+        network = Network(1234)
+        peers = ['N0', 'N1', 'N2']
+        routers = [Router(key_value_state_machine, network, peers, p, split_keys=['m'],
+                          seed={} if p == 'N0' else None)
+                   for p in peers]
+        for router in routers:
+            for member in router.members:
+                member.startup_role.start()
+        futures = [routers[1].invoke_async(('set', k, i)) for i, k in enumerate('az')]
+        network.set_timer(None, 10, network.stop)
+        network.run()
+        self.assertEqual([f.result() for f in futures], [0, 1])
+        states = [[role.state for r in routers for role in r.members[g].node.roles
+                   if isinstance(role, Replica)] for g in range(2)]
+        self.assertIn({'a': 0}, states[0])
+        self.assertIn({'z': 1}, states[1])
+        self.assertEqual(group_address('N1', 1), routers[1].members[1].node.address)
+        leaders = [set(role.latest_leader for r in routers for role in r.members[g].node.roles
+                       if isinstance(role, Replica)) for g in range(2)]
+        self.assertEqual(leaders, [{'N0/0'}, {'N1/1'}])
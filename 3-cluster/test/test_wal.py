@@ -0,0 +1,123 @@
+from cluster import *
+from wal import WriteAheadLog
+from . import utils
+from unittest import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+PROPOSAL = Proposal('cli', 123, 'INC')
+
+
+class WriteAheadLogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'wal')
+        self.wal = WriteAheadLog(self.path)
+
+    def tearDown(self):
+        self.wal.close()
+        shutil.rmtree(self.dir)
+
+    def test_replay(self):
+        """Synced records are replayed in order"""
+        self.wal.append(('ballot', Ballot(1, 'N1')))
+        self.wal.append(('accept', 3, Ballot(1, 'N1'), PROPOSAL))
+        self.wal.sync()
+        self.assertEqual(list(WriteAheadLog(self.path).replay()), [
+            ('ballot', Ballot(1, 'N1')), ('accept', 3, Ballot(1, 'N1'), PROPOSAL)])
+
+    def test_torn_record(self):
+        """Replay stops at a partially written final record"""
+        self.wal.append(('ballot', Ballot(1, 'N1')))
+        self.wal.append(('ballot', Ballot(2, 'N1')))
+        self.wal.sync()
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+        self.assertEqual(list(self.wal.replay()), [('ballot', Ballot(1, 'N1'))])
+
+    def test_append_after_torn_record(self):
+        """Reopening a log cuts off a torn final record, so records appended
+        after a restart are replayed"""
+        self.wal.append(('ballot', Ballot(1, 'N1')))
+        self.wal.append(('ballot', Ballot(2, 'N1')))
+        self.wal.sync()
+        self.wal.close()
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+        self.wal = WriteAheadLog(self.path)
+        self.wal.append(('ballot', Ballot(3, 'N1')))
+        self.wal.sync()
+        self.assertEqual(list(WriteAheadLog(self.path).replay()), [
+            ('ballot', Ballot(1, 'N1')), ('ballot', Ballot(3, 'N1'))])
+
+    def test_checkpoint(self):
+        """A checkpoint replaces the log, and later appends follow it"""
+        self.wal.append(('ballot', Ballot(1, 'N1')))
+        self.wal.checkpoint([('ballot', Ballot(2, 'N1'))])
+        self.wal.append(('accept', 3, Ballot(2, 'N1'), freeze(PROPOSAL)))
+        self.wal.sync()
+        self.assertEqual(list(self.wal.replay()), [
+            ('ballot', Ballot(2, 'N1')), ('accept', 3, Ballot(2, 'N1'), PROPOSAL)])
+
+
+class DurableAcceptorTests(utils.ComponentTestCase):
+
+    def setUp(self):
+        super(DurableAcceptorTests, self).setUp()
+        self.wal = mock.Mock(name='wal')
+        self.wal.replay.return_value = [
+            ('ballot', Ballot(5, 5)),
+            ('accept', 32, Ballot(5, 5), PROPOSAL),
+            ('ballot', Ballot(7, 7)),
+        ]
+        self.ac = Acceptor(self.node, wal=self.wal)
+
+    def test_restart(self):
+        """An acceptor restores its promises and accepted proposals from the log"""
+        self.assertEqual(self.ac.ballot_num, Ballot(7, 7))
+        self.assertEqual(self.ac.accepted_proposals, {32: (Ballot(5, 5), PROPOSAL)})
+
+    def test_group_commit(self):
+        """ACCEPTED replies wait for a single fsync covering all their appends"""
+        for slot in 33, 34:
+            self.node.fake_message(Accept(ballot_num=Ballot(8, 8),
+                                          proposals={slot: PROPOSAL}), sender='CMD')
+        self.assertEqual(self.wal.append.call_args_list, [
+            mock.call(('ballot', Ballot(8, 8))),
+            mock.call(('accept', 33, Ballot(8, 8), PROPOSAL)),
+            mock.call(('accept', 34, Ballot(8, 8), PROPOSAL)),
+        ])
+        self.assertNoMessages()
+        self.network.tick(WAL_SYNC_DELAY)
+        self.wal.sync.assert_called_once_with()
+        self.assertMessage(['CMD'], Accepted(slots=(33,), ballot_num=Ballot(8, 8)))
+        self.assertMessage(['CMD'], Accepted(slots=(34,), ballot_num=Ballot(8, 8)))
+
+    def test_restart_lease(self):
+        """After a restart, the acceptor makes no new promise until any lease
+        it may have granted has run out"""
+        self.node.fake_message(Prepare(ballot_num=Ballot(9, 9), slot=0), sender='SC')
+        self.assertEqual(self.ac.ballot_num, Ballot(7, 7))
+        self.network.tick(WAL_SYNC_DELAY)
+        self.assertMessage(['SC'], Promise(ballot_num=Ballot(7, 7),
+                                           accepted_proposals={32: (Ballot(5, 5), PROPOSAL)}))
+
+    def test_prepare_logged(self):
+        """A new promise is logged before the PROMISE goes out"""
+        self.network.tick(LEASE_DURATION)
+        self.node.fake_message(Prepare(ballot_num=Ballot(9, 9), slot=0), sender='SC')
+        self.wal.append.assert_called_once_with(('ballot', Ballot(9, 9)))
+        self.assertMessage(['F999'], Accepting(leader='SC'))
+        self.network.tick(WAL_SYNC_DELAY)
+        self.assertMessage(['SC'], Promise(ballot_num=Ballot(9, 9),
+                                           accepted_proposals={32: (Ballot(5, 5), PROPOSAL)}))
+
+    def test_compact(self):
+        """Compaction rewrites the log with just the remaining state"""
+        self.ac.accepted_proposals[33] = (Ballot(7, 7), PROPOSAL)
+        self.node.fake_message(Compact(slot=33))
+        self.wal.checkpoint.assert_called_once_with([
+            ('ballot', Ballot(7, 7)), ('accept', 33, Ballot(7, 7), PROPOSAL)])
@@ -0,0 +1,67 @@
+import os
+import pickle
+import struct
+
+HEADER = struct.Struct('>I')  # length prefix of each record
+
+
+class WriteAheadLog(object):
+    """An append-only file of pickled records, for Acceptor(node, wal=...).
+
+    append() only buffers a record; sync() makes everything appended so far
+    durable with a single fsync, so many appends share the cost of one disk
+    sync (group commit)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        # a crash can leave a torn record at the end; cut it off, or the
+        # records appended after it would be hidden behind it from replay
+        for record in self.replay():
+            pass
+        if os.path.getsize(path) > self.end:
+            self.file.truncate(self.end)
+
+    def append(self, record):
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        self.file.write(HEADER.pack(len(data)) + data)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def replay(self):
+        """Yield the records in the log, stopping at a torn final record;
+        self.end is left at the end of the last whole one"""
+        self.end = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                length = HEADER.unpack(header)[0]
+                data = f.read(length)
+                if len(data) < length:
+                    return  # crashed part-way through writing this record
+                try:
+                    record = pickle.loads(data)
+                except Exception:
+                    return
+                self.end = f.tell()
+                yield record
+
+    def checkpoint(self, records):
+        """Atomically replace the whole log with just these records"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as tmp:
+            for record in records:
+                data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+                tmp.write(HEADER.pack(len(data)) + data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, 'ab')
+
+    def close(self):
+        self.file.close()